@@ -1,69 +1,133 @@
+import itertools
+import json
 import os
-import tempfile
+import shutil
+import uuid
 import logging
-from flask import Flask, request, jsonify, render_template
-from yt_dlp import YoutubeDL
-from utils.ffmpeg_downloader import get_ffmpeg  # Import the FFmpeg utility
-import time
+from flask import Flask, Response, request, jsonify, render_template, send_file, send_from_directory, url_for
+from utils.ffmpeg_downloader import FFmpegBootstrap
+from utils.config import (DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE, DOWNLOAD_LOCATION, JOB_TTL, PROGRESS_STREAM_RATE,
+                          INFO_CACHE_SIZE, INFO_CACHE_TTL, INFO_CACHE_DB, STORE_MAX_BYTES,
+                          FILE_MAX_AGE, USE_X_SENDFILE, FRAGMENT_CONCURRENCY, MAX_FRAGMENT_CONCURRENCY,
+                          MAX_CONNECTIONS, HTTP_CHUNK_SIZE, DOWNLOAD_BUFFER_SIZE, BATCH_WORKERS,
+                          BATCH_MAX_ENTRIES, MAX_BANDWIDTH, FFMPEG_WORKERS, PRIORITY_WEIGHTS,
+                          FFMPEG_LOCATION, FFMPEG_URL, FFMPEG_SHA256, STATE_URL, ROLE, DISK_QUOTA,
+                          DISK_MIN_FREE, DISK_HIGH_WATER, DISK_LOW_WATER, DISK_UNKNOWN_SIZE, DISK_WAIT,
+                          YDL_POOL_SIZE, YDL_MAX_USES, THUMBNAIL_WIDTH, THUMBNAIL_CACHE_BYTES, THUMBNAIL_MAX_AGE,
+                          FORMATS_MAX_AGE)
+from utils.concurrency import ConnectionBudget, map_unordered
+from utils.disk_quota import DiskQuota, InsufficientSpaceError, estimate_peak_bytes
+from utils.download_store import DownloadStore, store_key
+from utils.format_index import FormatIndex
+from utils.http_cache import cacheable
+from utils.info_cache import InfoCache, video_key
+from utils.job_journal import JobJournal
+from utils.job_queue import JobQueue, QueueFullError, SharedJobQueue
+from utils.metrics import ByteMeter, MetricsRegistry, PhaseTimer
+from utils.postprocess import plan_postprocessors
+from utils.progress import ProgressHook, ProgressRegistry, SharedProgressRegistry, stream_progress
+from utils.scheduler import BandwidthScheduler, PostprocessPool
+from utils.sections import requested_section, resolve_section, section_fraction, section_options
+from utils.state import open_backend
+from utils.streaming import content_disposition, open_stream
+from utils.thumbnails import ThumbnailCache
+from utils.ytdl import YoutubeDLPool, downloaded_path, ffmpeg_context, playlist_entry_urls, resolve_format, selectable
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Let a fronting nginx/Apache send files when it is configured for X-Sendfile
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
 
 # Get the absolute path of the project directory (where app.py is located)
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Create downloads directory path
-DOWNLOAD_DIR = os.path.join(PROJECT_DIR, 'downloads')
-
-# Create the downloads directory if it doesn't exist
-if not os.path.exists(DOWNLOAD_DIR):
-    os.makedirs(DOWNLOAD_DIR)
-
-# Setup portable FFmpeg
-FFMPEG_PATH = get_ffmpeg()
-
-# Add this class at the top of your file, after the imports
-class ProgressHook:
-    def __init__(self):
-        self.progress = {
-            'status': 'idle',
-            'downloaded_bytes': 0,
-            'total_bytes': 0,
-            'speed': 0,
-            'eta': 0,
-            'percentage': 0,
-            'filename': ''
-        }
-
-    def __call__(self, d):
-        logger.info(f"Progress update: {d['status']}")
-        
-        if d['status'] == 'downloading':
-            self.progress['status'] = 'downloading'
-            self.progress['downloaded_bytes'] = d.get('downloaded_bytes', 0)
-            self.progress['total_bytes'] = d.get('total_bytes', 0)
-            self.progress['speed'] = d.get('speed', 0)
-            self.progress['eta'] = d.get('eta', 0)
-            self.progress['filename'] = d.get('filename', '')
-            
-            if d.get('total_bytes'):
-                self.progress['percentage'] = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                logger.info(f"Download progress: {self.progress['percentage']:.2f}%")
-            elif d.get('total_bytes_estimate'):
-                self.progress['percentage'] = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-                logger.info(f"Download progress (estimate): {self.progress['percentage']:.2f}%")
-            else:
-                logger.info(f"Download progress: unknown (no total bytes)")
-        
-        elif d['status'] == 'finished':
-            logger.info("Download finished!")
-            self.progress['status'] = 'finished'
-            self.progress['percentage'] = 100
-
-# Create a global progress hook instance that persists between requests
-progress_tracker = ProgressHook()
+DOWNLOAD_DIR = DOWNLOAD_LOCATION or os.path.join(PROJECT_DIR, 'downloads')
+
+# Create the downloads directory if it doesn't exist; several worker processes may race here
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+
+# Jobs, progress and cached metadata live in this process unless a shared backend is configured,
+# in which case several web and download processes can serve the same jobs
+state_backend = open_backend(STATE_URL)
+if state_backend is None and ROLE != 'all':
+    raise RuntimeError(f"YTB_ROLE={ROLE} needs a shared YTB_STATE_URL (sqlite:// or redis://)")
+
+# Find FFmpeg without blocking startup; if it has to be downloaded, that happens in the background
+ffmpeg_bootstrap = FFmpegBootstrap(os.path.join(PROJECT_DIR, 'ffmpeg'), FFMPEG_LOCATION,
+                                   FFMPEG_URL, FFMPEG_SHA256).start()
+
+# Warm yt-dlp instances, so requests skip its setup and reuse open connections
+ydl_pool = YoutubeDLPool(max_idle=YDL_POOL_SIZE, max_uses=YDL_MAX_USES)
+
+# Fragment connections shared by all running downloads
+connection_budget = ConnectionBudget(MAX_CONNECTIONS, MAX_FRAGMENT_CONCURRENCY)
+
+# Bandwidth split between running downloads by priority
+bandwidth_scheduler = BandwidthScheduler(MAX_BANDWIDTH, PRIORITY_WEIGHTS)
+
+# ffmpeg postprocessing runs on a bounded number of slots so merges cannot swamp the CPU
+postprocess_pool = PostprocessPool(FFMPEG_WORKERS)
+
+# Extracted metadata shared by /api/formats and /api/download
+info_cache = InfoCache(max_entries=INFO_CACHE_SIZE, ttl=INFO_CACHE_TTL, db_path=INFO_CACHE_DB,
+                       shared=state_backend)
+
+# Finished downloads indexed by what produced them, so repeats are served instantly
+download_store = DownloadStore(os.path.join(DOWNLOAD_DIR, '.store.sqlite3'), max_bytes=STORE_MAX_BYTES,
+                               min_idle=JOB_TTL)
+
+# Jobs reserve their estimated disk use before downloading; old downloads are reaped to make room.
+# Files stay at least as long as their job can be looked up, so clients can still fetch them
+disk_quota = DiskQuota(DOWNLOAD_DIR, download_store, max_bytes=DISK_QUOTA, min_free=DISK_MIN_FREE,
+                       high_water=DISK_HIGH_WATER / 100, low_water=DISK_LOW_WATER / 100, min_idle=JOB_TTL)
+
+# Downscaled thumbnails served by /api/thumbnail, fetched in the background as soon as a video is extracted
+thumbnail_cache = ThumbnailCache(os.path.join(DOWNLOAD_DIR, '.thumbnails'), width=THUMBNAIL_WIDTH,
+                                 max_bytes=THUMBNAIL_CACHE_BYTES).start()
+
+# Jobs survive restarts through this journal
+job_journal = JobJournal(os.path.join(DOWNLOAD_DIR, '.jobs.sqlite3'), ttl=JOB_TTL, owner='app')
+
+# Progress of each download job, keyed by job ID
+if state_backend is None:
+    progress_registry = ProgressRegistry(ttl=JOB_TTL)
+else:
+    progress_registry = SharedProgressRegistry(state_backend, ttl=JOB_TTL)
+
+# Format used when a request does not pick one
+DEFAULT_FORMAT = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+
+# Downloads run on a bounded pool of background workers instead of inside the request
+if state_backend is None:
+    download_queue = JobQueue(workers=DOWNLOAD_WORKERS, max_queued=DOWNLOAD_QUEUE_SIZE, name='download',
+                              ttl=JOB_TTL, weights=PRIORITY_WEIGHTS)
+else:
+    download_queue = SharedJobQueue(state_backend, workers=DOWNLOAD_WORKERS, max_queued=DOWNLOAD_QUEUE_SIZE,
+                                    name='download', ttl=JOB_TTL, weights=PRIORITY_WEIGHTS)
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+extract_seconds = metrics.histogram('extract_info_seconds', 'Time spent extracting metadata on info cache misses')
+job_phase_seconds = metrics.histogram('job_phase_seconds', 'Time download jobs spend in each phase', labels=('phase',))
+download_throughput = metrics.histogram('download_throughput_bytes_per_second', 'Average transfer rate of each download',
+                                        buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6))
+downloaded_bytes = metrics.counter('downloaded_bytes_total', 'Bytes received by download jobs')
+jobs_total = metrics.counter('jobs_total', 'Finished download jobs by outcome', labels=('outcome',))
+metrics.gauge('jobs', 'Download jobs by state', label='state',
+              func=lambda: {state: download_queue.stats()[state] for state in ('queued', 'running')})
+metrics.gauge('info_cache_hit_ratio', 'Share of metadata lookups served from the info cache',
+              func=lambda: info_cache.stats()['hit_ratio'])
+metrics.gauge('download_store_hit_ratio', 'Share of download jobs served from the download store',
+              func=lambda: download_store.stats()['hit_ratio'])
+metrics.gauge('fragment_connections_in_use', 'Fragment connections held by running downloads',
+              func=lambda: connection_budget.stats()['in_use'])
+metrics.gauge('disk_used_bytes', 'Bytes on disk under the download directory',
+              func=lambda: disk_quota.stats()['used_bytes'])
+metrics.gauge('disk_reserved_bytes', 'Bytes reserved by running downloads',
+              func=lambda: disk_quota.stats()['reserved_bytes'])
 
 @app.route('/')
 def index():
@@ -79,209 +143,384 @@ def format_size(bytes):
         bytes /= 1024
     return f"{bytes:.1f} TB"
 
-@app.route('/api/formats', methods=['POST'])
+def _extract_info(url):
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        # Metadata extraction never waits for an FFmpeg download
+        'ffmpeg_location': ffmpeg_bootstrap.location(wait=False),
+    }
+    with extract_seconds.time(), ydl_pool.checkout(ydl_opts) as ydl:
+        # Sanitized so the dict can be stored on disk and fed back to process_ie_result
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    # The page shows the thumbnail next, so start fetching it now
+    thumbnail_cache.prefetch(info)
+    return info
+
+def extract_info(url):
+    """Return video metadata, reusing a cached extraction when possible"""
+    return info_cache.get_or_extract(url, _extract_info)
+
+@app.route('/api/formats', methods=['GET', 'POST'])
 def get_formats():
     try:
-        data = request.get_json()
+        if request.method == 'GET':
+            # Browsers cache GET responses and revalidate them with If-None-Match
+            data = request.args.to_dict()
+            if len(request.args.getlist('chapters')) > 1:
+                data['chapters'] = request.args.getlist('chapters')
+        else:
+            data = request.get_json()
         if not data or 'url' not in data:
             return jsonify({'error': 'URL is required'}), 400
 
         url = data['url']
+        section = requested_section(data)
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'ffmpeg_location': FFMPEG_PATH,  # Add FFmpeg location
+        info = extract_info(url)
+        # Cached metadata may come from another process or an earlier run, so note its thumbnail here too
+        thumbnail_id = thumbnail_cache.remember(info)
+
+        response_data = {
+            'title': info.get('title', 'Unknown Title'),
+            'duration': info.get('duration', 0),
+            'thumbnail': url_for('get_thumbnail', video_id=thumbnail_id) if thumbnail_id else '',
+            'chapters': [{key: chapter.get(key) for key in ('title', 'start_time', 'end_time')}
+                         for chapter in info.get('chapters') or ()],
+            'formats': []
         }
+
+        # Sizes are scaled to the requested part of the video
+        fraction = 1.0
+        if section:
+            start, end = resolve_section(info, section)
+            fraction = section_fraction(info, start, end)
+            response_data['section'] = {'start': start, 'end': end}
         
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            response_data = {
-                'title': info.get('title', 'Unknown Title'),
-                'duration': info.get('duration', 0),
-                'thumbnail': info.get('thumbnail', ''),
-                'formats': []
-            }
-            
-            # Add best quality option
-            response_data['formats'].append({
-                'format_id': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                'resolution': 'Best Quality',
-                'ext': 'mp4',
-                'filesize': 'Automatic',
-                'height': 9999  # For sorting
-            })
-            
-            # Get all video formats
-            all_formats = []
-            for f in info.get('formats', []):
-                # Include formats with video codec
-                if f.get('vcodec', 'none') != 'none':
-                    height = f.get('height', 0)
-                    if height:  # Only include formats with height information
-                        all_formats.append({
-                            'format_id': f['format_id'],
-                            'resolution': f"{height}p",
-                            'ext': f.get('ext', 'mp4'),
-                            'filesize': format_size(f.get('filesize', 0)),
-                            'height': height
-                        })
-            
-            # Sort by height (resolution) in descending order
-            all_formats = sorted(all_formats, key=lambda x: x['height'], reverse=True)
-            
-            # Target resolutions we want to show
-            target_resolutions = [1080, 720, 360, 144]
+        # Add best quality option
+        response_data['formats'].append({
+            'format_id': DEFAULT_FORMAT,
+            'resolution': 'Best Quality',
+            'ext': 'mp4',
+            'filesize': 'Automatic',
+            'height': 9999  # For sorting
+        })
+        
+        # Index formats once; each target below is a bisect instead of a full scan
+        index = FormatIndex(info)
+        
+        # Target resolutions we want to show
+        target_resolutions = [1080, 720, 360, 144]
+        
+        # For each target resolution, find the closest available format
+        for target in target_resolutions:
+            closest_format = None
+            fmt = index.nearest(target)
+            if fmt:
+                closest_format = {
+                    'format_id': fmt['format_id'],
+                    'resolution': f"{fmt['height']}p",
+                    'ext': fmt.get('ext', 'mp4'),
+                    'filesize': format_size(index.estimate_size(fmt) * fraction),
+                    'height': fmt['height']
+                }
             
-            # For each target resolution, find the closest available format
-            for target in target_resolutions:
-                closest_format = None
-                min_diff = float('inf')
-                
-                for fmt in all_formats:
-                    diff = abs(fmt['height'] - target)
-                    if diff < min_diff:
-                        min_diff = diff
-                        closest_format = fmt.copy()  # Make a copy to avoid modifying the original
-                
-                # If we found a format, add it with the target resolution label
-                if closest_format:
-                    # Update the resolution label to match our target
-                    closest_format['resolution'] = f"{target}p"
-                    # Add filesize info if available
-                    if closest_format['filesize'] != 'N/A':
-                        closest_format['resolution'] += f" (mp4) - Size: {closest_format['filesize']}"
-                    else:
-                        closest_format['resolution'] += f" (mp4)"
-                    # Update format_id to ensure we get both video and audio
-                    closest_format['format_id'] = f"{closest_format['format_id']}+bestaudio[ext=m4a]/bestaudio"
-                    response_data['formats'].append(closest_format)
+            # If we found a format, add it with the target resolution label
+            if closest_format:
+                # Update the resolution label to match our target
+                closest_format['resolution'] = f"{target}p"
+                # Add filesize info if available
+                if closest_format['filesize'] != 'N/A':
+                    closest_format['resolution'] += f" (mp4) - Size: {closest_format['filesize']}"
                 else:
-                    # If no format is available, create a placeholder that uses the best format
-                    response_data['formats'].append({
-                        'format_id': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                        'resolution': f"{target}p (mp4) - Size: Automatic",
-                        'ext': 'mp4',
-                        'filesize': 'Automatic',
-                        'height': target
-                    })
-            
-            # Add MP3 audio option at the end
-            # Find best audio format for size estimation
-            best_audio = None
-            for f in info.get('formats', []):
-                if f.get('vcodec') == 'none' and f.get('acodec') != 'none':
-                    if best_audio is None or (f.get('filesize', 0) and f.get('filesize', 0) > best_audio.get('filesize', 0)):
-                        best_audio = f
-            
-            audio_size = format_size(best_audio.get('filesize', 0)) if best_audio else 'Automatic'
-            response_data['formats'].append({
-                'format_id': 'bestaudio/best',
-                'resolution': f"Audio Only (mp3) - Size: {audio_size}",
-                'ext': 'mp3',
-                'filesize': audio_size,
-                'height': 0  # Lowest priority for sorting
-            })
-            
-            return jsonify(response_data)
+                    closest_format['resolution'] += f" (mp4)"
+                # Update format_id to ensure we get both video and audio
+                closest_format['format_id'] = f"{closest_format['format_id']}+bestaudio[ext=m4a]/bestaudio"
+                response_data['formats'].append(closest_format)
+            else:
+                # If no format is available, create a placeholder that uses the best format
+                response_data['formats'].append({
+                    'format_id': DEFAULT_FORMAT,
+                    'resolution': f"{target}p (mp4) - Size: Automatic",
+                    'ext': 'mp4',
+                    'filesize': 'Automatic',
+                    'height': target
+                })
+        
+        # Add MP3 audio option at the end
+        # Find best audio format for size estimation
+        best_audio = index.best_audio()
+        
+        audio_size = format_size(index.estimate_size(best_audio) * fraction) if best_audio else 'Automatic'
+        response_data['formats'].append({
+            'format_id': 'bestaudio/best',
+            'resolution': f"Audio Only (mp3) - Size: {audio_size}",
+            'ext': 'mp3',
+            'filesize': audio_size,
+            'height': 0  # Lowest priority for sorting
+        })
+        
+        # The same video gives the same response, so repeat views get a 304 instead of the body
+        return cacheable(jsonify(response_data), request, FORMATS_MAX_AGE)
 
     except Exception as e:
         print("Error:", str(e))
         return jsonify({'error': str(e)}), 400
 
-@app.route('/api/progress')
-def get_progress():
-    # Log the current progress data
-    logger.info(f"Progress data: {progress_tracker.progress}")
+@app.route('/api/thumbnail/<path:video_id>')
+def get_thumbnail(video_id):
+    try:
+        found = thumbnail_cache.get(video_id)
+    except Exception as e:
+        logger.warning(f"Thumbnail fetch failed: {str(e)}")
+        return jsonify({'error': str(e)}), 502
+    if found is None:
+        return jsonify({'error': 'Unknown video; look it up with /api/formats first'}), 404
+    path, mimetype = found
+    return send_file(path, mimetype=mimetype, max_age=THUMBNAIL_MAX_AGE)
+
+@app.route('/api/progress/<job_id>')
+def get_progress(job_id):
     # This endpoint will be polled by the frontend to get download progress
-    return jsonify(progress_tracker.progress)
+    record = progress_registry.get(job_id)
+    if record is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(record.to_dict())
+
+@app.route('/api/progress/<job_id>/stream')
+def stream_job_progress(job_id):
+    # Push progress deltas to the browser instead of having it poll
+    if progress_registry.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    events = stream_progress(progress_registry, job_id, max_rate=PROGRESS_STREAM_RATE)
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+def job_temp_dir(job_id):
+    return os.path.join(DOWNLOAD_DIR, '.partial', job_id)
+
+def check_disk_space(url, format_id, section=None):
+    """Refuse a download that can never fit on disk, if its metadata is already cached"""
+    info = info_cache.get(url)
+    if info is None:
+        # The worker checks once it has extracted the metadata
+        return
+    audio_codec = 'mp3' if format_id == 'bestaudio/best' else None
+    # yt-dlp's format selection is too slow for the request; the worker checks its exact result again
+    resolved = FormatIndex(info).resolve('bestaudio' if audio_codec else format_id)
+    if resolved is None:
+        return
+    fraction = section_fraction(info, *resolve_section(info, section)) if section else 1.0
+    plan = plan_postprocessors(resolved, audio_codec=audio_codec)
+    disk_quota.check(int(estimate_peak_bytes(resolved, plan, DISK_UNKNOWN_SIZE) * fraction))
+
+def queue_download(url, format_id, resolution='', concurrent_fragments=FRAGMENT_CONCURRENCY, priority=None,
+                   job_id=None, section=None, forget_on_full=True):
+    """Queue a download job, attaching to an identical one already in flight"""
+    # Journal the job before a worker can pick it up so a crash never loses it
+    job_id = job_id or uuid.uuid4().hex
+    job_journal.record(job_id, {
+        'url': url,
+        'format_id': format_id,
+        'resolution': resolution,
+        'concurrent_fragments': concurrent_fragments,
+        'priority': priority,
+        'section': section,
+    })
+    try:
+        key = (video_key(url), format_id, json.dumps(section, sort_keys=True))
+        job, created = download_queue.submit_unique(key, run_download, url, format_id, resolution,
+                                                    concurrent_fragments, job_id=job_id, priority=priority,
+                                                    section=section)
+    except QueueFullError:
+        # A resumed job keeps its journal row and partial files for the next start
+        if forget_on_full:
+            job_journal.forget(job_id)
+        raise
+    if not created:
+        job_journal.forget(job_id)
+    progress_registry.track(job.id)
+    return job, created
+
+def resume_unfinished_jobs():
+    """Requeue jobs a previous run journaled but never finished"""
+    for job_id, args in job_journal.unfinished():
+        logger.info(f"Resuming download job {job_id}")
+        try:
+            queue_download(job_id=job_id, forget_on_full=False, **args)
+        except QueueFullError:
+            logger.warning(f"Download queue is full; job {job_id} stays journaled for the next start")
+        except Exception as e:
+            # A row this app cannot queue, e.g. one journaled with arguments it no longer takes
+            logger.error(f"Could not resume download job {job_id}: {str(e)}")
 
 @app.route('/api/download', methods=['POST'])
 def download_video():
+    data = request.get_json()
+    if not data or 'url' not in data or 'format_id' not in data:
+        return jsonify({'error': 'URL and format_id are required'}), 400
+
+    url = data['url']
+    format_id = data['format_id']
+    resolution = data.get('resolution', '')
     try:
-        data = request.get_json()
-        if not data or 'url' not in data or 'format_id' not in data:
-            return jsonify({'error': 'URL and format_id are required'}), 400
+        concurrent_fragments = int(data.get('concurrent_fragments') or FRAGMENT_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrent_fragments = 0
+    if not 1 <= concurrent_fragments <= MAX_FRAGMENT_CONCURRENCY:
+        return jsonify({'error': f'concurrent_fragments must be between 1 and {MAX_FRAGMENT_CONCURRENCY}'}), 400
+    priority = data.get('priority') or 'interactive'
+    if priority not in PRIORITY_WEIGHTS:
+        return jsonify({'error': f'priority must be one of {", ".join(PRIORITY_WEIGHTS)}'}), 400
+    # Optional start/end times or chapter titles; only that part of the video is fetched
+    try:
+        section = requested_section(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        url = data['url']
-        format_id = data['format_id']
-        resolution = data.get('resolution', '')
-
-        # Reset progress tracker for new download
-        progress_tracker.progress = {
-            'status': 'starting',
-            'downloaded_bytes': 0,
-            'total_bytes': 0,
-            'speed': 0,
-            'eta': 0,
-            'percentage': 0,
-            'filename': ''
-        }
+    try:
+        check_disk_space(url, format_id, section)
+    except InsufficientSpaceError as e:
+        logger.warning(f"Rejecting download: {str(e)}")
+        return jsonify({'error': str(e)}), 507
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job, created = queue_download(url, format_id, resolution, concurrent_fragments, priority, section=section)
+    except QueueFullError as e:
+        logger.warning(f"Rejecting download: {str(e)}")
+        response = jsonify({'error': 'Too many downloads in progress, please retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status, 'deduplicated': not created}), 202
+
+@app.route('/api/batch', methods=['POST'])
+def batch_download():
+    data = request.get_json()
+    if not data or not (data.get('urls') or data.get('url')):
+        return jsonify({'error': 'A list of urls or a playlist url is required'}), 400
+    urls = data.get('urls')
+    if urls is not None and (not isinstance(urls, list) or not all(isinstance(u, str) for u in urls)):
+        return jsonify({'error': 'urls must be a list of strings'}), 400
+    format_id = data.get('format_id') or DEFAULT_FORMAT
+    # Batches default to bulk so a large playlist does not hold up interactive downloads
+    priority = data.get('priority') or 'bulk'
+    if priority not in PRIORITY_WEIGHTS:
+        return jsonify({'error': f'priority must be one of {", ".join(PRIORITY_WEIGHTS)}'}), 400
+
+    def ingest(entry_url):
+        try:
+            # Warms the info cache, so the job skips extraction when it runs
+            info = extract_info(entry_url)
+            check_disk_space(entry_url, format_id)
+            job, created = queue_download(entry_url, format_id, priority=priority)
+            return {'url': entry_url, 'title': info.get('title'), 'job_id': job.id, 'deduplicated': not created}
+        except QueueFullError:
+            return {'url': entry_url, 'error': 'Download queue is full'}
+        except Exception as e:
+            return {'url': entry_url, 'error': str(e)}
+
+    def generate():
+        # Playlists are enumerated lazily, so the first results go out before the last page is fetched
+        entries = urls if urls is not None else playlist_entry_urls(data['url'], ydl_pool)
+        try:
+            for result in map_unordered(ingest, itertools.islice(entries, BATCH_MAX_ENTRIES), BATCH_WORKERS):
+                yield json.dumps(result) + '\n'
+        except Exception as e:
+            yield json.dumps({'url': data.get('url'), 'error': str(e)}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/config')
+def get_config():
+    return jsonify({
+        'download_workers': DOWNLOAD_WORKERS,
+        'download_queue_size': DOWNLOAD_QUEUE_SIZE,
+        'fragment_concurrency': FRAGMENT_CONCURRENCY,
+        'max_fragment_concurrency': MAX_FRAGMENT_CONCURRENCY,
+        'max_connections': MAX_CONNECTIONS,
+        'http_chunk_size': HTTP_CHUNK_SIZE,
+        'max_bandwidth': MAX_BANDWIDTH,
+        'ffmpeg_workers': FFMPEG_WORKERS,
+        'priorities': PRIORITY_WEIGHTS,
+        'disk_quota': DISK_QUOTA,
+    })
+
+@app.route('/api/stats')
+def get_stats():
+    return jsonify({
+        'download_queue': download_queue.stats(),
+        'info_cache': info_cache.stats(),
+        'download_store': download_store.stats(),
+        'connections': connection_budget.stats(),
+        'bandwidth': bandwidth_scheduler.stats(),
+        'disk': disk_quota.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/files/<job_id>')
+def get_file(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status != 'finished':
+        return jsonify({'error': f"Job is {job.status}"}), 409
+    # Werkzeug answers Range and conditional requests itself and hands the open
+    # file to wsgi.file_wrapper, so the server can use sendfile instead of Python reads
+    return send_from_directory(os.path.abspath(DOWNLOAD_DIR), job.result['filename'],
+                               as_attachment=True, max_age=FILE_MAX_AGE)
+
+@app.route('/api/stream')
+def stream_video():
+    # Pipe the selected format straight to the client without staging it on disk
+    url = request.args.get('url')
+    format_id = request.args.get('format_id') or 'best'
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+
+    try:
+        resolved = resolve_format(extract_info(url), format_id, ydl_pool)
+        chunks, mimetype, filename, length = open_stream(resolved, ffmpeg_bootstrap.location)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    headers = {'Content-Disposition': content_disposition(filename)}
+    if length:
+        headers['Content-Length'] = str(length)
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+@download_queue.task
+def run_download(job, url, format_id, resolution, concurrent_fragments=FRAGMENT_CONCURRENCY, section=None):
+    """Download a video on a worker thread"""
+    record = progress_registry.track(job.id)
+    job_journal.mark(job.id, 'running')
+    timer = PhaseTimer(job_phase_seconds)
+    timer.add('queue', job.started_at - job.created_at)
+    meter = ByteMeter(downloaded_bytes)
+    try:
+        record.status = 'starting'
 
         # Disable logging for yt-dlp
         logging.getLogger('yt_dlp').setLevel(logging.WARNING)
         # Disable our app's logging during download
         logger.setLevel(logging.WARNING)
 
-        def format_size(bytes):
-            """Convert bytes to human readable string"""
-            if not bytes:
-                return "0 B"
-            for unit in ['B', 'KB', 'MB', 'GB']:
-                if bytes < 1024:
-                    return f"{bytes:.1f} {unit}"
-                bytes /= 1024
-            return f"{bytes:.1f} TB"
-
-        def format_speed(speed):
-            """Convert speed to human readable string"""
-            return f"{format_size(speed)}/s" if speed else "0 B/s"
-
-        def progress_hook(d):
-            if d['status'] == 'downloading':
-                try:
-                    # Get downloaded bytes and total bytes
-                    downloaded_bytes = d.get('downloaded_bytes', 0)
-                    total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                    
-                    # Calculate percentage
-                    if total_bytes > 0:
-                        percentage = (downloaded_bytes / total_bytes) * 100
-                    else:
-                        percentage = 0
-                    
-                    # Get speed and eta
-                    speed = d.get('speed', 0)
-                    eta = d.get('eta', 0)
-                    
-                    # Format values
-                    speed_str = format_speed(speed)
-                    downloaded_str = format_size(downloaded_bytes)
-                    total_str = format_size(total_bytes) if total_bytes else 'Unknown'
-                    eta_str = f"{int(eta//60)}:{int(eta%60):02d}" if eta else "??:??"
-                    
-                    # Update progress tracker
-                    progress_tracker.progress.update({
-                        'status': 'downloading',
-                        'downloaded_bytes': downloaded_bytes,
-                        'total_bytes': total_bytes,
-                        'speed': speed,
-                        'eta': eta,
-                        'percentage': percentage
-                    })
-
-                    # Clear line and print progress
-                    print(f"\rDownloading: {percentage:5.1f}% | {downloaded_str}/{total_str} | {speed_str} | ETA: {eta_str}", 
-                          end='', flush=True)
-                except Exception as e:
-                    print(f"\rDownloading... {format_size(downloaded_bytes)}", end='', flush=True)
-            
-            elif d['status'] == 'finished':
-                print("\nDownload completed!")
-                progress_tracker.progress['status'] = 'finished'
-                progress_tracker.progress['percentage'] = 100
-
         # Extract resolution value from the string
         if resolution:
             resolution_value = resolution.split()[0]
@@ -293,76 +532,149 @@ def download_video():
             else:
                 resolution_value = "MP4"
 
-        # Add timestamp to filename to make it unique
-        timestamp = int(time.time())
-        filename_template = os.path.join(DOWNLOAD_DIR, f'%(title)s (%(resolution)s)_{timestamp}.%(ext)s')
-
-        # Use system's temp directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            ydl_opts = {
-                'format': format_id,
-                'outtmpl': filename_template,
-                'merge_output_format': 'mp4',
-                'ffmpeg_location': FFMPEG_PATH,
-                'progress_hooks': [progress_hook],
-                'outtmpl_params': {
-                    'resolution': resolution_value,
-                },
-                'quiet': True,
-                'no_warnings': True,
-                'force_download': True,
-                'writesubtitles': False,
-                'writeautomaticsub': False,
-                'keepvideo': False,
-                'clean_infojson': True,
-                'postprocessor_args': ['-y'],
-                'paths': {
-                    'home': DOWNLOAD_DIR,
-                    'temp': temp_dir,
-                }
-            }
+        # Check if this is an audio-only download
+        audio_codec = 'mp3' if format_id == 'bestaudio/best' else None
+        download_format = 'bestaudio' if audio_codec else format_id
+
+        # Reuse the metadata fetched by /api/formats instead of extracting again
+        with timer.phase('extract'):
+            info = extract_info(url)
+
+        with timer.phase('plan'):
+            # Only run ffmpeg as hard as the selected codecs require
+            resolved = resolve_format(info, download_format, ydl_pool)
+            plan = plan_postprocessors(resolved, audio_codec=audio_codec)
+            logger.info(f"Postprocessing for {resolved.get('format_id')}: {plan['path']}")
+            # A clip covers start..end seconds; None means the whole video
+            span = resolve_section(info, section) if section else None
+
+            # The same formats run through the same postprocessors give the same file,
+            # so serve it from the store if we have produced it before
+            key = store_key(info.get('extractor_key'), info.get('id'), resolved.get('format_id'),
+                            plan['postprocessors'], span)
+            stored_path = download_store.lookup(key)
+        if stored_path:
+            logger.info(f"Serving {os.path.basename(stored_path)} from the download store")
+            record.filename = stored_path
+            job_journal.mark(job.id, 'finished')
+            progress_registry.finish(job.id)
+            timer.observe()
+            jobs_total.inc(outcome='cached')
+            return {'filename': os.path.basename(stored_path), 'cached': True, 'postprocess': 'none', 'section': span}
+
+        # Name the file after its store key so different formats never overwrite each other
+        filename_template = os.path.join(DOWNLOAD_DIR, f'%(title)s (%(resolution)s)_{key[:10]}.%(ext)s')
+
+        # Partial files live in a per-job directory that survives restarts, so a
+        # resumed job continues from the bytes it already has
+        temp_dir = job_temp_dir(job.id)
+        os.makedirs(temp_dir, exist_ok=True)
 
-            # Check if this is an audio-only download
-            if format_id == 'bestaudio/best':
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
-                ydl_opts['extract_audio'] = True
-                ydl_opts['format'] = 'bestaudio'
-            else:
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                }]
-                ydl_opts['format'] = format_id
-
-            try:
-                with YoutubeDL(ydl_opts) as ydl:
+        ydl_opts = {
+            'format': download_format,
+            'outtmpl': filename_template,
+            'merge_output_format': plan['merge_output_format'],
+            # Only jobs that merge, convert or cut a clip have to wait for FFmpeg
+            'ffmpeg_location': ffmpeg_bootstrap.location(wait=plan['needs_ffmpeg'] or span is not None),
+            # Progress goes to the job's record and a sampled byte counter, never to stdout
+            'progress_hooks': [ProgressHook(record), meter],
+            'postprocessors': plan['postprocessors'],
+            'outtmpl_params': {
+                'resolution': resolution_value,
+            },
+            'quiet': True,
+            # quiet still prints a progress line per chunk; the hooks above are the only progress output
+            'noprogress': True,
+            'no_warnings': True,
+            'force_download': True,
+            'continuedl': True,
+            'writesubtitles': False,
+            'writeautomaticsub': False,
+            'keepvideo': False,
+            'clean_infojson': True,
+            'postprocessor_args': ['-y'],
+            'http_chunk_size': HTTP_CHUNK_SIZE,
+            'buffersize': DOWNLOAD_BUFFER_SIZE,
+            'paths': {
+                'home': DOWNLOAD_DIR,
+                'temp': temp_dir,
+            }
+        }
+        if audio_codec:
+            ydl_opts['extract_audio'] = True
+        if span:
+            # ffmpeg fetches only the fragments or byte ranges covering the clip
+            ydl_opts.update(section_options(*span))
+
+        def wait_for_disk():
+            record.status = 'waiting_for_disk'
+            record.publish()
+
+        # Hold the download's estimated peak disk use until its file is in place
+        with timer.phase('disk_wait'):
+            peak_bytes = estimate_peak_bytes(resolved, plan, DISK_UNKNOWN_SIZE)
+            if span:
+                peak_bytes = int(peak_bytes * section_fraction(info, *span))
+            disk_quota.acquire(job.id, peak_bytes, timeout=DISK_WAIT, on_wait=wait_for_disk)
+
+        # Bandwidth share follows the job's priority and is rebalanced as other jobs come and go
+        shaper = bandwidth_scheduler.attach(job.priority)
+        ffmpeg_gate = postprocess_pool.gate()
+        ydl_opts['progress_hooks'].append(shaper.hook)
+        # The timer hook runs first so time spent waiting for an ffmpeg slot counts as postprocessing
+        ydl_opts['postprocessor_hooks'] = [timer.postprocessor_hook, ffmpeg_gate.hook]
+        try:
+            # Fragment parallelism comes out of the global connection budget
+            # Section downloads look for ffmpeg without reading the options, so point them at ours too
+            with connection_budget.reserve(concurrent_fragments) as granted, ffmpeg_context(ydl_opts['ffmpeg_location']):
+                ydl_opts['concurrent_fragment_downloads'] = granted
+                # The shaper lets go of the instance's options before it goes back to the pool
+                with ydl_pool.checkout(ydl_opts) as ydl, shaper.bound(ydl.params):
                     logger.info("Starting YoutubeDL download...")
-                    ydl.download([url])
+                    with timer.phase('download'):
+                        result = ydl.process_ie_result(selectable(info), download=True)
                     logger.info("Download completed successfully")
 
-                # Clean up any remaining .part files
-                for file in os.listdir(DOWNLOAD_DIR):
-                    if file.endswith('.part') or file.endswith('.ytdl'):
-                        try:
-                            os.remove(os.path.join(DOWNLOAD_DIR, file))
-                        except:
-                            pass
-
-            except Exception as e:
-                logger.error(f"Error during download: {str(e)}")
-                raise
-
-        return jsonify({'success': True})
+            path = downloaded_path(result)
+            with timer.phase('store'):
+                download_store.add(key, path)
+        except Exception as e:
+            logger.error(f"Error during download: {str(e)}")
+            raise
+        finally:
+            shaper.close()
+            ffmpeg_gate.release()
+            meter.flush()
+            disk_quota.release(job.id)
 
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
-        progress_tracker.progress['status'] = 'error'
-        progress_tracker.progress['error'] = str(e)
-        return jsonify({'error': str(e)}), 400
+        shutil.rmtree(job_temp_dir(job.id), ignore_errors=True)
+        job_journal.mark(job.id, 'error', str(e))
+        progress_registry.finish(job.id, error=str(e))
+        timer.observe()
+        jobs_total.inc(outcome='error')
+        raise
+
+    # Only this job's partial files are removed; other downloads keep theirs
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    job_journal.mark(job.id, 'finished')
+    record.filename = path
+    progress_registry.finish(job.id)
+    timer.observe()
+    jobs_total.inc(outcome='finished')
+    if timer.durations.get('download'):
+        download_throughput.observe(meter.total / timer.durations['download'])
+    return {'filename': os.path.basename(path), 'cached': False, 'postprocess': plan['path'], 'section': span}
+
+# Under the debug reloader this module also runs in the watcher process; only the serving process resumes jobs
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    if ROLE in ('all', 'worker'):
+        download_queue.start()
+        disk_quota.start()
+        # A shared backend keeps its queue across restarts; in-process state relies on the journal
+        if state_backend is None:
+            resume_unfinished_jobs()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,106 @@
+"""Compare the old per-target format scans with FormatIndex.
+
+Run from the project root:
+
+    python -m benchmarks.bench_format_index [--lists 2000] [--formats 150] [--targets 1080,720,360,144]
+"""
+import argparse
+import random
+import time
+
+from utils.format_index import FormatIndex
+
+TARGETS = [1080, 720, 360, 144]
+HEIGHTS = [144, 240, 360, 480, 720, 1080, 1440, 2160]
+VCODECS = ['avc1.4d401e', 'vp09.00.40.08', 'av01.0.08M.08']
+
+
+def synthetic_info(rng, n_formats):
+    formats = []
+    for i in range(n_formats):
+        if rng.random() < 0.2:
+            formats.append({
+                'format_id': f"a{i}",
+                'vcodec': 'none',
+                'acodec': rng.choice(['mp4a.40.2', 'opus']),
+                'ext': rng.choice(['m4a', 'webm']),
+                'abr': rng.choice([48, 70, 128, 160]),
+                'filesize': rng.choice([None, rng.randint(10 ** 5, 10 ** 7)]),
+            })
+            continue
+        height = rng.choice(HEIGHTS)
+        formats.append({
+            'format_id': f"v{i}",
+            'vcodec': rng.choice(VCODECS),
+            'acodec': 'none',
+            'ext': rng.choice(['mp4', 'webm']),
+            'height': height,
+            'width': height * 16 // 9,
+            'fps': rng.choice([24, 30, 60]),
+            'tbr': rng.uniform(100, 8000),
+            'filesize': rng.choice([None, rng.randint(10 ** 6, 10 ** 9)]),
+        })
+    return {'duration': rng.randint(30, 7200), 'formats': formats}
+
+
+def legacy_select(info, targets):
+    """The scans get_formats() used to do: sort, rescan per target, rescan for audio"""
+    all_formats = [f for f in info['formats'] if f.get('vcodec', 'none') != 'none' and f.get('height')]
+    all_formats = sorted(all_formats, key=lambda x: x['height'], reverse=True)
+    picked = []
+    for target in targets:
+        closest, min_diff = None, float('inf')
+        for fmt in all_formats:
+            diff = abs(fmt['height'] - target)
+            if diff < min_diff:
+                min_diff, closest = diff, fmt
+        picked.append(closest['format_id'] if closest else None)
+    best_audio = None
+    for f in info['formats']:
+        if f.get('vcodec') == 'none' and f.get('acodec') != 'none':
+            if best_audio is None or (f.get('filesize') or 0) > (best_audio.get('filesize') or 0):
+                best_audio = f
+    return picked, best_audio
+
+
+def indexed_select(info, targets):
+    index = FormatIndex(info)
+    picked = []
+    for target in targets:
+        fmt = index.nearest(target)
+        picked.append(fmt['format_id'] if fmt else None)
+    return picked, index.best_audio()
+
+
+def run(func, infos, targets):
+    start = time.perf_counter()
+    results = [func(info, targets) for info in infos]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lists', type=int, default=2000, help='number of synthetic info dicts')
+    parser.add_argument('--formats', type=int, default=150, help='formats per info dict')
+    parser.add_argument('--targets', default=','.join(map(str, TARGETS)),
+                        help='comma separated heights to look up in each list')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    infos = [synthetic_info(rng, args.formats) for _ in range(args.lists)]
+    targets = [int(t) for t in args.targets.split(',')]
+
+    legacy_time, legacy = run(legacy_select, infos, targets)
+    indexed_time, indexed = run(indexed_select, infos, targets)
+    mismatches = sum(1 for a, b in zip(legacy, indexed) if a[0] != b[0])
+
+    print(f"{args.lists} format lists x {args.formats} formats, {len(targets)} targets")
+    print(f"legacy scans: {legacy_time * 1000:8.1f} ms ({legacy_time / args.lists * 1e6:6.1f} us/list)")
+    print(f"FormatIndex:  {indexed_time * 1000:8.1f} ms ({indexed_time / args.lists * 1e6:6.1f} us/list)")
+    print(f"speedup:      {legacy_time / indexed_time:8.2f}x")
+    print(f"target picks that differ: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""Load test the apps offline with a local origin and a stub extractor.
+
+Run from the project root:
+
+    python -m benchmarks.bench_load [--apps app,web_app] [--mode dash] [--concurrency 4] [--requests 32]
+
+A local origin serves one synthetic video two ways: as a progressive
+MP4 and as DASH video and audio tracks cut into 2 second segments. The
+stub extractor in benchmarks/yt_dlp_plugins answers URLs on the origin
+with a canned info dict listing --formats formats, all pointing at that
+media. When ffmpeg is installed the media is a real H.264/AAC clip and
+DASH downloads go through the ffmpeg merge; without it the files are
+filler bytes and only the progressive and formats modes can run.
+
+Each client thread asks /api/formats about a video, queues a download
+of it and polls /api/jobs until the job ends. The report gives latency
+percentiles per request, downloads and bytes per second, and the mean
+time jobs spent in each phase as the app's /metrics recorded it. Each
+app runs in its own interpreter and nothing leaves the machine.
+"""
+import argparse
+import atexit
+import contextlib
+import importlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.ffmpeg_downloader import FFMPEG_DIR, FFmpegBootstrap
+
+SEGMENT_SECONDS = 2
+VIDEO_BITRATE = 2_000_000
+AUDIO_BITRATE = 128_000
+
+# Format spec each mode downloads; 'formats' only asks for the format list
+MODES = {
+    'dash': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]',
+    'progressive': 'best[ext=mp4]',
+    'formats': None,
+}
+
+# Variants the canned format list cycles through, roughly what a large video site offers
+HEIGHTS = (144, 240, 360, 480, 720, 1080, 1440, 2160)
+VIDEO_CODECS = (('avc1.640028', 'mp4'), ('vp09.00.40.08', 'webm'), ('av01.0.08M.08', 'mp4'))
+AUDIO_CODECS = (('mp4a.40.2', 'm4a', 128), ('opus', 'webm', 160), ('mp4a.40.5', 'm4a', 48))
+LANGUAGES = ('en', 'fr', 'de', 'es', 'ja')
+
+PHASES = ('queue', 'extract', 'plan', 'disk_wait', 'download', 'postprocess', 'store')
+CONTENT_TYPES = {'.mp4': 'video/mp4', '.m4s': 'video/iso.segment', '.mpd': 'application/dash+xml'}
+
+
+def find_ffmpeg():
+    """The ffmpeg the apps would find, without falling back to downloading one"""
+    bootstrap = FFmpegBootstrap(FFMPEG_DIR, os.environ.get('YTB_FFMPEG_PATH'))
+    return next((path for path in bootstrap._candidates() if bootstrap._verify(path)), None)
+
+
+def encode_media(ffmpeg, directory, duration):
+    """Encode a test pattern clip, then split its tracks into DASH segments"""
+    encoders = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+    # The info dict calls the video avc1 either way; mpeg4 is only for ffmpeg builds without x264
+    video = ['-c:v', 'libx264', '-preset', 'ultrafast'] if 'libx264' in encoders else ['-c:v', 'mpeg4']
+    progressive = os.path.join(directory, 'progressive.mp4')
+    subprocess.run([ffmpeg, '-v', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+                    '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                    *video, '-b:v', str(VIDEO_BITRATE), '-g', str(30 * SEGMENT_SECONDS),
+                    '-c:a', 'aac', '-b:a', str(AUDIO_BITRATE), '-movflags', '+faststart', progressive], check=True)
+    os.makedirs(os.path.join(directory, 'dash'))
+    subprocess.run([ffmpeg, '-v', 'error', '-y', '-i', progressive, '-map', '0:v', '-map', '0:a', '-c', 'copy',
+                    '-f', 'dash', '-seg_duration', str(SEGMENT_SECONDS), '-use_template', '1', '-use_timeline', '0',
+                    '-init_seg_name', 'init-$RepresentationID$.m4s',
+                    '-media_seg_name', 'chunk-$RepresentationID$-$Number%05d$.m4s',
+                    os.path.join(directory, 'dash', 'manifest.mpd')], check=True)
+
+
+def filler_media(directory, duration):
+    """Files laid out like encode_media's, sized for the same bitrates but holding zeros"""
+    segments = max(1, round(duration / SEGMENT_SECONDS))
+    with open(os.path.join(directory, 'progressive.mp4'), 'wb') as f:
+        f.write(b'\x00\x00\x00\x18ftypmp42' + bytes(duration * (VIDEO_BITRATE + AUDIO_BITRATE) // 8))
+    os.makedirs(os.path.join(directory, 'dash'))
+    with open(os.path.join(directory, 'dash', 'manifest.mpd'), 'w') as f:
+        f.write('<?xml version="1.0"?>\n<MPD xmlns="urn:mpeg:dash:schema:mpd:2011"/>\n')
+    for rep, bitrate in ((0, VIDEO_BITRATE), (1, AUDIO_BITRATE)):
+        with open(os.path.join(directory, 'dash', f'init-{rep}.m4s'), 'wb') as f:
+            f.write(bytes(1024))
+        for number in range(1, segments + 1):
+            with open(os.path.join(directory, 'dash', f'chunk-{rep}-{number:05d}.m4s'), 'wb') as f:
+                f.write(bytes(SEGMENT_SECONDS * bitrate // 8))
+
+
+def load_media(directory):
+    """Read the media into memory: the files by origin path, and each DASH track's init and chunk names"""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                files['/media/' + os.path.relpath(path, directory).replace(os.sep, '/')] = f.read()
+    tracks = {}
+    for track, rep in (('video', 0), ('audio', 1)):
+        chunks = sorted(name for name in files if name.startswith(f'/media/dash/chunk-{rep}-'))
+        tracks[track] = [f'init-{rep}.m4s'] + [name.rsplit('/', 1)[1] for name in chunks]
+    return files, tracks
+
+
+def build_formats(origin, files, tracks, count):
+    """A long format list: two progressive MP4s, then DASH video in many variants with DASH audio mixed in"""
+    progressive = {
+        'url': f'{origin}/media/progressive.mp4',
+        'protocol': 'http',
+        'ext': 'mp4',
+        'vcodec': 'avc1.64001F',
+        'acodec': 'mp4a.40.2',
+        'filesize': len(files['/media/progressive.mp4']),
+        'tbr': (VIDEO_BITRATE + AUDIO_BITRATE) / 1000,
+    }
+    formats = [dict(progressive, format_id='p360', width=640, height=360),
+               dict(progressive, format_id='p720', width=1280, height=720)]
+
+    def dash(track, **fields):
+        names = tracks[track]
+        return dict({
+            'url': f'{origin}/media/dash/manifest.mpd',
+            'manifest_url': f'{origin}/media/dash/manifest.mpd',
+            'protocol': 'http_dash_segments',
+            'fragment_base_url': f'{origin}/media/dash/',
+            'fragments': [{'path': names[0]}] + [{'path': name, 'duration': SEGMENT_SECONDS} for name in names[1:]],
+            'filesize': sum(len(files[f'/media/dash/{name}']) for name in names),
+        }, **fields)
+
+    videos = audios = 0
+    while len(formats) < count:
+        if len(formats) % 4 == 3:
+            acodec, ext, abr = AUDIO_CODECS[audios % len(AUDIO_CODECS)]
+            formats.append(dash('audio', format_id=f'a{audios}', ext=ext, vcodec='none', acodec=acodec,
+                                abr=abr, tbr=abr, asr=48000,
+                                language=LANGUAGES[audios // len(AUDIO_CODECS) % len(LANGUAGES)]))
+            audios += 1
+        else:
+            height = HEIGHTS[videos % len(HEIGHTS)]
+            vcodec, ext = VIDEO_CODECS[videos // len(HEIGHTS) % len(VIDEO_CODECS)]
+            fps = (30, 60)[videos // (len(HEIGHTS) * len(VIDEO_CODECS)) % 2]
+            formats.append(dash('video', format_id=f'v{videos}', ext=ext, vcodec=vcodec, acodec='none',
+                                width=height * 16 // 9, height=height, fps=fps, tbr=height * fps / 10))
+            videos += 1
+    return formats
+
+
+def build_info(video_id, formats, duration):
+    quarter = duration / 4
+    return {
+        'id': video_id,
+        'title': f'Synthetic clip {video_id}',
+        'duration': duration,
+        'chapters': [{'title': f'Part {i + 1}', 'start_time': i * quarter, 'end_time': (i + 1) * quarter}
+                     for i in range(4)],
+        'formats': formats,
+    }
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        match = re.fullmatch(r'/synthetic/([\w-]+)/info\.json', path)
+        if match:
+            self.send_body(200, 'application/json', json.dumps(self.server.info(match.group(1))).encode())
+            return
+        body = self.server.files.get(path)
+        if body is None:
+            self.send_body(404, 'text/plain', b'Not found')
+            return
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream')
+        # yt-dlp fetches progressive files in http_chunk_size ranges
+        byte_range = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not byte_range:
+            self.send_body(200, content_type, body)
+            return
+        start = int(byte_range.group(1))
+        end = min(int(byte_range.group(2) or len(body) - 1), len(body) - 1)
+        if start >= len(body):
+            self.send_body(416, 'text/plain', b'', {'Content-Range': f'bytes */{len(body)}'})
+            return
+        self.send_body(206, content_type, memoryview(body)[start:end + 1],
+                       {'Content-Range': f'bytes {start}-{end}/{len(body)}'})
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Origin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files, info):
+        super().__init__(('127.0.0.1', 0), OriginHandler)
+        self.files = files
+        self.info = info
+
+    def handle_error(self, request, client_address):
+        # Clients hang up mid-body when a download is cancelled or a probe has seen enough
+        pass
+
+
+def one_video(module, url, format_spec, poll):
+    """Look up formats, queue the download and wait for it; returns the timings and outcome"""
+    client = module.app.test_client()
+    sample = {'rejected': 0}
+    start = time.perf_counter()
+    response = client.post('/api/formats', json={'url': url})
+    sample['formats'] = time.perf_counter() - start
+    if response.status_code != 200:
+        return dict(sample, error=f"/api/formats: {response.get_json()['error']}")
+    if format_spec is None:
+        return sample
+
+    start = time.perf_counter()
+    while True:
+        response = client.post('/api/download', json={'url': url, 'format_id': format_spec})
+        if response.status_code != 429:
+            break
+        # The queue is full; retry sooner than Retry-After so the clients keep it full
+        sample['rejected'] += 1
+        time.sleep(poll)
+    sample['download'] = time.perf_counter() - start
+    if response.status_code != 202:
+        return dict(sample, error=f"/api/download: {response.get_json()['error']}")
+    job_id = response.get_json()['job_id']
+    while True:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in ('finished', 'error'):
+            break
+        time.sleep(poll)
+    sample['job'] = time.perf_counter() - start
+    if job['status'] == 'error':
+        return dict(sample, error=job['error'])
+    sample['path'] = os.path.join(module.DOWNLOAD_DIR, job['result']['filename'])
+    sample['bytes'] = os.path.getsize(sample['path'])
+    return sample
+
+
+def histogram_totals(client):
+    """{(histogram, phase): [sum, count]} read from the app's /metrics"""
+    totals = {}
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        match = re.fullmatch(r'ytb_(\w+)_(sum|count)(?:\{phase="(\w+)"\})? (\S+)', line)
+        if match:
+            name, kind, phase, value = match.groups()
+            totals.setdefault((name, phase), [0.0, 0.0])[kind == 'count'] = float(value)
+    return totals
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def report(samples, elapsed, before, after):
+    for label, key in (('/api/formats', 'formats'), ('/api/download', 'download'), ('job', 'job')):
+        times = [sample[key] for sample in samples if key in sample]
+        if times:
+            print(f"{label:14} p50 {percentile(times, 0.5) * 1000:8.1f} ms  p95 {percentile(times, 0.95) * 1000:8.1f} ms  "
+                  f"p99 {percentile(times, 0.99) * 1000:8.1f} ms  ({len(times)} requests)")
+
+    failed = [sample['error'] for sample in samples if 'error' in sample]
+    finished = [sample for sample in samples if 'bytes' in sample]
+    print(f"{len(samples) / elapsed:.1f} videos/s over {elapsed:.2f} s, {len(failed)} failed, "
+          f"{sum(sample['rejected'] for sample in samples)} downloads rejected with 429 and retried")
+    if failed:
+        print(f"  first error: {failed[0]}")
+    if finished:
+        total = sum(sample['bytes'] for sample in finished)
+        print(f"{len(finished) / elapsed:.2f} downloads/s, {total / elapsed / 1024 ** 2:.1f} MiB/s "
+              f"({len(finished)} files, {total / 1024 ** 2:.1f} MiB)")
+
+    def delta(name, phase=None):
+        seconds, count = after.get((name, phase), (0, 0))
+        old_seconds, old_count = before.get((name, phase), (0, 0))
+        return seconds - old_seconds, count - old_count
+
+    seconds, count = delta('extract_info_seconds')
+    if count:
+        print(f"extraction on info cache misses: mean {seconds / count * 1000:.1f} ms ({count:.0f} misses)")
+    jobs = delta('job_phase_seconds', 'queue')[1]
+    if jobs:
+        print("mean time per job by phase:")
+        total = sum(delta('job_phase_seconds', phase)[0] for phase in PHASES)
+        for phase in PHASES:
+            seconds, count = delta('job_phase_seconds', phase)
+            if count:
+                print(f"  {phase:12} {seconds / jobs * 1000:8.1f} ms  {seconds / total * 100:5.1f}%")
+
+
+def run(app_name, args):
+    format_spec = MODES[args.mode]
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None and args.mode == 'dash':
+        raise SystemExit("DASH downloads are merged by ffmpeg, which was not found; try --mode progressive")
+
+    with tempfile.TemporaryDirectory() as directory:
+        if ffmpeg:
+            encode_media(ffmpeg, directory, args.duration)
+        else:
+            filler_media(directory, args.duration)
+        files, tracks = load_media(directory)
+    formats = []
+    server = Origin(files, lambda video_id: build_info(video_id, formats, args.duration))
+    origin = f'http://127.0.0.1:{server.server_port}'
+    formats.extend(build_formats(origin, files, tracks, args.formats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # The apps must not go online for ffmpeg: give them the one found, or a link that 404s on the origin
+    if ffmpeg:
+        os.environ['YTB_FFMPEG_PATH'] = ffmpeg
+    else:
+        os.environ['YTB_FFMPEG_URL'] = f'{origin}/ffmpeg.tar.xz'
+    # Downloads, the store, the job journal and thumbnails go to a scratch directory, never the real downloads/
+    download_dir = tempfile.mkdtemp(prefix='bench_load-')
+    atexit.register(shutil.rmtree, download_dir, ignore_errors=True)
+    os.environ['YTB_DOWNLOAD_DIR'] = download_dir
+    # yt-dlp loads the stub extractor as a plugin from the directories on sys.path
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    module = importlib.import_module(app_name)
+    logging.getLogger().setLevel(logging.WARNING)
+    client = module.app.test_client()
+
+    run_id = uuid.uuid4().hex[:8]
+    print(f"{app_name}: {args.mode} mode, {args.concurrency} clients, {args.requests} videos with {len(formats)} formats each, "
+          f"{'encoded' if ffmpeg else 'filler'} media of {args.duration} s")
+    videos = args.videos or args.requests
+    urls = [f'{origin}/synthetic/{run_id}-{i % videos}' for i in range(args.requests)]
+    # Progress lines yt-dlp and the apps print would bury the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # The first video imports yt-dlp, fills the YoutubeDL pool and opens connections to the origin
+        warmup = one_video(module, f'{origin}/synthetic/{run_id}-warmup', format_spec, args.poll)
+        if 'error' in warmup:
+            raise SystemExit(f"Warmup failed: {warmup['error']}")
+        before = histogram_totals(client)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            samples = list(pool.map(lambda url: one_video(module, url, format_spec, args.poll), urls))
+        elapsed = time.perf_counter() - start
+    report(samples, elapsed, before, histogram_totals(client))
+
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', default='app,web_app', help='comma separated app modules, each run in its own interpreter')
+    parser.add_argument('--mode', default='dash', choices=list(MODES), help='what each client downloads')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads')
+    parser.add_argument('--requests', type=int, default=32, help='videos the clients go through in total')
+    parser.add_argument('--videos', type=int, default=0,
+                        help='distinct videos among them; fewer repeats videos so caches answer (0 for all distinct)')
+    parser.add_argument('--formats', type=int, default=200, help='formats in each canned info dict')
+    parser.add_argument('--duration', type=int, default=20, help='seconds of synthetic media')
+    parser.add_argument('--poll', type=float, default=0.05, help='seconds between job status polls')
+    args = parser.parse_args()
+
+    apps = args.apps.split(',')
+    if len(apps) == 1:
+        run(apps[0], args)
+        return
+    # The apps share module state, so each gets a fresh interpreter
+    for app_name in apps:
+        subprocess.run([sys.executable, '-m', 'benchmarks.bench_load', *sys.argv[1:], '--apps', app_name], check=True)
+
+
+if __name__ == '__main__':
+    main()
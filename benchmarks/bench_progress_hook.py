@@ -0,0 +1,95 @@
+"""Measure the per-callback cost of the yt-dlp progress hooks.
+
+Run from the project root:
+
+    python -m benchmarks.bench_progress_hook [--callbacks 200000] [--chunk 16384]
+
+yt-dlp calls progress hooks once per block read, so on a fast link the
+hook runs thousands of times per second on the download thread.
+"""
+import argparse
+import os
+import sys
+import time
+
+from utils.progress import ProgressHook, ProgressRecord
+
+
+def format_size(bytes):
+    if not bytes:
+        return "0 B"
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes < 1024:
+            return f"{bytes:.1f} {unit}"
+        bytes /= 1024
+    return f"{bytes:.1f} TB"
+
+
+def legacy_hook(record):
+    """The hook app.py used to nest in run_download: update, format four strings, flushed print"""
+    def progress_hook(d):
+        record.update(d)
+        if d['status'] == 'downloading':
+            speed_str = f"{format_size(record.speed)}/s" if record.speed else "0 B/s"
+            downloaded_str = format_size(record.downloaded_bytes)
+            total_str = format_size(record.total_bytes) if record.total_bytes else 'Unknown'
+            eta = record.eta
+            eta_str = f"{int(eta//60)}:{int(eta%60):02d}" if eta else "??:??"
+            print(f"\rDownloading: {record.percentage:5.1f}% | {downloaded_str}/{total_str} | {speed_str} | ETA: {eta_str}",
+                  end='', flush=True)
+    return progress_hook
+
+
+def update_hook(record):
+    """Unthrottled record update on every callback"""
+    return record.update
+
+
+def callbacks(count, chunk):
+    total = count * chunk
+    for i in range(1, count + 1):
+        yield {
+            'status': 'downloading',
+            'filename': 'video.f137.mp4',
+            'downloaded_bytes': i * chunk,
+            'total_bytes': total,
+            'speed': 25e6,
+            'eta': (count - i) * chunk / 25e6,
+        }
+
+
+def run(make_hook, events):
+    record = ProgressRecord('bench')
+    hook = make_hook(record)
+    start = time.perf_counter()
+    for d in events:
+        hook(d)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--callbacks', type=int, default=200000, help='progress callbacks per run')
+    parser.add_argument('--chunk', type=int, default=16384, help='bytes reported per callback')
+    args = parser.parse_args()
+
+    events = list(callbacks(args.callbacks, args.chunk))
+    results = []
+    # The legacy hook prints to stdout; send it to /dev/null so the write syscalls are still paid
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            results.append(('legacy print hook', run(legacy_hook, events)))
+        finally:
+            sys.stdout = stdout
+    results.append(('record.update', run(update_hook, events)))
+    results.append(('ProgressHook', run(ProgressHook, events)))
+
+    print(f"{args.callbacks} callbacks of {args.chunk} bytes")
+    baseline = results[0][1]
+    for name, elapsed in results:
+        print(f"{name:18} {elapsed / args.callbacks * 1e9:8.0f} ns/callback  {baseline / elapsed:6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
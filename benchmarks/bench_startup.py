@@ -0,0 +1,47 @@
+"""Measure how long each app takes to import, i.e. before Flask can bind.
+
+Run from the project root:
+
+    python -m benchmarks.bench_startup [--runs 5] [--modules app,web_app]
+
+Each run is a fresh interpreter so nothing is cached in-process. The
+import of yt_dlp is timed separately; the apps defer it until the first
+request that needs it.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, 'yt_dlp' in sys.modules)
+"""
+
+
+def time_import(module):
+    result = subprocess.run([sys.executable, '-c', SNIPPET.format(module=module)],
+                            capture_output=True, text=True, check=True)
+    seconds, loaded = result.stdout.split()[-2:]
+    return float(seconds), loaded == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per module')
+    parser.add_argument('--modules', default='app,web_app', help='comma separated modules to import')
+    args = parser.parse_args()
+
+    for module in args.modules.split(',') + ['yt_dlp']:
+        samples = [time_import(module) for _ in range(args.runs)]
+        times = [seconds for seconds, _ in samples]
+        line = f"import {module:8} median {statistics.median(times) * 1000:7.1f} ms  min {min(times) * 1000:7.1f} ms"
+        if module != 'yt_dlp':
+            line += f"  yt_dlp imported: {'yes' if any(loaded for _, loaded in samples) else 'no'}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Compare /api/formats latency with fresh and pooled YoutubeDL instances.
+
+Run from the project root:
+
+    python -m benchmarks.bench_ydl_pool [--app app] [--requests 50]
+
+Requests go through the Flask test client to a local origin, each with
+a different query string so the info cache never answers them. They
+ask for a watch page with an HTML5 video, whose body yt-dlp reads in
+full, and for a direct MP4 link, which it only sniffs. "cold" builds a
+YoutubeDL per call, as the apps used to; "pooled" checks them out of a
+warm pool. The origin counts the TCP connections it accepts, which
+shows whether keep-alive connections are reused between requests.
+"""
+import argparse
+import importlib
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.ytdl import YoutubeDLPool
+
+MEDIA = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 65512
+PAGE = b'''<!DOCTYPE html>
+<html><head><title>Benchmark clip</title></head>
+<body><video controls width="640" height="360"><source src="/video.mp4" type="video/mp4"></video></body></html>
+'''
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        OriginHandler.connections += 1
+
+    def do_GET(self):
+        if self.path.startswith('/video.mp4'):
+            content_type, body = 'video/mp4', MEDIA
+        else:
+            content_type, body = 'text/html; charset=utf-8', PAGE
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Origin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # yt-dlp hangs up after sniffing the start of a media file
+        pass
+
+
+def measure(client, url, label, count):
+    OriginHandler.connections = 0
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        response = client.post('/api/formats', json={'url': f'{url}?{label}={i}'})
+        times.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise SystemExit(f"/api/formats failed: {response.get_json()}")
+    times.sort()
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print(f"{url.rsplit('/', 1)[-1]:10} {label:6} median {statistics.median(times) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms  "
+          f"origin connections {OriginHandler.connections}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default='app', choices=['app', 'web_app'], help='which app module to drive')
+    parser.add_argument('--requests', type=int, default=50, help='requests per mode')
+    args = parser.parse_args()
+
+    server = Origin(('127.0.0.1', 0), OriginHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin = f'http://127.0.0.1:{server.server_port}'
+
+    module = importlib.import_module(args.app)
+    client = module.app.test_client()
+    for url in (f'{origin}/watch', f'{origin}/video.mp4'):
+        for label, pool in (('cold', YoutubeDLPool(max_idle=0)), ('pooled', YoutubeDLPool())):
+            module.ydl_pool = pool
+            # The first request imports yt-dlp and fills the pool
+            client.post('/api/formats', json={'url': f'{url}?warmup={label}'})
+            measure(client, url, label, args.requests)
+            pool.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
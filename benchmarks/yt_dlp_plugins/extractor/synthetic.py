@@ -0,0 +1,18 @@
+"""Stub extractor for the offline load benchmark.
+
+yt-dlp loads plugins from the directories on sys.path, and
+benchmarks.bench_load adds the benchmarks directory before the apps
+create their first YoutubeDL, so the apps pick this up without changes.
+It answers URLs on the benchmark's local origin with the canned info
+dict the origin serves, as a site extractor would after one API call.
+"""
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class SyntheticIE(InfoExtractor):
+    IE_NAME = 'synthetic'
+    _VALID_URL = r'(?P<origin>http://127\.0\.0\.1:\d+)/synthetic/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        origin, video_id = self._match_valid_url(url).group('origin', 'id')
+        return self._download_json(f'{origin}/synthetic/{video_id}/info.json', video_id)
@@ -0,0 +1,97 @@
+"""Production entrypoint that runs web and download workers as separate processes.
+
+    python serve.py web [--app app] [--bind 0.0.0.0:8000] [--workers 4] [--threads 8]
+    python serve.py worker [--app app] [--processes 2]
+    python serve.py all [--app app] [--bind ...] [--workers 4] [--processes 2]
+
+Web workers are served by gunicorn (pip install gunicorn) and only queue
+jobs; download workers run them. All of them must share job state
+through YTB_STATE_URL, e.g. sqlite:///state.db on one machine or
+redis://host:6379/0 across machines.
+"""
+import argparse
+import importlib
+import importlib.util
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+def run_worker(app_module, state_url):
+    """Import the app as a download worker and keep the process alive"""
+    # The download queue starts its worker threads when the app module is imported
+    importlib.import_module(app_module)
+    print(f"Download worker {os.getpid()} running jobs from {state_url}", flush=True)
+    while True:
+        time.sleep(3600)
+
+
+def web_command(args):
+    if importlib.util.find_spec('gunicorn') is None:
+        sys.exit("The web role is served by gunicorn: pip install gunicorn")
+    # Threads keep progress streams from tying up a whole worker process each
+    return [sys.executable, '-m', 'gunicorn', '--bind', args.bind, '--workers', str(args.workers),
+            '--worker-class', 'gthread', '--threads', str(args.threads), f"{args.app}:app"]
+
+
+def worker_command(args):
+    return [sys.executable, os.path.abspath(__file__), 'worker', '--app', args.app, '--processes', '1']
+
+
+def supervise(commands):
+    """Run commands as child processes until one exits or we are told to stop"""
+    children = []
+    for command, role in commands:
+        env = {**os.environ, 'YTB_ROLE': role}
+        children.append(subprocess.Popen(command, env=env))
+
+    def stop(signum, frame):
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while all(child.poll() is None for child in children):
+            time.sleep(1)
+    finally:
+        stop(None, None)
+        for child in children:
+            child.wait()
+    return max(abs(child.returncode or 0) for child in children)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('role', choices=['web', 'worker', 'all'])
+    parser.add_argument('--app', default='app', choices=['app', 'web_app'], help='which app module to serve')
+    parser.add_argument('--bind', default='0.0.0.0:8000', help='address gunicorn listens on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--processes', type=int, default=1, help='download worker processes')
+    args = parser.parse_args()
+
+    in_process_worker = args.role == 'worker' and args.processes == 1
+    if in_process_worker:
+        # utils.config reads YTB_ROLE once, when it is first imported
+        os.environ['YTB_ROLE'] = 'worker'
+    from utils.config import STATE_URL
+
+    if STATE_URL.startswith('memory'):
+        sys.exit("Set YTB_STATE_URL to sqlite:///... or redis://... so web and download workers share jobs")
+
+    if in_process_worker:
+        run_worker(args.app, STATE_URL)
+    commands = []
+    if args.role in ('web', 'all'):
+        commands.append((web_command(args), 'web'))
+    if args.role in ('worker', 'all'):
+        commands += [(worker_command(args), 'worker')] * args.processes
+    sys.exit(supervise(commands))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+
+from utils.download_store import DownloadStore, store_key
+
+
+def test_store_key_is_stable():
+    key = store_key('youtube', 'abc', '137+140', [{'key': 'FFmpegMerger'}])
+    assert key == store_key('youtube', 'abc', '137+140', [{'key': 'FFmpegMerger'}])
+    assert len(key) == 64
+
+
+def test_store_key_distinguishes_inputs():
+    base = store_key('youtube', 'abc', '137+140', None)
+    assert base == store_key('youtube', 'abc', '137+140', [])
+    assert base != store_key('youtube', 'abd', '137+140', None)
+    assert base != store_key('youtube', 'abc', '136+140', None)
+    assert base != store_key('youtube', 'abc', '137+140', [{'key': 'FFmpegExtractAudio'}])
+    assert base != store_key('youtube', 'abc', '137+140', None, section=(0, 10))
+    assert store_key('youtube', 'abc', '18', None, section=(0, 10)) != store_key('youtube', 'abc', '18', None,
+                                                                                   section=(0, 20))
+
+
+def _write(tmp_path, name, size=100):
+    path = tmp_path / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def test_add_evicts_least_recently_used(tmp_path):
+    store = DownloadStore(str(tmp_path / 'store.db'), max_bytes=250)
+    for name in ('a', 'b', 'c'):
+        store.add(name, _write(tmp_path, name))
+    assert store.lookup('a') is None
+    assert not os.path.exists(tmp_path / 'a')
+    assert store.lookup('c') is not None
+
+
+def test_add_keeps_recently_used_files(tmp_path):
+    store = DownloadStore(str(tmp_path / 'store.db'), max_bytes=150, min_idle=60)
+    store.add('a', _write(tmp_path, 'a'))
+    store.add('b', _write(tmp_path, 'b'))
+    assert store.lookup('a') is not None
+    assert store.total_bytes() == 200
+
+
+def test_lookup_drops_modified_files(tmp_path):
+    store = DownloadStore(str(tmp_path / 'store.db'))
+    path = _write(tmp_path, 'a')
+    store.add('a', path)
+    _write(tmp_path, 'a', size=50)
+    assert store.lookup('a') is None
+    assert store.stats()['files'] == 0
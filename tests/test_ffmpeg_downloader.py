@@ -0,0 +1,68 @@
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from utils.ffmpeg_downloader import ChecksumMismatchError, fetch_ffmpeg
+
+
+def _tar_archive(path):
+    with tarfile.open(path, 'w:gz') as archive:
+        for name in ('ffmpeg-build/bin/ffmpeg', 'ffmpeg-build/bin/ffprobe', 'ffmpeg-build/README'):
+            data = name.encode()
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+
+
+def _zip_archive(path):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name in ('ffmpeg-build/bin/ffmpeg.exe', 'ffmpeg-build/bin/ffprobe.exe'):
+            archive.writestr(name, name)
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.mark.parametrize('name, build, installed', [
+    ('build.tar.gz', _tar_archive, ['ffmpeg', 'ffprobe']),
+    ('build.zip', _zip_archive, ['ffmpeg.exe', 'ffprobe.exe']),
+])
+def test_installs_binaries_when_checksum_matches(tmp_path, name, build, installed):
+    archive = tmp_path / name
+    build(archive)
+    target = tmp_path / 'ffmpeg'
+    target.mkdir()
+    fetch_ffmpeg(archive.as_uri(), str(target), _sha256(archive).upper())
+    assert sorted(os.listdir(target)) == installed
+    assert os.access(target / installed[0], os.X_OK)
+
+
+@pytest.mark.parametrize('name, build', [('build.tar.gz', _tar_archive), ('build.zip', _zip_archive)])
+def test_rejects_checksum_mismatch(tmp_path, name, build):
+    archive = tmp_path / name
+    build(archive)
+    target = tmp_path / 'ffmpeg'
+    target.mkdir()
+    (target / 'ffmpeg').write_bytes(b'old')
+    with pytest.raises(ChecksumMismatchError):
+        fetch_ffmpeg(archive.as_uri(), str(target), '0' * 64)
+    # Nothing is replaced and no staged files are left behind
+    assert os.listdir(target) == ['ffmpeg']
+    assert (target / 'ffmpeg').read_bytes() == b'old'
+
+
+def test_rejects_archive_without_binaries(tmp_path):
+    archive = tmp_path / 'empty.tar.gz'
+    with tarfile.open(archive, 'w:gz'):
+        pass
+    target = tmp_path / 'ffmpeg'
+    target.mkdir()
+    with pytest.raises(RuntimeError, match='does not contain'):
+        fetch_ffmpeg(archive.as_uri(), str(target), _sha256(archive))
+    assert os.listdir(target) == []
@@ -0,0 +1,75 @@
+from utils.format_index import FormatIndex, codec_family, estimate_size
+
+FORMATS = [
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'filesize': 1000},
+    {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 160},
+    {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'width': 640},
+    {'format_id': '134', 'ext': 'mp4', 'vcodec': 'avc1.4d401e', 'acodec': 'none', 'height': 360, 'width': 640},
+    {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720, 'width': 1280},
+    {'format_id': '247', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 720, 'width': 1280, 'fps': 60},
+    {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'width': 1920},
+]
+INFO = {'duration': 100, 'formats': FORMATS}
+
+
+def test_codec_family():
+    assert codec_family('avc1.640028') == 'avc1'
+    assert codec_family('VP9') == 'vp9'
+    assert codec_family('none') is None
+    assert codec_family(None) is None
+
+
+def test_estimate_size():
+    assert estimate_size({'filesize': 10, 'tbr': 1000}, 100) == 10
+    assert estimate_size({'filesize_approx': 20}, 100) == 20
+    # tbr is kbit/s: 8 kbit/s for 100 seconds is 100 kB
+    assert estimate_size({'tbr': 8}, 100) == 100000
+    assert estimate_size({'tbr': 8}, 0) == 0
+    assert estimate_size(None, 100) == 0
+
+
+def test_nearest():
+    index = FormatIndex(INFO)
+    assert index.nearest(700)['height'] == 720
+    assert index.nearest(5000)['height'] == 1080
+    assert index.nearest(100)['height'] == 360
+    # Halfway between 360 and 720 goes to the taller one
+    assert index.nearest(540)['height'] == 720
+
+
+def test_nearest_by_codec():
+    index = FormatIndex(INFO)
+    assert index.nearest(1080, 'vp9')['format_id'] == '247'
+    assert index.nearest(1080, 'av01') is None
+
+
+def test_best_audio():
+    index = FormatIndex(INFO)
+    assert index.best_audio()['format_id'] == '251'
+    assert index.best_audio('m4a')['format_id'] == '140'
+    assert index.best_audio('mp3') is None
+
+
+def test_video_formats():
+    heights = [fmt['height'] for fmt in FormatIndex(INFO).video_formats('mp4')]
+    assert heights == [1080, 720, 360]
+
+
+def test_resolve_simple_selectors():
+    index = FormatIndex(INFO)
+    merged = index.resolve('bestvideo[ext=mp4]+bestaudio[ext=m4a]')
+    assert [fmt['format_id'] for fmt in merged['requested_formats']] == ['137', '140']
+    assert merged['duration'] == 100
+    assert index.resolve('best')['format_id'] == '18'
+    assert index.resolve('bestvideo')['format_id'] == '137'
+    assert index.resolve('137/18')['format_id'] == '137'
+    assert index.resolve('bestvideo[ext=flv]/18')['format_id'] == '18'
+
+
+def test_resolve_gives_up_on_complex_specs():
+    index = FormatIndex(INFO)
+    assert index.resolve('bestvideo[height<=720]+bestaudio') is None
+    assert index.resolve('mp4') is None
+    # An ID this video does not have could be something yt-dlp reads differently
+    assert index.resolve('22/18') is None
+    assert index.resolve('bestvideo[ext=flv]') is None
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from utils.job_queue import JobQueue, QueueFullError
+
+
+def wait_done(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < deadline, f"job {job.id} did not finish"
+        time.sleep(0.01)
+
+
+def test_runs_jobs_and_stores_results():
+    queue = JobQueue(workers=1)
+    queue.start()
+    ok = queue.submit(lambda job, x: x * 2, 21)
+    failed = queue.submit(lambda job: 1 / 0)
+    wait_done(ok)
+    wait_done(failed)
+    assert (ok.status, ok.result) == ('finished', 42)
+    assert failed.status == 'error' and 'division' in failed.error
+    assert ok.finished_at is not None and failed.finished_at is not None
+
+
+def test_submit_unique_attaches_to_unfinished_job():
+    release = threading.Event()
+    queue = JobQueue(workers=1)
+    queue.start()
+    first, created = queue.submit_unique('key', lambda job: release.wait(5))
+    assert created
+    second, created = queue.submit_unique('key', lambda job: None)
+    assert second is first and not created
+    release.set()
+    wait_done(first)
+    third, created = queue.submit_unique('key', lambda job: None)
+    assert created and third is not first
+
+
+def test_queue_full():
+    queue = JobQueue(workers=1, max_queued=2)
+    queue.submit(lambda job: None)
+    queue.submit(lambda job: None)
+    with pytest.raises(QueueFullError):
+        queue.submit(lambda job: None)
+
+
+def test_unknown_priority():
+    with pytest.raises(ValueError):
+        JobQueue(weights={'interactive': 4, 'bulk': 1}).submit(lambda job: None, priority='urgent')
+
+
+def test_finished_jobs_expire_after_ttl():
+    queue = JobQueue(workers=1, ttl=0.05)
+    queue.start()
+    job = queue.submit(lambda job: None)
+    wait_done(job)
+    assert queue.get(job.id) is job
+    time.sleep(0.1)
+    # Expired jobs are dropped when the next job is submitted
+    queue.submit(lambda job: None)
+    assert queue.get(job.id) is None
+
+
+def test_unfinished_jobs_do_not_expire():
+    release = threading.Event()
+    queue = JobQueue(workers=1, ttl=0)
+    queue.start()
+    job = queue.submit(lambda job: release.wait(5))
+    queue.submit(lambda job: None)
+    assert queue.get(job.id) is job
+    release.set()
+    wait_done(job)
+
+
+def test_weighted_fair_queuing():
+    order = []
+    queue = JobQueue(workers=1, max_queued=20, weights={'interactive': 4, 'bulk': 1})
+    jobs = [queue.submit(lambda job, p: order.append(p), p, priority=p)
+            for p in ['bulk'] * 5 + ['interactive'] * 8]
+    queue.start()
+    for job in jobs:
+        wait_done(job)
+    # Four interactive jobs for every bulk job while both classes are waiting
+    assert order[:5].count('interactive') == 4
@@ -0,0 +1,58 @@
+import time
+
+from utils.scheduler import BandwidthScheduler, TokenBucket
+
+
+def test_token_bucket_allows_a_burst():
+    bucket = TokenBucket(1000)
+    start = time.monotonic()
+    bucket.consume(1000)
+    assert time.monotonic() - start < 0.05
+
+
+def test_token_bucket_sleeps_off_debt():
+    bucket = TokenBucket(1000)
+    start = time.monotonic()
+    bucket.consume(1200)
+    assert time.monotonic() - start >= 0.15
+
+
+def test_token_bucket_lower_rate_caps_tokens():
+    bucket = TokenBucket(1000)
+    bucket.set_rate(10)
+    start = time.monotonic()
+    bucket.consume(12)
+    assert time.monotonic() - start >= 0.15
+
+
+def test_shares_follow_weights():
+    scheduler = BandwidthScheduler(max_rate=1000, weights={'interactive': 4, 'bulk': 1})
+    bulk = scheduler.attach('bulk')
+    assert bulk.rate == 1000
+    interactive = scheduler.attach('interactive')
+    assert (interactive.rate, bulk.rate) == (800, 200)
+    interactive.close()
+    assert bulk.rate == 1000
+
+
+def test_bound_params_follow_rebalancing():
+    scheduler = BandwidthScheduler(max_rate=1000)
+    shaper = scheduler.attach('bulk')
+    params = {}
+    with shaper.bound(params):
+        assert params['ratelimit'] == 1000
+        scheduler.attach('bulk')
+        assert params['ratelimit'] == 500
+
+
+def test_share_never_drops_to_zero():
+    scheduler = BandwidthScheduler(max_rate=3)
+    shapers = [scheduler.attach('bulk') for _ in range(10)]
+    assert all(shaper.rate >= 1 for shaper in shapers)
+    shapers[0].hook({'status': 'downloading', 'filename': 'f', 'downloaded_bytes': 1})
+
+
+def test_no_limit_disables_shaping():
+    shaper = BandwidthScheduler(max_rate=0).attach('bulk')
+    assert shaper.rate is None
+    shaper.hook({'status': 'downloading', 'filename': 'f', 'downloaded_bytes': 10 ** 9})
@@ -0,0 +1,90 @@
+import pytest
+
+from utils.sections import parse_timestamp, requested_section, resolve_section, section_fraction
+
+CHAPTERS = [
+    {'title': 'Intro', 'start_time': 0, 'end_time': 30},
+    {'title': 'Verse', 'start_time': 30, 'end_time': 90},
+    {'title': 'Outro', 'start_time': 90.5, 'end_time': 120},
+]
+
+
+@pytest.mark.parametrize('value, seconds', [
+    (5, 5.0),
+    (1.5, 1.5),
+    ('42', 42.0),
+    ('1:30', 90.0),
+    ('01:02:03.5', 3723.5),
+    (' 0:07 ', 7.0),
+])
+def test_parse_timestamp(value, seconds):
+    assert parse_timestamp(value) == seconds
+
+
+@pytest.mark.parametrize('value', [True, None, '', 'abc', '1:2:3:4', -1, '-5', float('nan'), float('inf')])
+def test_parse_timestamp_rejects(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+def test_requested_section_whole_video():
+    assert requested_section({}) is None
+
+
+def test_requested_section_times():
+    assert requested_section({'start': '1:00'}) == {'start': 60.0, 'end': None}
+    assert requested_section({'end': 10}) == {'start': 0.0, 'end': 10.0}
+
+
+def test_requested_section_end_before_start():
+    with pytest.raises(ValueError):
+        requested_section({'start': 20, 'end': 10})
+
+
+def test_requested_section_chapters():
+    assert requested_section({'chapters': 'Intro'}) == {'chapters': ['Intro']}
+    assert requested_section({'chapters': ['Intro', 'Verse']}) == {'chapters': ['Intro', 'Verse']}
+
+
+@pytest.mark.parametrize('data', [
+    {'chapters': 'Intro', 'start': 0},
+    {'chapters': []},
+    {'chapters': ['Intro', 3]},
+])
+def test_requested_section_bad_chapters(data):
+    with pytest.raises(ValueError):
+        requested_section(data)
+
+
+def test_resolve_section_clamps_to_duration():
+    info = {'duration': 100}
+    assert resolve_section(info, {'start': 10.0, 'end': None}) == (10.0, 100)
+    assert resolve_section(info, {'start': 10.0, 'end': 500.0}) == (10.0, 100)
+    with pytest.raises(ValueError):
+        resolve_section(info, {'start': 100.0, 'end': None})
+
+
+def test_resolve_section_unknown_duration():
+    assert resolve_section({}, {'start': 10.0, 'end': None}) == (10.0, None)
+
+
+def test_resolve_section_chapters():
+    info = {'duration': 120, 'chapters': CHAPTERS}
+    assert resolve_section(info, {'chapters': ['verse']}) == (30, 90)
+    # Order in the request does not matter, and a sub-second gap still counts as consecutive
+    assert resolve_section(info, {'chapters': ['Outro', 'Verse']}) == (30, 120)
+
+
+def test_resolve_section_chapter_errors():
+    info = {'duration': 120, 'chapters': CHAPTERS}
+    with pytest.raises(ValueError, match='No chapter named'):
+        resolve_section(info, {'chapters': ['Bridge']})
+    with pytest.raises(ValueError, match='consecutive'):
+        resolve_section(info, {'chapters': ['Intro', 'Outro']})
+
+
+def test_section_fraction():
+    assert section_fraction({'duration': 100}, 25, 75) == 0.5
+    assert section_fraction({'duration': 100}, 0, None) == 1.0
+    assert section_fraction({}, 0, 10) == 1.0
+    assert section_fraction({'duration': 100}, 50, 10) == 0.0
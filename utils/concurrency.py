@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+
+class ConnectionBudget:
+    """Global cap on concurrent fragment connections shared by all jobs.
+
+    A job asks for the number of parallel fragment downloads it would
+    like and is granted what is left, never more than per_job and never
+    less than one. When the budget is exhausted new jobs wait for running
+    ones to give connections back, so one large job cannot starve the rest.
+    """
+
+    def __init__(self, total, per_job):
+        if total < 1 or per_job < 1:
+            raise ValueError("connection limits must be at least 1")
+        self.total = total
+        self.per_job = per_job
+        self._available = total
+        self._cond = threading.Condition()
+
+    def acquire(self, wanted):
+        wanted = max(1, min(wanted, self.per_job))
+        with self._cond:
+            while self._available < 1:
+                self._cond.wait()
+            granted = min(wanted, self._available)
+            self._available -= granted
+            return granted
+
+    def release(self, granted):
+        with self._cond:
+            self._available += granted
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, wanted):
+        granted = self.acquire(wanted)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'total': self.total,
+                'per_job': self.per_job,
+                'in_use': self.total - self._available,
+            }
+
+
+def map_unordered(func, items, workers):
+    """Yield func(item) for each item as soon as it completes.
+
+    Items are pulled lazily, with at most twice as many calls in flight as
+    there are workers, so long or generated inputs are never materialized.
+    """
+    items = iter(items)
+    exhausted = False
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                while not exhausted and len(pending) < workers * 2:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(func, item))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,88 @@
+import os
+
+
+def env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+
+
+# Number of background threads running yt-dlp downloads
+DOWNLOAD_WORKERS = env_int('YTB_DOWNLOAD_WORKERS', 4)
+# Maximum number of jobs waiting for a free worker before /api/download returns 429
+DOWNLOAD_QUEUE_SIZE = env_int('YTB_DOWNLOAD_QUEUE_SIZE', 32)
+# Directory for downloads and the app's own files in it (store, job journal, thumbnails); default downloads/
+DOWNLOAD_LOCATION = os.environ.get('YTB_DOWNLOAD_DIR') or None
+# Seconds a finished job and its progress stay queryable
+JOB_TTL = env_int('YTB_JOB_TTL', 600)
+# Maximum progress events per second sent on each /api/progress/<job_id>/stream
+PROGRESS_STREAM_RATE = env_int('YTB_PROGRESS_STREAM_RATE', 4)
+# Number of extracted info dicts kept in memory
+INFO_CACHE_SIZE = env_int('YTB_INFO_CACHE_SIZE', 256)
+# Seconds an extracted info dict is reused; media URLs inside it expire after a few hours
+INFO_CACHE_TTL = env_int('YTB_INFO_CACHE_TTL', 1800)
+# Optional SQLite file that keeps the info cache across restarts
+INFO_CACHE_DB = os.environ.get('YTB_INFO_CACHE_DB') or None
+# Size limit for finished downloads kept for reuse; 0 keeps everything
+STORE_MAX_BYTES = env_int('YTB_STORE_MAX_BYTES', 0)
+# Seconds browsers may cache a finished file from /api/files/<job_id>
+FILE_MAX_AGE = env_int('YTB_FILE_MAX_AGE', 3600)
+# Set to 1 when a fronting web server handles X-Sendfile
+USE_X_SENDFILE = bool(env_int('YTB_USE_X_SENDFILE', 0))
+# Parallel fragment downloads for a DASH/HLS job that does not ask for a number
+FRAGMENT_CONCURRENCY = env_int('YTB_FRAGMENT_CONCURRENCY', 4)
+# Most parallel fragment downloads a single job may use
+MAX_FRAGMENT_CONCURRENCY = env_int('YTB_MAX_FRAGMENT_CONCURRENCY', 16)
+# Fragment connections allowed across all running jobs
+MAX_CONNECTIONS = env_int('YTB_MAX_CONNECTIONS', 32)
+# Size of each ranged request for progressive downloads; 0 lets yt-dlp read the whole file at once
+HTTP_CHUNK_SIZE = env_int('YTB_HTTP_CHUNK_SIZE', 10 * 1024 * 1024)
+# Initial read buffer size for downloads
+DOWNLOAD_BUFFER_SIZE = env_int('YTB_DOWNLOAD_BUFFER_SIZE', 64 * 1024)
+# Parallel metadata extractions for one /api/batch request
+BATCH_WORKERS = env_int('YTB_BATCH_WORKERS', 4)
+# Most entries a single /api/batch request will turn into jobs
+BATCH_MAX_ENTRIES = env_int('YTB_BATCH_MAX_ENTRIES', 500)
+# Bytes per second shared by all running downloads; 0 means unlimited
+MAX_BANDWIDTH = env_int('YTB_MAX_BANDWIDTH', 0)
+# ffmpeg postprocessors (merge, remux, transcode) allowed to run at once
+FFMPEG_WORKERS = env_int('YTB_FFMPEG_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+# Relative share of workers and bandwidth per priority class; the first one is the default
+PRIORITY_WEIGHTS = {
+    'interactive': env_int('YTB_INTERACTIVE_WEIGHT', 4),
+    'bulk': env_int('YTB_BULK_WEIGHT', 1),
+}
+# ffmpeg binary, or a directory holding one, provisioned outside the app; skips the portable download
+FFMPEG_LOCATION = os.environ.get('YTB_FFMPEG_PATH') or None
+# Archive to fetch the portable FFmpeg from, and its SHA-256; default to the release build and its published checksum
+FFMPEG_URL = os.environ.get('YTB_FFMPEG_URL') or None
+FFMPEG_SHA256 = os.environ.get('YTB_FFMPEG_SHA256') or None
+# Where jobs, progress and cached metadata live: memory://, sqlite:///state.db or redis://host:6379/0
+STATE_URL = os.environ.get('YTB_STATE_URL', 'memory://')
+# What this process runs: 'all' (web and downloads), 'web' or 'worker'; split roles need a shared STATE_URL
+ROLE = os.environ.get('YTB_ROLE', 'all')
+# Bytes the download directory may use; 0 leaves only the free space on the volume as a limit
+DISK_QUOTA = env_int('YTB_DISK_QUOTA', 0)
+# Bytes always left free on the volume holding the download directory
+DISK_MIN_FREE = env_int('YTB_DISK_MIN_FREE', 1024 ** 3)
+# Percent of the quota at which old downloads are deleted, and the percent they are deleted down to
+DISK_HIGH_WATER = env_int('YTB_DISK_HIGH_WATER', 90)
+DISK_LOW_WATER = env_int('YTB_DISK_LOW_WATER', 80)
+# Bytes reserved for a format whose size cannot be estimated
+DISK_UNKNOWN_SIZE = env_int('YTB_DISK_UNKNOWN_SIZE', 256 * 1024 ** 2)
+# Seconds a job waits for disk space to free up before it fails
+DISK_WAIT = env_int('YTB_DISK_WAIT', 300)
+# Idle yt-dlp instances kept warm per option shape, and how many jobs one serves before it is rebuilt
+YDL_POOL_SIZE = env_int('YTB_YDL_POOL_SIZE', 4)
+YDL_MAX_USES = env_int('YTB_YDL_MAX_USES', 50)
+# Widest thumbnail /api/thumbnail serves, and bytes of downscaled thumbnails kept on disk
+THUMBNAIL_WIDTH = env_int('YTB_THUMBNAIL_WIDTH', 480)
+THUMBNAIL_CACHE_BYTES = env_int('YTB_THUMBNAIL_CACHE_BYTES', 64 * 1024 ** 2)
+# Seconds clients may reuse a thumbnail, and a /api/formats response before revalidating it
+THUMBNAIL_MAX_AGE = env_int('YTB_THUMBNAIL_MAX_AGE', 86400)
+FORMATS_MAX_AGE = env_int('YTB_FORMATS_MAX_AGE', 300)
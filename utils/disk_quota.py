@@ -0,0 +1,233 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.format_index import estimate_size
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientSpaceError(Exception):
+    """A download does not fit in the disk space it may use"""
+
+
+def estimate_peak_bytes(resolved, plan, unknown=0):
+    """Most disk space downloading a resolved info dict takes at once.
+
+    Format sizes come from filesize, filesize_approx or tbr * duration,
+    with ``unknown`` bytes for a format that has none of them. When ffmpeg
+    merges or converts, its output is written next to the downloaded
+    files, so those jobs need twice the space.
+    """
+    formats = resolved.get('requested_formats') or [resolved]
+    duration = resolved.get('duration')
+    total = sum(estimate_size(fmt, duration) or unknown for fmt in formats)
+    if len(formats) > 1 or plan['path'] != 'none':
+        total *= 2
+    return total
+
+
+def _tree_size(path, skip=()):
+    """Bytes in the files under path, leaving out the directories in skip"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in skip:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+    return total
+
+
+class DiskQuota:
+    """Admission control for the disk space used by downloads.
+
+    A job reserves its estimated peak size before it starts and waits
+    while that does not fit. Files already on disk and the reservations
+    of running jobs both count as used; a running job's partial directory
+    is covered by its reservation rather than counted on top of it. Space
+    is limited to max_bytes under the directory (0 for no quota) and to
+    whatever keeps min_free bytes free on the volume.
+
+    A background reaper deletes the download store's least recently used
+    files once usage passes high_water of the quota, until it is back at
+    low_water, and whenever the volume or a waiting job needs the room.
+    """
+
+    def __init__(self, directory, store, max_bytes=0, min_free=0, high_water=0.9, low_water=0.8,
+                 partial_dir='.partial', min_idle=0, interval=60):
+        self.directory = os.path.abspath(directory)
+        self.store = store
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.high_water = high_water
+        self.low_water = low_water
+        # Store files used more recently than this are never reaped
+        self.min_idle = min_idle
+        self.interval = interval
+        self.evicted_bytes = 0
+        # Usage as of the last reaper pass, so stats() does not walk the tree on every scrape
+        self._usage = None
+        self._written = {}
+        self._measured_at = 0
+        self._partial_dir = os.path.join(self.directory, partial_dir)
+        self._reserved = {}
+        self._waiting = {}
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+
+    def check(self, nbytes):
+        """Raise InsufficientSpaceError if nbytes would not fit even with the store emptied"""
+        if self.max_bytes and nbytes > self.max_bytes:
+            raise InsufficientSpaceError(f"Download needs about {nbytes} bytes but the quota is {self.max_bytes}")
+        with self._cond:
+            reserved = sum(self._reserved.values())
+        # Everything the reaper could delete, plus what running jobs will hand back
+        reclaimable = shutil.disk_usage(self.directory).free + self.store.total_bytes() + reserved
+        if nbytes > reclaimable - self.min_free:
+            raise InsufficientSpaceError(f"Download needs about {nbytes} bytes but only "
+                                         f"{max(0, reclaimable - self.min_free)} can be freed on the volume")
+
+    def acquire(self, job_id, nbytes, timeout=None, on_wait=None):
+        """Reserve nbytes for job_id, waiting up to timeout seconds for room.
+
+        on_wait is called once if the job has to wait. Raises
+        InsufficientSpaceError when the download can never fit or no room
+        frees up in time.
+        """
+        self.check(nbytes)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                # Walk the directory before taking the lock; admission itself only does arithmetic
+                self._measure()
+                with self._cond:
+                    if nbytes <= self._room():
+                        self._reserved[job_id] = nbytes
+                        return
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise InsufficientSpaceError(f"No room for a {nbytes} byte download after {timeout}s")
+                    if job_id not in self._waiting:
+                        self._waiting[job_id] = nbytes
+                        logger.info(f"Job {job_id} waits for {nbytes} bytes of disk space")
+                        if on_wait is not None:
+                            on_wait()
+                    self._wake.set()
+                    # Space is also freed outside this process, so look again every few seconds
+                    self._cond.wait(5 if remaining is None else min(remaining, 5))
+        finally:
+            with self._cond:
+                self._waiting.pop(job_id, None)
+
+    def release(self, job_id):
+        with self._cond:
+            if self._reserved.pop(job_id, None) is not None:
+                self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, job_id, nbytes, timeout=None, on_wait=None):
+        self.acquire(job_id, nbytes, timeout, on_wait)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    def start(self):
+        threading.Thread(target=self._reap_loop, name='disk-reaper', daemon=True).start()
+        return self
+
+    def reap(self):
+        """Delete least recently used store files to get back under the marks; returns the bytes freed"""
+        usage, outstanding = self._measure()
+        with self._cond:
+            reserved = sum(self._reserved.values())
+            waiting = sum(self._waiting.values())
+        excess = 0
+        if self.max_bytes:
+            used = usage + reserved
+            if used > self.max_bytes * self.high_water or waiting:
+                excess = used + waiting - self.max_bytes * self.low_water
+        free = shutil.disk_usage(self.directory).free
+        excess = max(excess, self.min_free + outstanding + waiting - free)
+        if excess <= 0:
+            return 0
+        freed = self.store.evict(excess, self.min_idle)
+        if freed:
+            self.evicted_bytes += freed
+            self._usage = max(0, usage - freed)
+            logger.info(f"Reaped {freed} bytes of old downloads")
+            with self._cond:
+                self._cond.notify_all()
+        elif waiting:
+            logger.warning(f"Jobs wait for {waiting} bytes but no old downloads can be reaped")
+        return freed
+
+    def stats(self):
+        """Quota figures; 'used_bytes' may be up to one reaper interval old"""
+        usage = self._usage
+        if usage is None or time.monotonic() - self._measured_at > self.interval:
+            # Web-only processes run no reaper, so measure here when the figure has gone stale
+            usage, _ = self._measure()
+        with self._cond:
+            reserved = sum(self._reserved.values())
+            waiting = len(self._waiting)
+        return {
+            'max_bytes': self.max_bytes,
+            'used_bytes': usage,
+            'reserved_bytes': reserved,
+            'free_bytes': shutil.disk_usage(self.directory).free,
+            'waiting': waiting,
+            'evicted_bytes': self.evicted_bytes,
+        }
+
+    def _reap_loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Disk reaper failed")
+
+    def _measure(self):
+        """Bytes on disk outside running jobs' partial directories, and bytes still to come for those jobs.
+
+        The figures are kept for _room() and stats(). Never call this with
+        the lock held: walking a large directory would stall every
+        acquire() and release() behind it.
+        """
+        with self._cond:
+            reserved = dict(self._reserved)
+        partials = {job_id: os.path.join(self._partial_dir, job_id) for job_id in reserved}
+        usage = _tree_size(self.directory, skip=set(partials.values()))
+        written = {job_id: _tree_size(path) for job_id, path in partials.items()}
+        with self._cond:
+            self._usage = usage
+            self._written = written
+            self._measured_at = time.monotonic()
+        return usage, self._outstanding(written, reserved)
+
+    def _outstanding(self, written, reserved):
+        """Bytes reserved jobs have yet to write, given what they had written at the last measurement"""
+        return sum(max(0, nbytes - written.get(job_id, 0)) for job_id, nbytes in reserved.items())
+
+    def _room(self):
+        """Bytes a new reservation can take, from the last measurement; call with the lock held"""
+        outstanding = self._outstanding(self._written, self._reserved)
+        room = shutil.disk_usage(self.directory).free - self.min_free - outstanding
+        if self.max_bytes:
+            room = min(room, self.max_bytes - (self._usage or 0) - sum(self._reserved.values()))
+        return room
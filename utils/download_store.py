@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def store_key(extractor, video_id, format_ids, postprocessors, section=None):
+    """Content address of a download: what was fetched, which part of it and how it was processed"""
+    fields = [extractor, video_id, format_ids, postprocessors or []]
+    if section is not None:
+        # Appended only for sections so keys of whole-video downloads stay the same
+        fields.append(list(section))
+    payload = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DownloadStore:
+    """SQLite index of finished downloads so repeat requests reuse the file.
+
+    Entries are evicted least-recently-used first once the indexed files
+    exceed max_bytes (0 disables eviction); files used in the last min_idle
+    seconds are never evicted. On startup every entry is checked against
+    the file on disk and dropped if it is gone or its size no longer matches.
+    """
+
+    def __init__(self, db_path, max_bytes=0, min_idle=0):
+        self.max_bytes = max_bytes
+        self.min_idle = min_idle
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS files (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )''')
+        self._db.commit()
+        self.verify()
+
+    def verify(self):
+        """Drop entries whose file is missing or was modified behind our back"""
+        with self._lock:
+            rows = self._db.execute('SELECT key, path, size FROM files').fetchall()
+            stale = [key for key, path, size in rows if not self._intact(path, size)]
+            if stale:
+                logger.warning(f"Dropping {len(stale)} stale download store entries")
+                self._db.executemany('DELETE FROM files WHERE key = ?', [(key,) for key in stale])
+                self._db.commit()
+        return len(stale)
+
+    def lookup(self, key):
+        """Return the path stored for key, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT path, size FROM files WHERE key = ?', (key,)).fetchone()
+            if row is None or not self._intact(*row):
+                if row is not None:
+                    self._db.execute('DELETE FROM files WHERE key = ?', (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE files SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def add(self, key, path):
+        path = os.path.abspath(path)
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                             (key, path, os.path.getsize(path), now, now))
+            self._db.commit()
+            self._evict(keep=key)
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            count, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'files': count,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0,
+        }
+
+    def evict(self, nbytes, min_idle=0):
+        """Delete least recently used files until nbytes are freed; returns the bytes freed.
+
+        Files used in the last min_idle seconds are kept, so a download
+        that just finished is not deleted before its client fetches it.
+        """
+        with self._lock:
+            return self._evict_lru(nbytes, accessed_before=time.time() - min_idle)
+
+    def _evict(self, keep=None):
+        if not self.max_bytes:
+            return
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+        if total > self.max_bytes:
+            # Same guard as evict(): a file just handed out by lookup() must survive until it is served
+            self._evict_lru(total - self.max_bytes, keep=keep, accessed_before=time.time() - self.min_idle)
+
+    def _evict_lru(self, nbytes, keep=None, accessed_before=None):
+        freed = 0
+        rows = self._db.execute('SELECT key, path, size, last_access FROM files ORDER BY last_access').fetchall()
+        for key, path, size, last_access in rows:
+            if freed >= nbytes or (accessed_before is not None and last_access > accessed_before):
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+                continue
+            self._db.execute('DELETE FROM files WHERE key = ?', (key,))
+            freed += size
+            logger.info(f"Evicted {os.path.basename(path)} from download store")
+        self._db.commit()
+        return freed
+
+    @staticmethod
+    def _intact(path, size):
+        try:
+            return os.path.getsize(path) == size
+        except OSError:
+            return False
@@ -1,72 +1,287 @@
+import contextlib
+import hashlib
+import json
 import os
+import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import zipfile
 import shutil
-from urllib.request import urlretrieve
+from urllib.request import urlopen
 import platform
 
-def get_ffmpeg():
-    """Download and setup FFmpeg in a portable way"""
-    ffmpeg_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ffmpeg')
-    os.makedirs(ffmpeg_dir, exist_ok=True)
+# Where the portable FFmpeg is installed
+FFMPEG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ffmpeg')
+
+# Release archives per system; each release publishes a checksums.sha256 next to them
+FFMPEG_URLS = {
+    'windows': 'https://github.com/yt-dlp/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip',
+    'linux': 'https://github.com/yt-dlp/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-linux64-gpl.tar.xz',
+    'darwin': 'https://github.com/yt-dlp/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-macos64-gpl.zip'
+}
+
+# Size of each read from the network and from archive members
+CHUNK_SIZE = 1024 * 1024
+
+def ffmpeg_binary(directory):
+    return os.path.join(directory, 'ffmpeg.exe' if platform.system() == 'Windows' else 'ffmpeg')
+
+class ChecksumMismatchError(Exception):
+    """Raised when a downloaded FFmpeg archive does not match its SHA-256"""
+
+class _HashingReader:
+    """File-like wrapper that hashes everything read through it"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.sha256.update(data)
+        return data
 
-    # Determine the system and architecture
-    system = platform.system().lower()
-    is_64bits = sys.maxsize > 2**32
-
-    # Define download URLs for different systems
-    urls = {
-        'windows': 'https://github.com/yt-dlp/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip',
-        'linux': 'https://github.com/yt-dlp/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-linux64-gpl.tar.xz',
-        'darwin': 'https://github.com/yt-dlp/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-macos64-gpl.zip'
-    }
-
-    if not is_64bits:
-        raise Exception("32-bit systems are not supported")
-
-    if system not in urls:
-        raise Exception(f"Unsupported system: {system}")
-
-    ffmpeg_url = urls[system]
-    archive_path = os.path.join(ffmpeg_dir, 'ffmpeg_archive')
-    
-    # Download and extract FFmpeg if not already present
-    if not os.path.exists(os.path.join(ffmpeg_dir, 'ffmpeg.exe' if system == 'windows' else 'ffmpeg')):
-        print("Downloading FFmpeg...")
-        urlretrieve(ffmpeg_url, archive_path)
-        
-        print("Extracting FFmpeg...")
-        if system == 'windows':
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(ffmpeg_dir)
+    def drain(self):
+        # Archive readers stop at the end marker; the hash has to cover the whole file
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.sha256.hexdigest()
+
+@contextlib.contextmanager
+def install_lock(path):
+    """Hold an exclusive lock on ``path`` across processes"""
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    # LK_LOCK gives up after ~10 seconds; keep waiting while another process installs
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
         else:
-            import tarfile
-            with tarfile.open(archive_path) as tar:
-                tar.extractall(ffmpeg_dir)
-
-        # Clean up the archive
-        os.remove(archive_path)
-
-        # Move binaries to the main ffmpeg directory
-        for root, dirs, files in os.walk(ffmpeg_dir):
-            for file in files:
-                if file.startswith('ffmpeg') or file.startswith('ffprobe'):
-                    src = os.path.join(root, file)
-                    dst = os.path.join(ffmpeg_dir, file)
-                    shutil.move(src, dst)
-
-        # Make binaries executable on Unix-like systems
-        if system != 'windows':
-            os.chmod(os.path.join(ffmpeg_dir, 'ffmpeg'), 0o755)
-            os.chmod(os.path.join(ffmpeg_dir, 'ffprobe'), 0o755)
-
-    # Clean up any remaining extracted directories
-    for item in os.listdir(ffmpeg_dir):
-        item_path = os.path.join(ffmpeg_dir, item)
-        if os.path.isdir(item_path) and item != '__pycache__':
-            shutil.rmtree(item_path)
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def published_sha256(url):
+    """Look up an archive's SHA-256 in the checksums.sha256 published beside it"""
+    base, name = url.rsplit('/', 1)
+    with urlopen(f"{base}/checksums.sha256", timeout=30) as response:
+        for line in response.read().decode().splitlines():
+            digest, _, filename = line.strip().partition(' ')
+            if filename.lstrip(' *') == name:
+                return digest.lower()
+    raise ChecksumMismatchError(f"No published checksum for {name}")
+
+def _copy_member(src, ffmpeg_dir, name, staged):
+    """Write one archive member to a temporary file next to its final path"""
+    fd, tmp_path = tempfile.mkstemp(dir=ffmpeg_dir, prefix=f".{name}.", suffix='.tmp')
+    staged[name] = tmp_path
+    with os.fdopen(fd, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+def fetch_ffmpeg(url, ffmpeg_dir, sha256, names=('ffmpeg', 'ffprobe')):
+    """Stream an FFmpeg release archive and install just the named binaries.
+
+    tar archives are decompressed while they download and only members
+    named ``ffmpeg``/``ffprobe`` are written. zip archives keep their
+    index at the end, so they are spooled to a temporary file first and
+    then only those members are read back. The archive is hashed as it
+    arrives, and binaries are renamed into place only after the SHA-256
+    matches, so a failed or tampered download never replaces anything.
+    """
+    wanted = {name + ext for name in names for ext in ('', '.exe')}
+    staged = {}
+    try:
+        with urlopen(url, timeout=60) as response:
+            reader = _HashingReader(response)
+            if url.endswith('.zip'):
+                with tempfile.TemporaryFile(dir=ffmpeg_dir) as spool:
+                    shutil.copyfileobj(reader, spool, CHUNK_SIZE)
+                    digest = reader.drain()
+                    if digest != sha256.lower():
+                        raise ChecksumMismatchError(f"SHA-256 of {url} is {digest}, expected {sha256}")
+                    spool.seek(0)
+                    with zipfile.ZipFile(spool) as archive:
+                        for member in archive.infolist():
+                            name = os.path.basename(member.filename)
+                            if name in wanted and not member.is_dir():
+                                with archive.open(member) as src:
+                                    _copy_member(src, ffmpeg_dir, name, staged)
+            else:
+                # 'r|*' reads the compressed stream front to back without seeking
+                with tarfile.open(fileobj=reader, mode='r|*') as archive:
+                    for member in archive:
+                        name = os.path.basename(member.name)
+                        if name in wanted and member.isfile():
+                            _copy_member(archive.extractfile(member), ffmpeg_dir, name, staged)
+                digest = reader.drain()
+                if digest != sha256.lower():
+                    raise ChecksumMismatchError(f"SHA-256 of {url} is {digest}, expected {sha256}")
+
+        missing = [name for name in names if name not in staged and name + '.exe' not in staged]
+        if missing:
+            raise RuntimeError(f"{url} does not contain {', '.join(missing)}")
+        for name, tmp_path in staged.items():
+            os.chmod(tmp_path, 0o755)
+            os.replace(tmp_path, os.path.join(ffmpeg_dir, name))
+        staged.clear()
+    finally:
+        for tmp_path in staged.values():
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+def get_ffmpeg(ffmpeg_dir=FFMPEG_DIR, url=None, sha256=None):
+    """Download and setup FFmpeg in a portable way.
+
+    ``url`` and ``sha256`` default to the release build for this system
+    and its published checksum. Concurrent callers, including other
+    worker processes, serialize on a lock file and only the first one
+    downloads.
+    """
+    os.makedirs(ffmpeg_dir, exist_ok=True)
+
+    if url is None:
+        # Determine the system and architecture
+        system = platform.system().lower()
+        if sys.maxsize <= 2**32:
+            raise Exception("32-bit systems are not supported")
+        if system not in FFMPEG_URLS:
+            raise Exception(f"Unsupported system: {system}")
+        url = FFMPEG_URLS[system]
+
+    with install_lock(os.path.join(ffmpeg_dir, '.install.lock')):
+        # Another process may have finished the install while we waited for the lock
+        if not os.path.exists(ffmpeg_binary(ffmpeg_dir)):
+            print("Downloading FFmpeg...")
+            fetch_ffmpeg(url, ffmpeg_dir, sha256 or published_sha256(url))
 
     return ffmpeg_dir
 
+def probe_ffmpeg(path, cache_path):
+    """Return the version line of an ffmpeg binary, or None if it does not run.
+
+    Results are cached in ``cache_path`` keyed by the binary's size and
+    mtime, so a restart with the same binary skips the subprocess.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = [stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    entry = cache.get(path)
+    if entry and entry['signature'] == signature:
+        return entry['version']
+
+    try:
+        result = subprocess.run([path, '-version'], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    version = result.stdout.partition('\n')[0]
+    cache[path] = {'signature': signature, 'version': version}
+    try:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return version
+
+class FFmpegBootstrap:
+    """Finds ffmpeg at startup without touching the network.
+
+    Candidates are checked in order: an explicitly configured binary or
+    directory, ffmpeg on PATH, then the portable install in ``ffmpeg_dir``.
+    Only when none of them runs is the portable build downloaded, on a
+    background thread; callers that need ffmpeg wait for it through
+    ``location()``, everything else starts immediately.
+    """
+
+    def __init__(self, ffmpeg_dir=FFMPEG_DIR, configured=None, url=None, sha256=None):
+        self.ffmpeg_dir = ffmpeg_dir
+        self.configured = configured
+        self.url = url
+        self.sha256 = sha256
+        self.version = None
+        self._location = None
+        self._error = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.ffmpeg_dir, exist_ok=True)
+        for path in self._candidates():
+            if self._verify(path):
+                self._ready.set()
+                return self
+        print("FFmpeg not found, downloading it in the background...")
+        self._thread = threading.Thread(target=self._download, name='ffmpeg-download', daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def location(self, wait=True, timeout=None):
+        """Return the ffmpeg binary path, waiting for a background download if ``wait``.
+
+        Without ``wait`` this never blocks or raises; it returns None until
+        ffmpeg is available.
+        """
+        if not wait:
+            return self._location
+        if not self._ready.wait(timeout):
+            raise RuntimeError("Timed out waiting for the FFmpeg download")
+        if self._error is not None:
+            raise RuntimeError(f"FFmpeg is unavailable: {self._error}")
+        return self._location
+
+    def _candidates(self):
+        if self.configured:
+            yield ffmpeg_binary(self.configured) if os.path.isdir(self.configured) else self.configured
+        yield shutil.which('ffmpeg')
+        yield ffmpeg_binary(self.ffmpeg_dir)
+
+    def _verify(self, path):
+        if not path:
+            return False
+        version = probe_ffmpeg(path, os.path.join(self.ffmpeg_dir, '.probe.json'))
+        if version is None:
+            return False
+        self._location = path
+        self.version = version
+        return True
+
+    def _download(self):
+        try:
+            get_ffmpeg(self.ffmpeg_dir, self.url, self.sha256)
+            if not self._verify(ffmpeg_binary(self.ffmpeg_dir)):
+                raise RuntimeError("downloaded ffmpeg does not run")
+            print("FFmpeg is ready")
+        except Exception as e:
+            self._error = e
+        finally:
+            self._ready.set()
+
 
 
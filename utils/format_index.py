@@ -0,0 +1,146 @@
+import re
+from bisect import bisect_left
+
+# The selectors resolve() follows: best, bestvideo or bestaudio, optionally limited to one extension
+SIMPLE_SELECTOR_RE = re.compile(r'^(best|bestvideo|bestaudio)(?:\[ext=(\w+)\])?$')
+
+
+def codec_family(codec):
+    """'avc1.640028' -> 'avc1'; None/'none' -> None"""
+    if not codec or codec == 'none':
+        return None
+    return codec.split('.')[0].lower()
+
+
+def estimate_size(fmt, duration):
+    """Size in bytes from filesize, filesize_approx or tbr * duration; 0 if unknown"""
+    if not fmt:
+        return 0
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    tbr = fmt.get('tbr')
+    if tbr and duration:
+        # tbr is in kbit/s
+        return int(tbr * 1000 / 8 * duration)
+    return 0
+
+
+class FormatIndex:
+    """Lookup structure over info['formats'], built in one pass per info dict.
+
+    Video formats are bucketed by height with the heights kept sorted for
+    bisect lookups; per codec family buckets are built on first use. The
+    best audio, video-only and muxed formats are precomputed per extension.
+    """
+
+    def __init__(self, info):
+        self.duration = info.get('duration') or 0
+        self._video = []
+        self._best_audio = {}
+        self._best_video = {'bestvideo': {}, 'best': {}}
+        self._by_id = {}
+        heights = {}
+        audio_ranks = {}
+        video_ranks = {'bestvideo': {}, 'best': {}}
+
+        for fmt in info.get('formats') or ():
+            self._by_id[fmt.get('format_id')] = fmt
+            vcodec = fmt.get('vcodec', 'none')
+            if vcodec != 'none':
+                height = fmt.get('height')
+                if not height:
+                    continue
+                self._video.append(fmt)
+                # Keep the first format seen at each height, matching a stable sort
+                if height not in heights:
+                    heights[height] = fmt
+                kind = 'bestvideo' if fmt.get('acodec') in (None, 'none') else 'best'
+                rank = (height, fmt.get('fps') or 0, fmt.get('tbr') or 0)
+                for ext in (fmt.get('ext'), None):
+                    if ext not in video_ranks[kind] or rank > video_ranks[kind][ext]:
+                        video_ranks[kind][ext] = rank
+                        self._best_video[kind][ext] = fmt
+            elif fmt.get('acodec') not in (None, 'none'):
+                rank = (fmt.get('abr') or fmt.get('tbr') or 0, self.estimate_size(fmt))
+                for ext in (fmt.get('ext'), None):
+                    if ext not in audio_ranks or rank > audio_ranks[ext]:
+                        audio_ranks[ext] = rank
+                        self._best_audio[ext] = fmt
+
+        self._buckets = {None: heights}
+        self._heights = {None: sorted(heights)}
+
+    def nearest(self, height, codec=None):
+        """Video format whose height is closest to height; ties go to the taller one"""
+        if codec not in self._heights:
+            self._index_codec(codec)
+        heights = self._heights[codec]
+        if not heights:
+            return None
+        i = bisect_left(heights, height)
+        if i == len(heights):
+            best = heights[-1]
+        elif i == 0 or heights[i] - height <= height - heights[i - 1]:
+            best = heights[i]
+        else:
+            best = heights[i - 1]
+        return self._buckets[codec][best]
+
+    def best_audio(self, ext=None):
+        """Highest bitrate audio-only format, optionally limited to one extension"""
+        return self._best_audio.get(ext)
+
+    def video_formats(self, ext=None):
+        """One format per width x height (highest fps wins), tallest first"""
+        chosen = {}
+        for fmt in self._video:
+            if ext and fmt.get('ext') != ext:
+                continue
+            if not fmt.get('width'):
+                continue
+            key = (fmt['width'], fmt['height'])
+            current = chosen.get(key)
+            if current is None or (fmt.get('fps') or 0) > (current.get('fps') or 0):
+                chosen[key] = fmt
+        return sorted(chosen.values(), key=lambda f: (f['height'], f.get('fps') or 0), reverse=True)
+
+    def resolve(self, format_spec):
+        """Cheap stand-in for utils.ytdl.resolve_format on simple specs; None for specs it cannot follow.
+
+        Understands '/' alternatives of this video's format IDs and best, bestvideo or
+        bestaudio with an optional [ext=...], joined by '+'. Formats are
+        ranked by height and bitrate rather than yt-dlp's full sort order,
+        so the result is an estimate of what a download will fetch.
+        """
+        for alternative in format_spec.split('/'):
+            formats = []
+            for selector in alternative.split('+'):
+                selector = selector.strip()
+                match = SIMPLE_SELECTOR_RE.match(selector)
+                if match:
+                    kind, ext = match.groups()
+                    fmt = self.best_audio(ext) if kind == 'bestaudio' else self._best_video[kind].get(ext)
+                elif selector in self._by_id:
+                    fmt = self._by_id[selector]
+                else:
+                    # Filters, sort keys, and words yt-dlp may read as an extension or shorthand
+                    return None
+                formats.append(fmt)
+            if all(formats):
+                if len(formats) == 1:
+                    return {**formats[0], 'duration': self.duration}
+                return {'requested_formats': formats, 'duration': self.duration}
+        return None
+
+    def estimate_size(self, fmt):
+        """Size in bytes from filesize, filesize_approx or tbr * duration; 0 if unknown"""
+        return estimate_size(fmt, self.duration)
+
+    def _index_codec(self, codec):
+        bucket = {}
+        for fmt in self._video:
+            if codec_family(fmt['vcodec']) == codec and fmt['height'] not in bucket:
+                bucket[fmt['height']] = fmt
+        self._buckets[codec] = bucket
+        self._heights[codec] = sorted(bucket)
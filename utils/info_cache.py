@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Matches the 11 character video ID in the common YouTube URL shapes
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)|youtu\.be/)'
+    r'([0-9A-Za-z_-]{11})'
+)
+
+
+def video_key(url):
+    """Normalize a URL to a cache key, using the video ID when we can find one"""
+    url = url.strip()
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return f"youtube:{match.group(1)}"
+    parts = urlsplit(url)
+    # Drop the fragment and normalize scheme/host case for everything else
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+class InfoCache:
+    """LRU + TTL cache of yt-dlp info dicts keyed by video_key().
+
+    Entries live in memory and, when db_path is set, in a SQLite file so
+    they survive restarts. With a ``shared`` state backend (see
+    utils.state) other processes reuse each other's extractions too.
+    Cached dicts are shared between callers, so copy them before handing
+    them to anything that mutates its input.
+    """
+
+    def __init__(self, max_entries=256, ttl=1800, db_path=None, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # The SQLite connection has its own lock so disk lookups never hold up memory hits
+        self._db_lock = threading.Lock()
+        self._extractions = SingleFlight()
+        self._shared = shared
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, expires_at REAL, info TEXT)')
+            self._db.execute('DELETE FROM info WHERE expires_at < ?', (time.time(),))
+            self._db.commit()
+
+    def get(self, url):
+        key = video_key(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, info = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return info
+                del self._entries[key]
+        # Disk and shared backend lookups run without the lock so memory hits never wait on them
+        info = self._load(key, now)
+        with self._lock:
+            if info is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        return info
+
+    def set(self, url, info):
+        key = video_key(url)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, info)
+        if self._db is not None:
+            data = json.dumps(info)
+            with self._db_lock:
+                self._db.execute('INSERT OR REPLACE INTO info VALUES (?, ?, ?)', (key, expires_at, data))
+                self._db.commit()
+        if self._shared is not None:
+            self._shared.set(f"info:{key}", json.dumps([expires_at, info]), ttl=self.ttl)
+
+    def get_or_extract(self, url, extract):
+        """Return cached info for url, calling extract(url) on a miss.
+
+        Concurrent misses for the same video share a single extraction.
+        """
+        info = self.get(url)
+        if info is None:
+            info = self._extractions.do(video_key(url), self._extract, url, extract)
+        return info
+
+    def _extract(self, url, extract):
+        info = extract(url)
+        self.set(url, info)
+        return info
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'shared_extractions': self._extractions.shared,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0,
+            }
+
+    def _remember(self, key, expires_at, info):
+        # Call with self._lock held
+        self._entries[key] = (expires_at, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key, now):
+        row = None
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute('SELECT expires_at, info FROM info WHERE key = ?', (key,)).fetchone()
+        if row is None and self._shared is not None:
+            data = self._shared.get(f"info:{key}")
+            if data is not None:
+                expires_at, info = json.loads(data)
+                with self._lock:
+                    self._remember(key, expires_at, info)
+                return info
+        if row is None:
+            return None
+        expires_at, data = row
+        if expires_at <= now:
+            with self._db_lock:
+                self._db.execute('DELETE FROM info WHERE key = ?', (key,))
+                self._db.commit()
+            return None
+        info = json.loads(data)
+        with self._lock:
+            self._remember(key, expires_at, info)
+        return info
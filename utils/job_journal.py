@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Jobs in these states were cut off by a restart and can be resumed
+UNFINISHED = ('queued', 'running')
+
+
+class JobJournal:
+    """Persistent record of download jobs so a restart can pick them up again.
+
+    Backed by SQLite in WAL mode; each job is stored with the arguments it
+    was queued with and its last known status. Rows are tagged with
+    ``owner`` so apps sharing a downloads directory only resume the jobs
+    they queued themselves.
+    """
+
+    def __init__(self, db_path, ttl=600, owner=None):
+        self.ttl = ttl
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            args TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            owner TEXT
+        )''')
+        self._db.commit()
+
+    def record(self, job_id, args):
+        now = time.time()
+        with self._lock:
+            # Finished jobs are only kept as long as their progress is queryable
+            self._db.execute('DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?',
+                             UNFINISHED + (now - self.ttl,))
+            self._db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, NULL, ?, ?, ?)',
+                             (job_id, json.dumps(args), 'queued', now, now, self.owner))
+            self._db.commit()
+
+    def mark(self, job_id, status, error=None):
+        with self._lock:
+            self._db.execute('UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                             (status, error, time.time(), job_id))
+            self._db.commit()
+
+    def forget(self, job_id):
+        with self._lock:
+            self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self._db.commit()
+
+    def unfinished(self):
+        """(job_id, args) for every job of ours that never reached a final state"""
+        with self._lock:
+            rows = self._db.execute('SELECT id, args FROM jobs WHERE status IN (?, ?) AND owner IS ? ORDER BY created_at',
+                                    UNFINISHED + (self.owner,)).fetchall()
+        return [(job_id, json.loads(args)) for job_id, args in rows]
@@ -0,0 +1,387 @@
+import collections
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+class Job:
+    """State of a single queued job"""
+
+    def __init__(self, func, args, kwargs, job_id=None, priority=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = None
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'error')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """Bounded queue drained by a fixed pool of worker threads.
+
+    Jobs are called as ``func(job, *args, **kwargs)`` so they can report
+    extra state on the job object. Whatever the function returns is stored
+    in ``job.result``; an exception marks the job as failed.
+
+    Each priority class has its own FIFO and free workers pick between
+    classes by weighted fair queuing, so with weights 4:1 a backlog of bulk
+    jobs gets one worker slot for every four interactive jobs instead of
+    starving them or being starved.
+    """
+
+    def __init__(self, workers=4, max_queued=32, name='jobs', ttl=600, weights=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.name = name
+        self.workers = workers
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self.weights = weights or {'default': 1}
+        self.default_priority = next(iter(self.weights))
+        self._pending = {priority: collections.deque() for priority in self.weights}
+        # Virtual finish time per class; the smallest one among waiting classes runs next
+        self._pass = dict.fromkeys(self.weights, 0.0)
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads; jobs queued before this wait for it"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def task(self, func):
+        """Declare func as a job function; in-process queues can run any callable"""
+        return func
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a job, raising QueueFullError when the queue is at capacity"""
+        job, _ = self.submit_unique(None, func, *args, **kwargs)
+        return job
+
+    def submit_unique(self, key, func, *args, job_id=None, priority=None, **kwargs):
+        """Queue a job unless an unfinished job with the same key exists.
+
+        Returns ``(job, created)``; when ``created`` is False the caller has
+        been attached to the job already running for ``key``. ``job_id``
+        reuses a known ID, e.g. when resuming a job after a restart.
+        """
+        priority = priority or self.default_priority
+        if priority not in self._pending:
+            raise ValueError(f"Unknown priority: {priority}")
+        with self._lock:
+            if key is not None:
+                job = self._active.get(key)
+                if job is not None and not job.done:
+                    return job, False
+            self._evict_expired()
+            if self._queued() >= self.max_queued:
+                raise QueueFullError(f"{self.name} queue is full ({self.max_queued} jobs waiting)")
+            job = Job(func, args, kwargs, job_id=job_id, priority=priority)
+            if not self._pending[priority]:
+                # A class that sat idle does not bank credit for later
+                waiting = [self._pass[p] for p, jobs in self._pending.items() if jobs]
+                if waiting:
+                    self._pass[priority] = max(self._pass[priority], min(waiting))
+            self._pending[priority].append(job)
+            self._jobs[job.id] = job
+            if key is not None:
+                job.key = key
+                self._active[key] = job
+            self._ready.notify()
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            by_priority = {priority: len(pending) for priority, pending in self._pending.items()}
+        return {
+            'workers': self.workers,
+            'queued': sum(1 for job in jobs if job.status == 'queued'),
+            'running': sum(1 for job in jobs if job.status == 'running'),
+            'max_queued': self.max_queued,
+            'queued_by_priority': by_priority,
+        }
+
+    def _queued(self):
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def _next_job(self):
+        priority = min((p for p, jobs in self._pending.items() if jobs), key=self._pass.get)
+        self._pass[priority] += 1 / self.weights[priority]
+        return self._pending[priority].popleft()
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.done and job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            with self._ready:
+                while not self._queued():
+                    self._ready.wait()
+                job = self._next_job()
+                job.status = 'running'
+                job.started_at = time.time()
+            result, error = None, None
+            try:
+                result = job.func(job, *job.args, **job.kwargs)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                error = str(e)
+            finally:
+                with self._lock:
+                    # finished_at before status, so a job never looks done without it
+                    job.finished_at = time.time()
+                    job.result, job.error = result, error
+                    job.status = 'error' if error is not None else 'finished'
+                    if job.key is not None and self._active.get(job.key) is job:
+                        del self._active[job.key]
+
+
+def _dump_job(job, task):
+    return json.dumps({**job.to_dict(), 'key': job.key, 'task': task, 'args': job.args, 'kwargs': job.kwargs})
+
+
+def _load_job(data):
+    record = json.loads(data)
+    job = Job(None, tuple(record['args']), record['kwargs'], job_id=record['job_id'], priority=record['priority'])
+    job.key = tuple(record['key']) if record['key'] is not None else None
+    for field in ('status', 'error', 'result', 'created_at', 'started_at', 'finished_at'):
+        setattr(job, field, record[field])
+    return job, record['task']
+
+
+class SharedJobQueue:
+    """JobQueue whose jobs live in a shared state backend (see utils.state).
+
+    Any process can submit and inspect jobs; processes that call start()
+    also run them. Job functions are looked up by name, so every process
+    must declare them with the ``task`` decorator, and their arguments and
+    results must be JSON serializable.
+
+    A running job holds a lease its worker renews every few seconds. When
+    a worker dies, its lease runs out and another worker puts the job
+    back at the front of its queue.
+    """
+
+    def __init__(self, backend, workers=4, max_queued=32, name='jobs', ttl=600, weights=None, lease=30):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.backend = backend
+        self.name = name
+        self.workers = workers
+        self.ttl = ttl
+        self.lease = lease
+        self.max_queued = max_queued
+        self.weights = weights or {'default': 1}
+        self.default_priority = next(iter(self.weights))
+        # Stride scheduling is per process; each one serves the classes in weighted proportion
+        self._pass = dict.fromkeys(self.weights, 0.0)
+        self._tasks = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def task(self, func):
+        """Register func so workers in any process can run jobs submitted with it"""
+        self._tasks[func.__name__] = func
+        return func
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name=f"{self.name}-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        job, _ = self.submit_unique(None, func, *args, **kwargs)
+        return job
+
+    def submit_unique(self, key, func, *args, job_id=None, priority=None, **kwargs):
+        """Queue a job unless an unfinished job with the same key exists, in any process"""
+        priority = priority or self.default_priority
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority: {priority}")
+        active_key = f"{self.name}:active:{json.dumps(key)}"
+        if key is not None:
+            existing = self._active_job(active_key)
+            if existing is not None:
+                return existing, False
+        if self._queued() >= self.max_queued:
+            raise QueueFullError(f"{self.name} queue is full ({self.max_queued} jobs waiting)")
+
+        job = Job(func, args, kwargs, job_id=job_id, priority=priority)
+        job.key = key
+        if key is not None and not self.backend.set_nx(active_key, job.id):
+            # Another process queued the same key between our check and now
+            existing = self._active_job(active_key)
+            if existing is not None:
+                return existing, False
+            self.backend.set(active_key, job.id)
+        self._save(job, func.__name__)
+        self.backend.push(f"{self.name}:queue:{priority}", job.id)
+        return job, True
+
+    def get(self, job_id):
+        data = self.backend.get(f"{self.name}:job:{job_id}")
+        return _load_job(data)[0] if data is not None else None
+
+    def stats(self):
+        by_priority = {priority: self.backend.length(f"{self.name}:queue:{priority}") for priority in self.weights}
+        return {
+            'workers': self.workers,
+            'queued': sum(by_priority.values()),
+            'running': len(self.backend.hgetall(f"{self.name}:running")),
+            'max_queued': self.max_queued,
+            'queued_by_priority': by_priority,
+        }
+
+    def recover(self):
+        """Requeue running jobs whose worker stopped renewing their lease"""
+        for job_id in self.backend.hgetall(f"{self.name}:running"):
+            if self.backend.get(f"{self.name}:lease:{job_id}") is not None:
+                continue
+            # Only one process recovers a given job
+            if not self.backend.set_nx(f"{self.name}:recover:{job_id}", '1', ttl=self.lease):
+                continue
+            self.backend.hdel(f"{self.name}:running", job_id)
+            data = self.backend.get(f"{self.name}:job:{job_id}")
+            if data is None:
+                continue
+            job, task = _load_job(data)
+            if job.done:
+                continue
+            logger.warning(f"Requeueing job {job_id} after its worker stopped")
+            job.status = 'queued'
+            job.started_at = None
+            self._save(job, task)
+            self.backend.push(f"{self.name}:queue:{job.priority}", job.id, front=True)
+
+    def _active_job(self, active_key):
+        job_id = self.backend.get(active_key)
+        job = self.get(job_id) if job_id is not None else None
+        return job if job is not None and not job.done else None
+
+    def _queued(self):
+        return sum(self.backend.length(f"{self.name}:queue:{priority}") for priority in self.weights)
+
+    def _save(self, job, task, ttl=None):
+        self.backend.set(f"{self.name}:job:{job.id}", _dump_job(job, task), ttl=ttl)
+
+    def _next_order(self):
+        with self._lock:
+            return sorted(self.weights, key=self._pass.get)
+
+    def _worker(self):
+        while True:
+            order = self._next_order()
+            try:
+                popped = self.backend.pop([f"{self.name}:queue:{priority}" for priority in order], timeout=5)
+                if popped is None:
+                    continue
+                name, job_id = popped
+                priority = name.rsplit(':', 1)[1]
+                with self._lock:
+                    # Classes ahead of this one in the order were empty and do not bank credit
+                    for skipped in order[:order.index(priority)]:
+                        self._pass[skipped] = max(self._pass[skipped], self._pass[priority])
+                    self._pass[priority] += 1 / self.weights[priority]
+                data = self.backend.get(f"{self.name}:job:{job_id}")
+                if data is not None:
+                    self._run(*_load_job(data))
+            except Exception as e:
+                # The job's lease lapses and recover() requeues it once the backend is back
+                logger.error(f"State backend error in {self.name} worker: {e}")
+                time.sleep(5)
+
+    def _run(self, job, task):
+        self.backend.set(f"{self.name}:lease:{job.id}", '1', ttl=self.lease)
+        self.backend.hset(f"{self.name}:running", job.id, '1')
+        with self._lock:
+            self._running.add(job.id)
+        job.status = 'running'
+        job.started_at = time.time()
+        self._save(job, task)
+        error = None
+        try:
+            func = self._tasks.get(task)
+            if func is None:
+                raise RuntimeError(f"No task named {task} is registered in this process")
+            job.result = func(job, *job.args, **job.kwargs)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            error = str(e)
+        finally:
+            # finished_at before status, so a job never looks done without it
+            job.finished_at = time.time()
+            job.error = error
+            job.status = 'error' if error is not None else 'finished'
+            self._save(job, task, ttl=self.ttl)
+            if job.key is not None:
+                active_key = f"{self.name}:active:{json.dumps(job.key)}"
+                if self.backend.get(active_key) == job.id:
+                    self.backend.delete(active_key)
+            self.backend.hdel(f"{self.name}:running", job.id)
+            self.backend.delete(f"{self.name}:lease:{job.id}")
+            with self._lock:
+                self._running.discard(job.id)
+
+    def _heartbeat(self):
+        last_recovery = 0
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                for job_id in running:
+                    self.backend.expire(f"{self.name}:lease:{job_id}", self.lease)
+                if time.monotonic() - last_recovery >= self.lease:
+                    last_recovery = time.monotonic()
+                    self.recover()
+            except Exception as e:
+                logger.error(f"Job heartbeat failed: {e}")
@@ -0,0 +1,227 @@
+import contextlib
+import threading
+import time
+
+from utils.postprocess import runs_ffmpeg
+
+# Histogram buckets in seconds, from a cached lookup up to a long download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Gauge:
+    """Value read from a callback at scrape time.
+
+    ``func`` returns a number, or a dict of label value -> number when the
+    gauge has a ``label``.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, func, label=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label = label
+
+    def samples(self):
+        value = self.func()
+        if self.label is None:
+            yield self.name, '', value
+            return
+        for label_value, sample in value.items():
+            yield self.name, _format_labels((self.label,), (label_value,)), sample
+
+
+class Histogram:
+    """Cumulative bucket histogram, optionally split by label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = (('le', _format_value(bound)),)
+                yield f'{self.name}_bucket', _format_labels(self.labels, key, le), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labels, key), values[-1]
+            yield f'{self.name}_count', _format_labels(self.labels, key), cumulative
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix='ytb_'):
+        self.prefix = prefix
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self.prefix + name, help, labels))
+
+    def gauge(self, name, help, func, label=None):
+        return self._register(Gauge(self.prefix + name, help, func, label))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, help, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class ByteMeter:
+    """yt-dlp progress hook that counts downloaded bytes.
+
+    Deltas are summed locally and pushed into the shared counter at most
+    once per ``interval`` seconds, so the per-chunk cost is a subtraction
+    and a clock read rather than a lock round trip.
+    """
+
+    def __init__(self, counter, interval=1.0):
+        self.counter = counter
+        self.interval = interval
+        self.total = 0
+        self._pending = 0
+        self._seen = {}
+        self._flushed_at = time.monotonic()
+
+    def __call__(self, d):
+        if d['status'] not in ('downloading', 'finished'):
+            return
+        filename = d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        delta = downloaded - self._seen.get(filename, 0)
+        self._seen[filename] = downloaded
+        if delta > 0:
+            self.total += delta
+            self._pending += delta
+        now = time.monotonic()
+        if d['status'] == 'finished' or now - self._flushed_at >= self.interval:
+            self.flush(now)
+
+    def flush(self, now=None):
+        if self._pending:
+            self.counter.inc(self._pending)
+            self._pending = 0
+        self._flushed_at = now or time.monotonic()
+
+
+class PhaseTimer:
+    """Times the phases of one job into a histogram labelled by phase.
+
+    ffmpeg time is picked up through ``postprocessor_hook`` and taken out
+    of the 'download' phase that wraps it, so each phase is reported once.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.durations = {}
+        self._postprocess_started = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+
+    def postprocessor_hook(self, d):
+        if not runs_ffmpeg(d.get('postprocessor', '')):
+            return
+        if d['status'] == 'started':
+            self._postprocess_started = time.perf_counter()
+        elif d['status'] == 'finished' and self._postprocess_started is not None:
+            self.add('postprocess', time.perf_counter() - self._postprocess_started)
+            self._postprocess_started = None
+
+    def observe(self):
+        if 'download' in self.durations and 'postprocess' in self.durations:
+            self.durations['download'] = max(0, self.durations['download'] - self.durations['postprocess'])
+        for name, seconds in self.durations.items():
+            self.histogram.observe(seconds, phase=name)
@@ -0,0 +1,87 @@
+import functools
+
+# Codecs ffmpeg can stream-copy into an MP4 container
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'hevc', 'h265', 'av01', 'vp09', 'vp9')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3', 'opus', 'ac-3', 'ec-3', 'flac', 'alac')
+
+
+@functools.lru_cache(maxsize=None)
+def runs_ffmpeg(key):
+    """Whether the postprocessor a yt-dlp hook reports as key runs ffmpeg.
+
+    Hooks get pp_key(), which drops the FFmpeg prefix: FFmpegMergerPP
+    reports 'Merger', so the name alone does not tell.
+    """
+    from yt_dlp.postprocessor import get_postprocessor
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+    for name in ('FFmpeg' + key, key):
+        try:
+            return issubclass(get_postprocessor(name), FFmpegPostProcessor)
+        except KeyError:
+            pass
+    return False
+
+
+def _codec_fits(codec, allowed):
+    if not codec or codec == 'none':
+        return True
+    return codec.lower().split('.')[0] in allowed
+
+
+def plan_postprocessors(resolved, audio_codec=None):
+    """Pick the cheapest postprocessor chain for the formats in a resolved info dict.
+
+    Returns a dict with the yt-dlp 'postprocessors' list, the
+    'merge_output_format' to use, the 'path' taken and whether that path
+    'needs_ffmpeg'. The paths are 'none' when the download is already a
+    usable MP4, 'merge' when the merger stream-copies separate video and
+    audio into MP4, 'remux' for a stream copy into MP4, 'transcode' when
+    the codecs force a re-encode, and 'copy' for audio extraction that
+    keeps the source codec. Every path but 'none' runs ffmpeg.
+    """
+    formats = resolved.get('requested_formats') or [resolved]
+
+    if audio_codec:
+        acodec = (formats[-1].get('acodec') or '').lower()
+        path = 'copy' if acodec.split('.')[0] == audio_codec else 'transcode'
+        return {
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': audio_codec,
+                'preferredquality': '192',
+            }],
+            'merge_output_format': None,
+            'path': path,
+            'needs_ffmpeg': True,
+        }
+
+    merged = len(formats) > 1
+    codecs_known = all(fmt.get('vcodec') or fmt.get('acodec') for fmt in formats)
+    if not codecs_known and not merged and resolved.get('ext') == 'mp4':
+        # Nothing to go on but the container; trust it like FFmpegVideoConvertor would
+        return {'postprocessors': [], 'merge_output_format': 'mp4', 'path': 'none', 'needs_ffmpeg': False}
+
+    copyable = codecs_known and all(
+        _codec_fits(fmt.get('vcodec'), MP4_VIDEO_CODECS) and _codec_fits(fmt.get('acodec'), MP4_AUDIO_CODECS)
+        for fmt in formats
+    )
+    if copyable:
+        if merged:
+            # The merger already stream-copies into mp4
+            return {'postprocessors': [], 'merge_output_format': 'mp4', 'path': 'merge', 'needs_ffmpeg': True}
+        if resolved.get('ext') == 'mp4':
+            return {'postprocessors': [], 'merge_output_format': 'mp4', 'path': 'none', 'needs_ffmpeg': False}
+        return {
+            'postprocessors': [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mp4'}],
+            'merge_output_format': 'mp4',
+            'path': 'remux',
+            'needs_ffmpeg': True,
+        }
+
+    # Merge into mkv first since mp4 cannot hold these codecs, then re-encode
+    return {
+        'postprocessors': [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}],
+        'merge_output_format': 'mkv',
+        'path': 'transcode',
+        'needs_ffmpeg': True,
+    }
@@ -0,0 +1,269 @@
+import json
+import threading
+import time
+import weakref
+
+
+class ProgressRecord:
+    """Progress of a single download job.
+
+    Each record is written only by the worker thread running its job, so
+    fields are updated with plain attribute assignment; readers take a
+    snapshot with to_dict(). Writers call publish() after a batch of
+    updates so shared registries can store them.
+    """
+
+    # Fields stored by shared registries
+    STATE_FIELDS = ('job_id', 'status', 'downloaded_bytes', 'total_bytes', 'speed', 'eta',
+                    'percentage', 'filename', 'error', 'updated_at', 'finished_at')
+
+    __slots__ = STATE_FIELDS + ('on_publish', '__weakref__')
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = 'queued'
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.speed = 0
+        self.eta = 0
+        self.percentage = 0
+        self.filename = ''
+        self.error = None
+        self.updated_at = time.time()
+        self.finished_at = None
+        self.on_publish = None
+
+    def update(self, d):
+        """Apply a yt-dlp progress hook dict to this record"""
+        if d['status'] == 'downloading':
+            downloaded_bytes = d.get('downloaded_bytes') or 0
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            self.status = 'downloading'
+            self.downloaded_bytes = downloaded_bytes
+            self.total_bytes = total_bytes
+            self.speed = d.get('speed') or 0
+            self.eta = d.get('eta') or 0
+            self.filename = d.get('filename', '')
+            self.percentage = (downloaded_bytes / total_bytes) * 100 if total_bytes else 0
+        elif d['status'] == 'finished':
+            self.status = 'finished'
+            self.downloaded_bytes = d.get('downloaded_bytes') or self.downloaded_bytes
+            self.total_bytes = d.get('total_bytes') or self.total_bytes
+            self.percentage = 100
+        self.updated_at = time.time()
+
+    def publish(self):
+        if self.on_publish is not None:
+            self.on_publish(self)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'speed': self.speed,
+            'eta': self.eta,
+            'percentage': self.percentage,
+            'filename': self.filename,
+            'error': self.error,
+            # Set once the whole job is done; 'finished' alone may only mean one of its formats
+            'finished_at': self.finished_at,
+        }
+
+
+class ProgressRegistry:
+    """Job-keyed progress records with TTL eviction of finished jobs"""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def track(self, job_id):
+        """Return the record for job_id, creating it if needed"""
+        with self._lock:
+            self._evict_expired()
+            record = self._records.get(job_id)
+            if record is None:
+                record = self._records[job_id] = ProgressRecord(job_id)
+        return record
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_expired()
+            return self._records.get(job_id)
+
+    def finish(self, job_id, error=None):
+        """Mark a job as done; its record is dropped ``ttl`` seconds later"""
+        record = self.get(job_id)
+        if record is None:
+            return
+        if error is not None:
+            record.status = 'error'
+            record.error = error
+        else:
+            record.status = 'finished'
+            record.percentage = 100
+        record.finished_at = record.updated_at = time.time()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, record in self._records.items()
+                   if record.finished_at is not None and record.finished_at < cutoff]
+        for job_id in expired:
+            del self._records[job_id]
+
+
+class SharedProgressRegistry:
+    """ProgressRegistry kept in a shared state backend (see utils.state).
+
+    The worker running a job writes its record to the backend each time
+    the record is published; any process can read it back. Finished
+    records expire from the backend after ``ttl`` seconds.
+    """
+
+    def __init__(self, backend, ttl=600):
+        self.backend = backend
+        self.ttl = ttl
+        # Held weakly: a process that only queued the job drops its record right away,
+        # the worker running it keeps it alive until finish()
+        self._tracked = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def track(self, job_id):
+        with self._lock:
+            record = self._tracked.get(job_id)
+            if record is None:
+                record = self.get(job_id) or ProgressRecord(job_id)
+                record.on_publish = self._save
+                self._tracked[job_id] = record
+        record.publish()
+        return record
+
+    def get(self, job_id):
+        data = self.backend.get(f"progress:{job_id}")
+        if data is None:
+            return None
+        record = ProgressRecord(job_id)
+        for field, value in json.loads(data).items():
+            setattr(record, field, value)
+        return record
+
+    def finish(self, job_id, error=None):
+        # Prefer this process's record; it has fields set since the last publish
+        with self._lock:
+            record = self._tracked.pop(job_id, None)
+        record = record or self.get(job_id)
+        if record is None:
+            return
+        if error is not None:
+            record.status = 'error'
+            record.error = error
+        else:
+            record.status = 'finished'
+            record.percentage = 100
+        record.finished_at = record.updated_at = time.time()
+        self._save(record, ttl=self.ttl)
+
+    def _save(self, record, ttl=None):
+        data = {field: getattr(record, field) for field in ProgressRecord.STATE_FIELDS}
+        self.backend.set(f"progress:{record.job_id}", json.dumps(data), ttl=ttl)
+
+
+class ProgressHook:
+    """yt-dlp progress hook that publishes into a ProgressRecord.
+
+    yt-dlp calls progress hooks for every block it reads, thousands of
+    times per second on a fast link. Chunks that arrive within
+    ``interval`` seconds of the last publish return after a clock read;
+    otherwise the record is updated with plain numbers, no formatting.
+    Speed is an exponentially weighted moving average of the byte rate
+    between publishes, and ETA is derived from it, so both stay steady
+    instead of tracking yt-dlp's per-chunk estimates.
+    """
+
+    def __init__(self, record, interval=0.25, smoothing=0.3):
+        self.record = record
+        self.interval = interval
+        self.smoothing = smoothing
+        self._published_at = None
+        self._published_bytes = 0
+        self._filename = None
+
+    def __call__(self, d):
+        if d['status'] != 'downloading':
+            # Status changes are rare and always published
+            self.record.update(d)
+            self.record.publish()
+            return
+        now = time.monotonic()
+        if self._published_at is not None and now - self._published_at < self.interval:
+            return
+
+        record = self.record
+        downloaded = d.get('downloaded_bytes') or 0
+        filename = d.get('filename', '')
+        if filename != self._filename or downloaded < self._published_bytes:
+            # A new file (e.g. audio after video) starts a new rate sample
+            self._filename = filename
+            self._published_at = None
+            self._published_bytes = 0
+        if self._published_at is not None:
+            rate = (downloaded - self._published_bytes) / (now - self._published_at)
+            record.speed = rate if not record.speed else record.speed + self.smoothing * (rate - record.speed)
+        elif not record.speed:
+            # Seed the average with yt-dlp's own estimate
+            record.speed = d.get('speed') or 0
+        self._published_at = now
+        self._published_bytes = downloaded
+
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+        record.status = 'downloading'
+        record.downloaded_bytes = downloaded
+        record.total_bytes = total
+        record.filename = filename
+        record.percentage = downloaded * 100 / total if total else 0
+        record.eta = int((total - downloaded) / record.speed) if total and record.speed else 0
+        record.updated_at = time.time()
+        record.publish()
+
+
+def format_event(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_progress(registry, job_id, max_rate=4, keepalive=15):
+    """Yield SSE messages with progress deltas for a job.
+
+    The record is sampled at most ``max_rate`` times per second and only
+    changed fields are sent, so fast yt-dlp hooks are coalesced into a
+    bounded number of messages. The stream ends once the job is finished.
+    """
+    interval = 1.0 / max_rate
+    sent = {}
+    last_send = time.monotonic()
+    while True:
+        record = registry.get(job_id)
+        if record is None:
+            yield format_event('done', {'job_id': job_id, 'status': 'expired'})
+            return
+        snapshot = record.to_dict()
+        delta = {key: value for key, value in snapshot.items() if sent.get(key, object()) != value}
+        if delta:
+            sent.update(delta)
+            last_send = time.monotonic()
+            yield format_event('progress', delta)
+        elif time.monotonic() - last_send >= keepalive:
+            last_send = time.monotonic()
+            # Comment lines keep proxies from closing an idle connection
+            yield ': keepalive\n\n'
+        if record.finished_at is not None:
+            yield format_event('done', snapshot)
+            return
+        time.sleep(interval)
@@ -0,0 +1,172 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.postprocess import runs_ffmpeg
+
+# Relative share of workers and bandwidth for each priority class
+DEFAULT_WEIGHTS = {'interactive': 4, 'bulk': 1}
+
+
+class TokenBucket:
+    """Token bucket that lets callers run into debt and sleep it off"""
+
+    def __init__(self, rate):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self._tokens = min(self._tokens, rate)
+
+    def consume(self, amount):
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def _refill(self):
+        now = time.monotonic()
+        # At most one second worth of burst
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+class JobShaper:
+    """Bandwidth share of one job, applied through yt-dlp's hooks and options"""
+
+    def __init__(self, scheduler, weight):
+        self._scheduler = scheduler
+        self.weight = weight
+        self.rate = None
+        self._bucket = None
+        self._params = None
+        self._seen = {}
+
+    def bind(self, params):
+        """Keep a YoutubeDL's params['ratelimit'] in sync with this job's share"""
+        self._params = params
+        params['ratelimit'] = self.rate
+
+    @contextmanager
+    def bound(self, params):
+        """bind() for the length of a with block, e.g. while a pooled YoutubeDL is checked out"""
+        self.bind(params)
+        try:
+            yield
+        finally:
+            with self._scheduler._lock:
+                self._params = None
+
+    def hook(self, d):
+        """Progress hook that blocks the download thread when it is over its share.
+
+        yt-dlp copies its options for fragment downloads, so ratelimit alone
+        only shapes progressive downloads; this covers DASH/HLS as well.
+        """
+        if d['status'] != 'downloading' or self._bucket is None:
+            return
+        filename = d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        delta = downloaded - self._seen.get(filename, 0)
+        self._seen[filename] = downloaded
+        if delta > 0:
+            self._bucket.consume(delta)
+
+    def close(self):
+        self._scheduler._detach(self)
+
+    def _set_rate(self, rate):
+        self.rate = rate
+        if rate is None:
+            self._bucket = None
+        elif self._bucket is None:
+            self._bucket = TokenBucket(rate)
+        else:
+            self._bucket.set_rate(rate)
+        if self._params is not None:
+            self._params['ratelimit'] = rate
+
+
+class BandwidthScheduler:
+    """Splits a global bandwidth limit between running jobs by priority weight.
+
+    Shares are recomputed whenever a job starts or finishes, so a lone
+    job gets the whole link and an interactive job joining a bulk archive
+    takes its weighted share right away. A limit of 0 disables shaping.
+    """
+
+    def __init__(self, max_rate=0, weights=None):
+        self.max_rate = max_rate
+        self.weights = weights or DEFAULT_WEIGHTS
+        self._shapers = set()
+        self._lock = threading.Lock()
+
+    def attach(self, priority):
+        shaper = JobShaper(self, self.weights.get(priority, 1))
+        with self._lock:
+            self._shapers.add(shaper)
+            self._rebalance()
+        return shaper
+
+    def _detach(self, shaper):
+        with self._lock:
+            self._shapers.discard(shaper)
+            self._rebalance()
+
+    def _rebalance(self):
+        total_weight = sum(shaper.weight for shaper in self._shapers)
+        for shaper in self._shapers:
+            # At least 1 B/s: a zero rate would stall the token bucket and turn off yt-dlp's ratelimit
+            rate = max(1, int(self.max_rate * shaper.weight / total_weight)) if self.max_rate else None
+            shaper._set_rate(rate)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_rate': self.max_rate,
+                'active_jobs': len(self._shapers),
+                'rates': sorted((shaper.rate for shaper in self._shapers if shaper.rate), reverse=True),
+            }
+
+
+class PostprocessGate:
+    """Holds one of a fixed number of ffmpeg slots while a job postprocesses"""
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._held = 0
+
+    def hook(self, d):
+        # Only the ffmpeg postprocessors are CPU heavy; MoveFiles and friends pass through
+        if not runs_ffmpeg(d.get('postprocessor', '')):
+            return
+        if d['status'] == 'started':
+            self._slots.acquire()
+            self._held += 1
+        elif d['status'] == 'finished' and self._held:
+            self._held -= 1
+            self._slots.release()
+
+    def release(self):
+        """Give back slots left held by a postprocessor that raised"""
+        while self._held:
+            self._held -= 1
+            self._slots.release()
+
+
+class PostprocessPool:
+    """Bounds how many ffmpeg postprocessors run at once across all jobs"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def gate(self):
+        return PostprocessGate(self._slots)
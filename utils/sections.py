@@ -0,0 +1,103 @@
+def parse_timestamp(value):
+    """Seconds from a number or an '[[HH:]MM:]SS[.fff]' string"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid time: {value!r}")
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    elif isinstance(value, str) and value.strip():
+        parts = value.strip().split(':')
+        if len(parts) > 3:
+            raise ValueError(f"Invalid time: {value!r}")
+        try:
+            seconds = 0.0
+            for part in parts:
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            raise ValueError(f"Invalid time: {value!r}")
+    else:
+        raise ValueError(f"Invalid time: {value!r}")
+    if seconds < 0 or seconds != seconds or seconds == float('inf'):
+        raise ValueError(f"Invalid time: {value!r}")
+    return seconds
+
+
+def requested_section(data):
+    """The part of a video a request body asks for, or None for all of it.
+
+    The body gives either 'start' and/or 'end' times, or 'chapters' as a
+    chapter title or a list of consecutive ones. The result is a plain
+    dict so it can be journaled and queued with the job.
+    """
+    start, end, chapters = data.get('start'), data.get('end'), data.get('chapters')
+    if chapters is not None:
+        if start is not None or end is not None:
+            raise ValueError("Give either start/end times or chapters, not both")
+        if isinstance(chapters, str):
+            chapters = [chapters]
+        if not chapters or not isinstance(chapters, list) or not all(isinstance(c, str) for c in chapters):
+            raise ValueError("chapters must be a chapter title or a list of them")
+        return {'chapters': chapters}
+    if start is None and end is None:
+        return None
+    section = {
+        'start': parse_timestamp(start) if start is not None else 0.0,
+        'end': parse_timestamp(end) if end is not None else None,
+    }
+    if section['end'] is not None and section['end'] <= section['start']:
+        raise ValueError("end must be after start")
+    return section
+
+
+def resolve_section(info, section):
+    """(start, end) seconds of a requested section within the video described by info.
+
+    Chapter titles are matched case-insensitively against info['chapters']
+    and must be consecutive, since a job produces a single file.
+    """
+    duration = info.get('duration')
+    if 'chapters' in section:
+        by_title = {}
+        for chapter in info.get('chapters') or ():
+            by_title.setdefault((chapter.get('title') or '').casefold(), chapter)
+        picked = []
+        for title in section['chapters']:
+            chapter = by_title.get(title.casefold())
+            if chapter is None:
+                available = ', '.join(repr(c.get('title')) for c in info.get('chapters') or ()) or 'none'
+                raise ValueError(f"No chapter named {title!r}; available chapters: {available}")
+            picked.append(chapter)
+        picked.sort(key=lambda c: c['start_time'])
+        for before, after in zip(picked, picked[1:]):
+            # Allow the rounding gaps extractors leave between chapters
+            if after['start_time'] - before['end_time'] > 1:
+                raise ValueError("Chapters must be consecutive; queue one download per chapter instead")
+        start, end = picked[0]['start_time'], picked[-1]['end_time']
+    else:
+        start, end = section['start'], section['end']
+    if duration:
+        if start >= duration:
+            raise ValueError(f"start is past the end of the video ({duration:.0f}s)")
+        end = duration if end is None else min(end, duration)
+    return start, end
+
+
+def section_fraction(info, start, end):
+    """Share of the video's length between start and end, for scaling size estimates"""
+    duration = info.get('duration')
+    if not duration or end is None:
+        return 1.0
+    return max(0.0, min(1.0, (end - start) / duration))
+
+
+def section_options(start, end):
+    """yt-dlp options that download only start..end.
+
+    yt-dlp hands the section to ffmpeg, which fetches just the byte
+    ranges or fragments covering it. The cut is a stream copy that starts
+    at the keyframe before start, so nothing is re-encoded.
+    """
+    from yt_dlp.utils import download_range_func
+    return {
+        'download_ranges': download_range_func(None, [(start, float('inf') if end is None else end)]),
+        'force_keyframes_at_cuts': False,
+    }
@@ -0,0 +1,271 @@
+import math
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+
+class SQLiteBackend:
+    """Shared state in a SQLite file, for several processes on one machine.
+
+    Keys hold strings with an optional TTL; lists are FIFO queues; hashes
+    map fields to strings. Blocking pops poll, so they suit job queues,
+    not high-frequency messaging.
+    """
+
+    def __init__(self, db_path, poll_interval=0.2):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._purged_at = 0
+        # Autocommit mode; multi-statement updates open their own IMMEDIATE transaction
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS lists (seq INTEGER, name TEXT, value TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS lists_name_seq ON lists (name, seq)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS hashes (name TEXT, field TEXT, value TEXT, '
+                         'PRIMARY KEY (name, field))')
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, ?)', (key, value, self._expiry(ttl)))
+            self._purge_expired()
+
+    def set_nx(self, key, value, ttl=None):
+        """Set key only if it is missing or expired; True when it was set"""
+        now = time.time()
+        with self._lock, self._transaction():
+            row = self._db.execute('SELECT expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+            if row is not None and (row[0] is None or row[0] > now):
+                return False
+            self._db.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, ?)', (key, value, self._expiry(ttl)))
+            return True
+
+    def expire(self, key, ttl):
+        with self._lock:
+            self._db.execute('UPDATE kv SET expires_at = ? WHERE key = ?', (self._expiry(ttl), key))
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def push(self, name, value, front=False):
+        with self._lock, self._transaction():
+            if front:
+                seq = self._db.execute('SELECT COALESCE(MIN(seq), 0) - 1 FROM lists WHERE name = ?', (name,))
+            else:
+                seq = self._db.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM lists WHERE name = ?', (name,))
+            self._db.execute('INSERT INTO lists VALUES (?, ?, ?)', (seq.fetchone()[0], name, value))
+
+    def pop(self, names, timeout=0):
+        """Pop from the first non-empty list in names, waiting up to timeout seconds.
+
+        Returns ``(name, value)`` or None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock, self._transaction():
+                for name in names:
+                    row = self._db.execute('SELECT rowid, value FROM lists WHERE name = ? ORDER BY seq LIMIT 1',
+                                           (name,)).fetchone()
+                    if row is not None:
+                        self._db.execute('DELETE FROM lists WHERE rowid = ?', (row[0],))
+                        return name, row[1]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def length(self, name):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM lists WHERE name = ?', (name,)).fetchone()[0]
+
+    def hset(self, name, field, value):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)', (name, field, value))
+
+    def hdel(self, name, field):
+        with self._lock:
+            self._db.execute('DELETE FROM hashes WHERE name = ? AND field = ?', (name, field))
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._db.execute('SELECT field, value FROM hashes WHERE name = ?', (name,)).fetchall())
+
+    def _expiry(self, ttl):
+        return time.time() + ttl if ttl else None
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so check-then-write steps
+        # cannot interleave with another process
+        self._db.execute('BEGIN IMMEDIATE')
+        return self._db
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._purged_at > 60:
+            self._purged_at = now
+            self._db.execute('DELETE FROM kv WHERE expires_at < ?', (now,))
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RespConnection:
+    """Minimal client for the Redis serialization protocol (RESP2)"""
+
+    def __init__(self, host, port, password=None, db=0, timeout=30):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def command(self, *args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the state server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RespError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)[:-2]
+            return data.decode()
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RespError(f"Unexpected reply: {line!r}")
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class RedisBackend:
+    """Shared state in Redis, or anything that speaks its protocol, for several machines.
+
+    Each thread keeps its own connection, since a blocking pop holds a
+    connection for as long as it waits; pop timeouts must stay below the
+    connection's 30 second socket timeout.
+    """
+
+    def __init__(self, host='localhost', port=6379, password=None, db=0, prefix='ytb:'):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def _command(self, *args):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = RespConnection(self.host, self.port, self.password, self.db)
+        try:
+            return conn.command(*args)
+        except (OSError, ConnectionError):
+            # Drop the broken connection; the next call reconnects
+            self._local.conn = None
+            conn.close()
+            raise
+
+    def get(self, key):
+        return self._command('GET', self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._command('SET', self.prefix + key, value, 'EX', max(1, math.ceil(ttl)))
+        else:
+            self._command('SET', self.prefix + key, value)
+
+    def set_nx(self, key, value, ttl=None):
+        args = ['SET', self.prefix + key, value, 'NX']
+        if ttl:
+            args += ['EX', max(1, math.ceil(ttl))]
+        return self._command(*args) is not None
+
+    def expire(self, key, ttl):
+        self._command('EXPIRE', self.prefix + key, max(1, math.ceil(ttl)))
+
+    def delete(self, key):
+        self._command('DEL', self.prefix + key)
+
+    def push(self, name, value, front=False):
+        self._command('LPUSH' if front else 'RPUSH', self.prefix + name, value)
+
+    def pop(self, names, timeout=0):
+        # BLPOP treats 0 as "wait forever"; a non-blocking pop uses LPOP per list instead
+        if timeout <= 0:
+            for name in names:
+                value = self._command('LPOP', self.prefix + name)
+                if value is not None:
+                    return name, value
+            return None
+        reply = self._command('BLPOP', *[self.prefix + name for name in names], max(1, math.ceil(timeout)))
+        if reply is None:
+            return None
+        return reply[0][len(self.prefix):], reply[1]
+
+    def length(self, name):
+        return self._command('LLEN', self.prefix + name)
+
+    def hset(self, name, field, value):
+        self._command('HSET', self.prefix + name, field, value)
+
+    def hdel(self, name, field):
+        self._command('HDEL', self.prefix + name, field)
+
+    def hgetall(self, name):
+        reply = self._command('HGETALL', self.prefix + name) or []
+        return dict(zip(reply[::2], reply[1::2]))
+
+
+def open_backend(url):
+    """Open the state backend for a URL, or None for in-process state.
+
+    ``memory://`` keeps everything in the current process;
+    ``sqlite:///state.db`` (relative) or ``sqlite:////var/lib/ytb/state.db``
+    (absolute) shares state between processes on one machine;
+    ``redis://[:password@]host[:port][/db]`` shares it between machines.
+    """
+    parts = urlsplit(url)
+    if parts.scheme in ('', 'memory'):
+        return None
+    if parts.scheme == 'sqlite':
+        # Same convention as SQLAlchemy: the third slash ends the (empty) host
+        path = unquote(parts.path[1:])
+        if not path:
+            raise ValueError(f"No database path in state URL {url}")
+        return SQLiteBackend(path)
+    if parts.scheme == 'redis':
+        db = int(parts.path.lstrip('/') or 0)
+        return RedisBackend(parts.hostname or 'localhost', parts.port or 6379,
+                            unquote(parts.password) if parts.password else None, db)
+    raise ValueError(f"Unsupported state backend: {url}")
@@ -0,0 +1,122 @@
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+from urllib.parse import quote
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Size of each ranged request made to the origin; YouTube throttles long unranged reads
+RANGE_SIZE = 10 * 1024 * 1024
+# Size of the chunks handed to the WSGI server
+READ_SIZE = 64 * 1024
+# Fragmented MP4 can be written to a pipe since it needs no seeking back to the header
+FRAGMENTED_MP4_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+# Protocols ffmpeg can read directly from the format URL
+FFMPEG_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
+
+
+class StreamUnsupportedError(Exception):
+    """Raised when the selected formats cannot be streamed without staging to disk"""
+
+
+def http_chunks(url, headers, range_size=RANGE_SIZE, read_size=READ_SIZE):
+    """Yield the body of url using consecutive Range requests"""
+    session = requests.Session()
+    start = 0
+    try:
+        while True:
+            range_headers = dict(headers, Range=f"bytes={start}-{start + range_size - 1}")
+            with session.get(url, headers=range_headers, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                received = 0
+                for chunk in response.iter_content(read_size):
+                    received += len(chunk)
+                    yield chunk
+                # A 200 means the origin ignored the range and sent the whole body
+                if response.status_code != 206 or not received:
+                    return
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                start += received
+                if not total.isdigit() or start >= int(total):
+                    return
+    finally:
+        session.close()
+
+
+def ffmpeg_chunks(command, read_size=READ_SIZE):
+    """Yield ffmpeg's stdout, killing the process if the client goes away"""
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            chunk = process.stdout.read(read_size)
+            if not chunk:
+                break
+            yield chunk
+        if process.wait() != 0:
+            logger.error(f"ffmpeg exited with status {process.returncode} while streaming")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+def ffmpeg_remux_command(ffmpeg, formats):
+    """ffmpeg command that stream-copies formats into fragmented MP4 on stdout"""
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error']
+    for fmt in formats:
+        headers = ''.join(f"{key}: {value}\r\n" for key, value in (fmt.get('http_headers') or {}).items())
+        if headers:
+            command += ['-headers', headers]
+        command += ['-i', fmt['url']]
+    for index, fmt in enumerate(formats):
+        command += ['-map', f"{index}:{'a' if fmt.get('vcodec') == 'none' else 'v'}"]
+    command += ['-c', 'copy', '-f', 'mp4', '-movflags', FRAGMENTED_MP4_FLAGS, 'pipe:1']
+    return command
+
+
+def find_ffmpeg(location):
+    """Resolve an ffmpeg binary from a file or directory location"""
+    if location and os.path.isfile(location):
+        return location
+    return shutil.which('ffmpeg', path=location) or shutil.which('ffmpeg')
+
+
+def open_stream(resolved, ffmpeg_location):
+    """Start streaming the formats selected in a resolved info dict.
+
+    Returns ``(chunks, mimetype, filename, length)``. A single progressive
+    format is proxied as-is; separate video and audio (or HLS) are remuxed
+    by ffmpeg into fragmented MP4 without touching the disk.
+    ``ffmpeg_location`` is called only in that second case, so a stream
+    never waits on an ffmpeg download it does not need.
+    """
+    formats = resolved.get('requested_formats') or [resolved]
+    for fmt in formats:
+        if not fmt.get('url') or fmt.get('protocol', 'https') not in FFMPEG_PROTOCOLS:
+            raise StreamUnsupportedError(f"Format {fmt.get('format_id')} ({fmt.get('protocol')}) cannot be streamed")
+
+    title = resolved.get('title') or resolved.get('id') or 'video'
+    fmt = formats[0]
+    if len(formats) == 1 and fmt.get('protocol', 'https') in ('http', 'https'):
+        ext = fmt.get('ext') or 'mp4'
+        mimetype = mimetypes.guess_type(f"x.{ext}")[0] or 'application/octet-stream'
+        length = fmt.get('filesize')
+        return http_chunks(fmt['url'], fmt.get('http_headers') or {}), mimetype, f"{title}.{ext}", length
+
+    ffmpeg = find_ffmpeg(ffmpeg_location())
+    if not ffmpeg:
+        raise StreamUnsupportedError("ffmpeg is required to stream this format")
+    return ffmpeg_chunks(ffmpeg_remux_command(ffmpeg, formats)), 'video/mp4', f"{title}.mp4", None
+
+
+def content_disposition(filename):
+    """Attachment header value that survives non-ASCII titles"""
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', '_', filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
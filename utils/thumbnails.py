@@ -0,0 +1,242 @@
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from urllib.request import Request, urlopen
+
+from utils.singleflight import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow is optional; without it thumbnails are cached at the size the site serves
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# File extensions for the image types sites serve thumbnails as
+IMAGE_TYPES = {'image/jpeg': '.jpg', 'image/webp': '.webp', 'image/png': '.png'}
+MIMETYPES = {ext: mimetype for mimetype, ext in IMAGE_TYPES.items()}
+
+# Larger responses are not thumbnails
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+
+
+def thumbnail_id(info):
+    """ID /api/thumbnail serves a video's thumbnail under, unique across sites"""
+    return f"{(info.get('extractor_key') or 'generic').lower()}-{info.get('id')}"
+
+
+def thumbnail_sources(info, width):
+    """Thumbnail URLs to try for a video, the cheapest one that is still sharp enough first.
+
+    That is the smallest thumbnail at least width pixels wide, or the
+    widest when none is; the one yt-dlp picked as best comes next in case
+    the first is missing on the site.
+    """
+    sized = [t for t in info.get('thumbnails') or () if t.get('url') and t.get('width')]
+    wide_enough = [t for t in sized if t['width'] >= width]
+    sources = []
+    if wide_enough:
+        sources.append(min(wide_enough, key=lambda t: t['width'])['url'])
+    elif sized:
+        sources.append(max(sized, key=lambda t: t['width'])['url'])
+    if info.get('thumbnail') and info['thumbnail'] not in sources:
+        sources.append(info['thumbnail'])
+    return sources
+
+
+class ThumbnailCache:
+    """Downscaled video thumbnails in a directory bounded to max_bytes.
+
+    Each thumbnail is fetched once, shrunk to at most ``width`` pixels
+    wide and re-encoded as JPEG when Pillow is installed (kept as the
+    site sent it otherwise), and served from disk after that. Where to
+    fetch a video's thumbnail from is remembered when its metadata is
+    extracted, and ``prefetch`` fetches it right away on background
+    threads so it is usually on disk before the page asks for it. The
+    least recently served files are deleted once the directory passes
+    max_bytes.
+    """
+
+    def __init__(self, directory, width=480, max_bytes=64 * 1024 * 1024, timeout=10, workers=2,
+                 max_sources=4096):
+        self.directory = os.path.abspath(directory)
+        self.width = width
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.workers = workers
+        self.max_sources = max_sources
+        self.fetched = 0
+        self.hits = 0
+        self.failures = 0
+        self._sources = OrderedDict()
+        self._fetches = SingleFlight()
+        self._prefetch = queue.Queue(maxsize=256)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._prefetch_loop, name=f'thumbnail-{i}', daemon=True).start()
+        return self
+
+    def remember(self, info):
+        """Note where the thumbnail of an extracted video comes from; returns its thumbnail_id, or None without one"""
+        sources = thumbnail_sources(info, self.width)
+        if not sources:
+            return None
+        video_id = thumbnail_id(info)
+        with self._lock:
+            self._sources[video_id] = sources
+            self._sources.move_to_end(video_id)
+            while len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+        return video_id
+
+    def prefetch(self, info):
+        """remember() the video and fetch its thumbnail in the background if it is not on disk yet"""
+        video_id = self.remember(info)
+        if video_id is not None and self._find(video_id) is None:
+            try:
+                self._prefetch.put_nowait(video_id)
+            except queue.Full:
+                # The page fetches it on demand instead
+                pass
+        return video_id
+
+    def get(self, video_id):
+        """(path, mimetype) of a video's thumbnail, fetching it on first use; None for an unknown video"""
+        found = self._find(video_id)
+        if found is None:
+            with self._lock:
+                known = video_id in self._sources
+            if not known:
+                return None
+            found = self._fetches.do(video_id, self._fetch, video_id)
+        else:
+            self.hits += 1
+        path, mimetype = found
+        try:
+            # The access time orders files for eviction; the modification time stays, since it makes up the ETag
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return path, mimetype
+
+    def stats(self):
+        with self._lock:
+            known = len(self._sources)
+        files = self._files()
+        return {
+            'files': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes,
+            'known_videos': known,
+            'hits': self.hits,
+            'fetched': self.fetched,
+            'failures': self.failures,
+            'resized': Image is not None,
+        }
+
+    def _prefetch_loop(self):
+        while True:
+            video_id = self._prefetch.get()
+            try:
+                if self._find(video_id) is None:
+                    self._fetches.do(video_id, self._fetch, video_id)
+            except Exception as e:
+                logger.warning(f"Could not prefetch the thumbnail of {video_id}: {str(e)}")
+
+    def _name(self, video_id):
+        return hashlib.sha1(video_id.encode()).hexdigest()
+
+    def _find(self, video_id):
+        name = self._name(video_id)
+        for ext, mimetype in MIMETYPES.items():
+            path = os.path.join(self.directory, name + ext)
+            if os.path.exists(path):
+                return path, mimetype
+        return None
+
+    def _fetch(self, video_id):
+        # Another caller may have finished the fetch while this one waited to start
+        found = self._find(video_id)
+        if found is not None:
+            return found
+        with self._lock:
+            sources = self._sources.get(video_id, [])
+        error = None
+        for url in sources:
+            try:
+                data, mimetype = self._download(url)
+                break
+            except Exception as e:
+                error = e
+        else:
+            self.failures += 1
+            raise RuntimeError(f"No thumbnail could be fetched for {video_id}: {error}")
+        data, mimetype = self._shrink(data, mimetype)
+        path = os.path.join(self.directory, self._name(video_id) + IMAGE_TYPES[mimetype])
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.fetched += 1
+        self._evict()
+        return path, mimetype
+
+    def _download(self, url):
+        request = Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+        with urlopen(request, timeout=self.timeout) as response:
+            mimetype = response.headers.get_content_type()
+            if mimetype not in IMAGE_TYPES:
+                raise ValueError(f"{url} is {mimetype}, not an image")
+            data = response.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise ValueError(f"{url} is larger than {MAX_IMAGE_BYTES} bytes")
+        return data, mimetype
+
+    def _shrink(self, data, mimetype):
+        """JPEG at most self.width wide, or the image unchanged without Pillow or when it cannot be decoded"""
+        if Image is None:
+            return data, mimetype
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                # JPEGs decode straight at a fraction of their size, which is most of the saving
+                image.draft('RGB', (self.width, self.width * image.height // max(1, image.width)))
+                image.thumbnail((self.width, image.height))
+                out = io.BytesIO()
+                image.convert('RGB').save(out, 'JPEG', quality=80, optimize=True, progressive=True)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Keeping a thumbnail at full size: {str(e)}")
+            return data, mimetype
+        return out.getvalue(), 'image/jpeg'
+
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_atime))
+            except OSError:
+                pass
+        return files
+
+    def _evict(self):
+        """Delete the least recently served thumbnails until the directory fits in max_bytes"""
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
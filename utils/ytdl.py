@@ -0,0 +1,216 @@
+import copy
+import json
+import threading
+from contextlib import contextmanager
+
+# Options that change from job to job and are applied when a pooled YoutubeDL is checked out;
+# the rest of the options decide which pooled instances a job can use
+CHECKOUT_OPTIONS = ('format', 'outtmpl', 'outtmpl_params', 'paths', 'progress_hooks', 'postprocessor_hooks',
+                    'postprocessors', 'ffmpeg_location', 'merge_output_format', 'concurrent_fragment_downloads',
+                    'download_ranges', 'force_keyframes_at_cuts')
+
+
+def new_ydl(params=None):
+    """Create a YoutubeDL, importing yt-dlp on first use.
+
+    Importing yt_dlp loads every extractor module and takes a noticeable
+    share of startup, so it waits until a request actually needs it.
+    """
+    from yt_dlp import YoutubeDL
+    return YoutubeDL(params)
+
+
+def _apply_checkout_options(ydl, params):
+    """Set one job's per-checkout options on a YoutubeDL built without them.
+
+    YoutubeDL.__init__ turns the output template, format and hooks into
+    internal state, so that part of it is repeated here.
+    """
+    from yt_dlp.postprocessor import get_postprocessor
+    from yt_dlp.utils import POSTPROCESS_WHEN
+
+    ydl.params.update({key: params[key] for key in CHECKOUT_OPTIONS if key in params})
+    ydl._parse_outtmpl()
+    spec = ydl.params.get('format')
+    ydl.format_selector = spec if spec in (None, '-') or callable(spec) else ydl.build_format_selector(spec)
+    ydl._progress_hooks = []
+    ydl._postprocessor_hooks = []
+    ydl._pps = {when: [] for when in POSTPROCESS_WHEN}
+    ydl._num_downloads = 0
+    ydl._download_retcode = 0
+    for hook in params.get('progress_hooks') or ():
+        ydl.add_progress_hook(hook)
+    for hook in params.get('postprocessor_hooks') or ():
+        ydl.add_postprocessor_hook(hook)
+    for pp_def in params.get('postprocessors') or ():
+        pp_def = dict(pp_def)
+        when = pp_def.pop('when', 'post_process')
+        ydl.add_post_processor(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+
+
+@contextmanager
+def ffmpeg_context(location):
+    """Let yt-dlp's own ffmpeg checks find the ffmpeg at location for the duration of the block.
+
+    Some checks, such as the one for partial (section) downloads, call
+    FFmpegFD.available() without the YoutubeDL's params, so they only see
+    PATH and this context variable, never params['ffmpeg_location'].
+    """
+    if location is None:
+        yield
+        return
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+    token = FFmpegPostProcessor._ffmpeg_location.set(location)
+    try:
+        yield
+    finally:
+        FFmpegPostProcessor._ffmpeg_location.reset(token)
+
+
+class YoutubeDLPool:
+    """Warm YoutubeDL instances reused across requests.
+
+    Building a YoutubeDL registers every extractor and sets up its cookie
+    jar and HTTP handlers, which takes tens of milliseconds, and closing
+    it drops its keep-alive connections. Instances are pooled by option
+    shape (everything but CHECKOUT_OPTIONS), so metadata, download and
+    audio extraction jobs each get their own, and the per-job options
+    are applied on checkout. An instance is closed after max_uses
+    checkouts, or when the code using it raises anything but a yt-dlp
+    error, so state it picks up along the way stays bounded.
+    max_idle=0 turns pooling off.
+    """
+
+    def __init__(self, max_idle=4, max_uses=50):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def checkout(self, params=None):
+        params = params or {}
+        shape = json.dumps({key: value for key, value in params.items() if key not in CHECKOUT_OPTIONS},
+                           sort_keys=True, default=repr)
+        with self._lock:
+            idle = self._idle.get(shape)
+            entry = idle.pop() if idle else None
+            if entry is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if entry is None:
+            ydl = new_ydl({key: value for key, value in params.items() if key not in CHECKOUT_OPTIONS})
+            # What __init__ made of the shared options; every checkout starts again from here
+            entry = [ydl, dict(ydl.params), 0]
+        ydl, base_params, _ = entry
+        ydl.params.clear()
+        ydl.params.update(base_params)
+        try:
+            # A bad format spec raises here, before the caller ever holds the instance
+            _apply_checkout_options(ydl, params)
+            yield ydl
+        except BaseException as e:
+            from yt_dlp.utils import YoutubeDLError
+            # yt-dlp's own errors (unavailable video, missing format) leave the instance usable
+            if isinstance(e, YoutubeDLError):
+                self._checkin(shape, entry)
+            else:
+                ydl.close()
+            raise
+        self._checkin(shape, entry)
+
+    def _checkin(self, shape, entry):
+        entry[2] += 1
+        with self._lock:
+            idle = self._idle.setdefault(shape, [])
+            if entry[2] < self.max_uses and len(idle) < self.max_idle:
+                idle.append(entry)
+                return
+        entry[0].close()
+
+    def close(self):
+        """Close every idle instance"""
+        with self._lock:
+            entries = [entry for idle in self._idle.values() for entry in idle]
+            self._idle.clear()
+        for ydl, _, _ in entries:
+            ydl.close()
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(entries) for entries in self._idle.values())
+            shapes = len(self._idle)
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'idle': idle,
+            'shapes': shapes,
+        }
+
+
+@contextmanager
+def _fresh_ydl(params):
+    with new_ydl(params) as ydl:
+        yield ydl
+
+
+def checkout_ydl(params, pool=None):
+    """YoutubeDL for params as a context manager, from pool when one is given"""
+    return pool.checkout(params) if pool is not None else _fresh_ydl(params)
+
+
+def selectable(info):
+    """Copy of a cached info dict that process_ie_result can run format selection on again.
+
+    extract_info already selected formats for its own default spec. A
+    new selection overwrites the top-level format fields, but only a
+    merged one replaces 'requested_formats', so a stale pair left from
+    the first selection would be downloaded instead of a single format.
+    """
+    info = copy.deepcopy(info)
+    info.pop('requested_formats', None)
+    info.pop('requested_downloads', None)
+    return info
+
+
+def resolve_format(info, format_spec, pool=None):
+    """Return info with the formats yt-dlp would download for format_spec.
+
+    Runs format selection only; nothing is fetched. The result carries
+    'format_id' (e.g. '137+140') and, for merged downloads,
+    'requested_formats'.
+    """
+    with checkout_ydl({'format': format_spec, 'quiet': True, 'no_warnings': True}, pool) as ydl:
+        return ydl.process_ie_result(selectable(info), download=False)
+
+
+def downloaded_path(result):
+    """Final path of the file produced by process_ie_result(download=True)"""
+    downloads = result.get('requested_downloads') or [{}]
+    return downloads[-1].get('filepath') or result.get('filepath')
+
+
+def playlist_entry_urls(url, pool=None):
+    """Yield the video URLs in a playlist or channel without extracting each entry.
+
+    Uses extract_flat so entries are enumerated page by page as the
+    caller iterates; a plain video URL yields just itself.
+    """
+    opts = {'extract_flat': 'in_playlist', 'lazy_playlist': True, 'quiet': True, 'no_warnings': True}
+    with checkout_ydl(opts, pool) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        # Follow redirects such as a watch URL pointing at its playlist tab
+        while info.get('_type') in ('url', 'url_transparent') and info.get('url') not in (None, url):
+            url = info['url']
+            info = ydl.extract_info(url, download=False, process=False, ie_key=info.get('ie_key'))
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            yield url
+            return
+        for entry in info.get('entries') or []:
+            if entry:
+                entry_url = entry.get('url') or entry.get('webpage_url')
+                if entry_url:
+                    yield entry_url
@@ -1,41 +1,134 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory, url_for
+import itertools
+import json
+import logging
 import os
-from yt_dlp import YoutubeDL
-from utils.ffmpeg_downloader import get_ffmpeg
+import shutil
+import uuid
+from utils.ffmpeg_downloader import FFmpegBootstrap
+from utils.config import (DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE, DOWNLOAD_LOCATION, JOB_TTL, PROGRESS_STREAM_RATE,
+                          INFO_CACHE_SIZE, INFO_CACHE_TTL, INFO_CACHE_DB, STORE_MAX_BYTES,
+                          FILE_MAX_AGE, USE_X_SENDFILE, FRAGMENT_CONCURRENCY, MAX_FRAGMENT_CONCURRENCY,
+                          MAX_CONNECTIONS, HTTP_CHUNK_SIZE, DOWNLOAD_BUFFER_SIZE, BATCH_WORKERS,
+                          BATCH_MAX_ENTRIES, MAX_BANDWIDTH, FFMPEG_WORKERS, PRIORITY_WEIGHTS,
+                          FFMPEG_LOCATION, FFMPEG_URL, FFMPEG_SHA256, STATE_URL, ROLE, DISK_QUOTA,
+                          DISK_MIN_FREE, DISK_HIGH_WATER, DISK_LOW_WATER, DISK_UNKNOWN_SIZE, DISK_WAIT,
+                          YDL_POOL_SIZE, YDL_MAX_USES, THUMBNAIL_WIDTH, THUMBNAIL_CACHE_BYTES, THUMBNAIL_MAX_AGE,
+                          FORMATS_MAX_AGE)
+from utils.concurrency import ConnectionBudget, map_unordered
+from utils.disk_quota import DiskQuota, InsufficientSpaceError, estimate_peak_bytes
+from utils.download_store import DownloadStore, store_key
+from utils.format_index import FormatIndex
+from utils.http_cache import cacheable
+from utils.info_cache import InfoCache, video_key
+from utils.job_journal import JobJournal
+from utils.job_queue import JobQueue, QueueFullError, SharedJobQueue
+from utils.metrics import ByteMeter, MetricsRegistry, PhaseTimer
+from utils.postprocess import plan_postprocessors
+from utils.progress import ProgressHook, ProgressRegistry, SharedProgressRegistry, stream_progress
+from utils.scheduler import BandwidthScheduler, PostprocessPool
+from utils.sections import requested_section, resolve_section, section_fraction, section_options
+from utils.state import open_backend
+from utils.streaming import content_disposition, open_stream
+from utils.thumbnails import ThumbnailCache
+from utils.ytdl import YoutubeDLPool, downloaded_path, ffmpeg_context, playlist_entry_urls, resolve_format, selectable
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+# Let a fronting nginx/Apache send files when it is configured for X-Sendfile
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
 
-DOWNLOAD_DIR = "downloads"
+DOWNLOAD_DIR = DOWNLOAD_LOCATION or "downloads"
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-# Setup portable FFmpeg
-FFMPEG_PATH = get_ffmpeg()
-
-class ProgressHook:
-    def __init__(self):
-        self.progress = {}
-
-    def __call__(self, d):
-        if d['status'] == 'downloading':
-            self.progress['status'] = 'downloading'
-            self.progress['downloaded_bytes'] = d.get('downloaded_bytes', 0)
-            self.progress['total_bytes'] = d.get('total_bytes', 0)
-            self.progress['speed'] = d.get('speed', 0)
-            self.progress['eta'] = d.get('eta', 0)
-            if d.get('total_bytes'):
-                self.progress['percentage'] = (d['downloaded_bytes'] / d['total_bytes']) * 100
-            elif d.get('total_bytes_estimate'):
-                self.progress['percentage'] = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-        elif d['status'] == 'finished':
-            self.progress['status'] = 'finished'
+# Jobs, progress and cached metadata live in this process unless a shared backend is configured,
+# in which case several web and download processes can serve the same jobs
+state_backend = open_backend(STATE_URL)
+if state_backend is None and ROLE != 'all':
+    raise RuntimeError(f"YTB_ROLE={ROLE} needs a shared YTB_STATE_URL (sqlite:// or redis://)")
+
+# Find FFmpeg without blocking startup; if it has to be downloaded, that happens in the background
+ffmpeg_bootstrap = FFmpegBootstrap(configured=FFMPEG_LOCATION, url=FFMPEG_URL,
+                                   sha256=FFMPEG_SHA256).start()
+
+# Downloads run on a bounded pool of background workers instead of inside the request
+if state_backend is None:
+    download_queue = JobQueue(workers=DOWNLOAD_WORKERS, max_queued=DOWNLOAD_QUEUE_SIZE, name='download',
+                              ttl=JOB_TTL, weights=PRIORITY_WEIGHTS)
+else:
+    download_queue = SharedJobQueue(state_backend, workers=DOWNLOAD_WORKERS, max_queued=DOWNLOAD_QUEUE_SIZE,
+                                    name='download', ttl=JOB_TTL, weights=PRIORITY_WEIGHTS)
+
+# Warm yt-dlp instances, so requests skip its setup and reuse open connections
+ydl_pool = YoutubeDLPool(max_idle=YDL_POOL_SIZE, max_uses=YDL_MAX_USES)
+
+# Fragment connections shared by all running downloads
+connection_budget = ConnectionBudget(MAX_CONNECTIONS, MAX_FRAGMENT_CONCURRENCY)
+
+# Bandwidth split between running downloads by priority
+bandwidth_scheduler = BandwidthScheduler(MAX_BANDWIDTH, PRIORITY_WEIGHTS)
+
+# ffmpeg postprocessing runs on a bounded number of slots so merges cannot swamp the CPU
+postprocess_pool = PostprocessPool(FFMPEG_WORKERS)
+
+# Extracted metadata shared by /api/formats and /api/download
+info_cache = InfoCache(max_entries=INFO_CACHE_SIZE, ttl=INFO_CACHE_TTL, db_path=INFO_CACHE_DB,
+                       shared=state_backend)
+
+# Finished downloads indexed by what produced them, so repeats are served instantly
+download_store = DownloadStore(os.path.join(DOWNLOAD_DIR, '.store.sqlite3'), max_bytes=STORE_MAX_BYTES,
+                               min_idle=JOB_TTL)
+
+# Jobs reserve their estimated disk use before downloading; old downloads are reaped to make room.
+# Files stay at least as long as their job can be looked up, so clients can still fetch them
+disk_quota = DiskQuota(DOWNLOAD_DIR, download_store, max_bytes=DISK_QUOTA, min_free=DISK_MIN_FREE,
+                       high_water=DISK_HIGH_WATER / 100, low_water=DISK_LOW_WATER / 100, min_idle=JOB_TTL)
+
+# Downscaled thumbnails served by /api/thumbnail, fetched in the background as soon as a video is extracted
+thumbnail_cache = ThumbnailCache(os.path.join(DOWNLOAD_DIR, '.thumbnails'), width=THUMBNAIL_WIDTH,
+                                 max_bytes=THUMBNAIL_CACHE_BYTES).start()
+
+# Jobs survive restarts through this journal
+job_journal = JobJournal(os.path.join(DOWNLOAD_DIR, '.jobs.sqlite3'), ttl=JOB_TTL, owner='web_app')
+
+# Progress of each download job, keyed by job ID
+if state_backend is None:
+    progress_registry = ProgressRegistry(ttl=JOB_TTL)
+else:
+    progress_registry = SharedProgressRegistry(state_backend, ttl=JOB_TTL)
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+extract_seconds = metrics.histogram('extract_info_seconds', 'Time spent extracting metadata on info cache misses')
+job_phase_seconds = metrics.histogram('job_phase_seconds', 'Time download jobs spend in each phase', labels=('phase',))
+download_throughput = metrics.histogram('download_throughput_bytes_per_second', 'Average transfer rate of each download',
+                                        buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6))
+downloaded_bytes = metrics.counter('downloaded_bytes_total', 'Bytes received by download jobs')
+jobs_total = metrics.counter('jobs_total', 'Finished download jobs by outcome', labels=('outcome',))
+metrics.gauge('jobs', 'Download jobs by state', label='state',
+              func=lambda: {state: download_queue.stats()[state] for state in ('queued', 'running')})
+metrics.gauge('info_cache_hit_ratio', 'Share of metadata lookups served from the info cache',
+              func=lambda: info_cache.stats()['hit_ratio'])
+metrics.gauge('download_store_hit_ratio', 'Share of download jobs served from the download store',
+              func=lambda: download_store.stats()['hit_ratio'])
+metrics.gauge('fragment_connections_in_use', 'Fragment connections held by running downloads',
+              func=lambda: connection_budget.stats()['in_use'])
+metrics.gauge('disk_used_bytes', 'Bytes on disk under the download directory',
+              func=lambda: disk_quota.stats()['used_bytes'])
+metrics.gauge('disk_reserved_bytes', 'Bytes reserved by running downloads',
+              func=lambda: disk_quota.stats()['reserved_bytes'])
 
 def get_ydl_opts(format_id=None, progress_hook=None):
     """Get yt-dlp options with FFmpeg configuration"""
     opts = {
         'format': format_id if format_id else 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
         'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
-        'ffmpeg_location': FFMPEG_PATH,
+        'ffmpeg_location': ffmpeg_bootstrap.location(wait=False),
         'merge_output_format': 'mp4',  # Force MP4 as output
+        'http_chunk_size': HTTP_CHUNK_SIZE,
+        'buffersize': DOWNLOAD_BUFFER_SIZE,
+        # No progress line per chunk on stdout; the progress hook reports it instead
+        'noprogress': True,
         'postprocessors': [{
             'key': 'FFmpegVideoConvertor',
             'preferedformat': 'mp4',
@@ -60,95 +153,151 @@ def format_filesize(bytes):
 def index():
     return render_template('index.html')
 
-@app.route('/api/formats', methods=['POST'])
+def _extract_info(url):
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+    }
+    with extract_seconds.time(), ydl_pool.checkout(ydl_opts) as ydl:
+        # Sanitized so the dict can be stored on disk and fed back to process_ie_result
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    # The page shows the thumbnail next, so start fetching it now
+    thumbnail_cache.prefetch(info)
+    return info
+
+def extract_info(url):
+    """Return video metadata, reusing a cached extraction when possible"""
+    return info_cache.get_or_extract(url, _extract_info)
+
+@app.route('/api/formats', methods=['GET', 'POST'])
 def get_formats():
-    url = request.json.get('url')
+    if request.method == 'GET':
+        # Browsers cache GET responses and revalidate them with If-None-Match
+        data = request.args.to_dict()
+        if len(request.args.getlist('chapters')) > 1:
+            data['chapters'] = request.args.getlist('chapters')
+    else:
+        data = request.json
+    url = data.get('url')
     if not url:
         return jsonify({'error': 'URL is required'}), 400
 
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
+        section = requested_section(data)
+        info = extract_info(url)
+        # Cached metadata may come from another process or an earlier run, so note its thumbnail here too
+        thumbnail_id = thumbnail_cache.remember(info)
+
+        # Sizes are scaled to the requested part of the video
+        fraction = section_fraction(info, *resolve_section(info, section)) if section else 1.0
+
+        # Index formats once; sorting and dedupe come precomputed
+        index = FormatIndex(info)
+
+        formats = []
+        # Get best audio format (prefer m4a for compatibility with mp4)
+        best_audio = index.best_audio('m4a')
+        audio_size = index.estimate_size(best_audio) * fraction
         
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            formats = []
-            # Get best audio format (prefer m4a for compatibility with mp4)
-            best_audio = next(
-                (f for f in info['formats'] 
-                 if f.get('vcodec') == 'none' 
-                 and f.get('acodec') != 'none'
-                 and f.get('ext') == 'm4a'),
-                None
-            )
-            
-            # Add "Best Quality" option first
+        # Add "Best Quality" option first
+        formats.append({
+            'format_id': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+            'resolution': 'Best Quality',
+            'ext': 'mp4',
+            'filesize': 'Automatic',
+            'height': 99999,  # for sorting
+            'fps': 99999,     # for sorting
+        })
+        
+        # One MP4 format per resolution, tallest (then highest fps) first
+        for format in index.video_formats(ext='mp4'):
+            # Calculate total size including audio
+            total_size = index.estimate_size(format) * fraction + audio_size
+
             formats.append({
-                'format_id': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                'resolution': 'Best Quality',
+                'format_id': f"{format['format_id']}+bestaudio[ext=m4a]/bestaudio",
+                'resolution': f"{format['width']}x{format['height']}",
                 'ext': 'mp4',
-                'filesize': 'Automatic',
-                'height': 99999,  # for sorting
-                'fps': 99999,     # for sorting
-            })
-            
-            # Process available formats
-            for format in info['formats']:
-                # Skip audio-only formats
-                if format.get('vcodec') == 'none':
-                    continue
-                
-                # Get resolution
-                height = format.get('height', 0)
-                width = format.get('width', 0)
-                
-                if not height or not width:
-                    continue
-
-                # Skip non-MP4 formats
-                if format.get('ext') != 'mp4':
-                    continue
-                
-                # Calculate total size including audio
-                video_size = format.get('filesize', 0) or format.get('filesize_approx', 0) or 0
-                audio_size = (best_audio.get('filesize', 0) or best_audio.get('filesize_approx', 0) or 0) if best_audio else 0
-                total_size = video_size + audio_size
-
-                formats.append({
-                    'format_id': f"{format['format_id']}+bestaudio[ext=m4a]/bestaudio",
-                    'resolution': f"{width}x{height}",
-                    'ext': 'mp4',
-                    'filesize': format_filesize(total_size),
-                    'height': height,
-                    'fps': format.get('fps', 0) or 0,
-                })
-
-            # Sort formats by resolution (height) and fps
-            formats = sorted(formats, key=lambda x: (x['height'], x['fps']), reverse=True)
-
-            # Remove duplicates based on resolution
-            seen_resolutions = set()
-            unique_formats = []
-            for f in formats:
-                resolution = f['resolution']
-                if resolution not in seen_resolutions:
-                    seen_resolutions.add(resolution)
-                    unique_formats.append(f)
-
-            return jsonify({
-                'title': info['title'],
-                'thumbnail': info.get('thumbnail'),
-                'duration': info.get('duration', 0),
-                'formats': unique_formats
+                'filesize': format_filesize(total_size),
+                'height': format['height'],
+                'fps': format.get('fps', 0) or 0,
             })
 
+        # The same video gives the same response, so repeat views get a 304 instead of the body
+        return cacheable(jsonify({
+            'title': info['title'],
+            'thumbnail': url_for('get_thumbnail', video_id=thumbnail_id) if thumbnail_id else None,
+            'duration': info.get('duration', 0),
+            'chapters': [{key: chapter.get(key) for key in ('title', 'start_time', 'end_time')}
+                         for chapter in info.get('chapters') or ()],
+            'formats': formats
+        }), request, FORMATS_MAX_AGE)
+
     except Exception as e:
         print(f"Error: {str(e)}")
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/thumbnail/<path:video_id>')
+def get_thumbnail(video_id):
+    try:
+        found = thumbnail_cache.get(video_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 502
+    if found is None:
+        return jsonify({'error': 'Unknown video; look it up with /api/formats first'}), 404
+    path, mimetype = found
+    return send_file(path, mimetype=mimetype, max_age=THUMBNAIL_MAX_AGE)
+
+def job_temp_dir(job_id):
+    # Absolute, because yt-dlp resolves a relative temp path against paths['home']
+    return os.path.abspath(os.path.join(DOWNLOAD_DIR, '.partial', job_id))
+
+def check_disk_space(url, format_id, section=None):
+    """Refuse a download that can never fit on disk, if its metadata is already cached"""
+    info = info_cache.get(url)
+    if info is None:
+        # The worker checks once it has extracted the metadata
+        return
+    # yt-dlp's format selection is too slow for the request; the worker checks its exact result again
+    resolved = FormatIndex(info).resolve(get_ydl_opts(format_id)['format'])
+    if resolved is None:
+        return
+    fraction = section_fraction(info, *resolve_section(info, section)) if section else 1.0
+    disk_quota.check(int(estimate_peak_bytes(resolved, plan_postprocessors(resolved), DISK_UNKNOWN_SIZE) * fraction))
+
+def queue_download(url, format_id, concurrent_fragments=FRAGMENT_CONCURRENCY, priority=None, job_id=None,
+                   section=None, forget_on_full=True):
+    """Queue a download job, attaching to an identical one already in flight"""
+    # Journal the job before a worker can pick it up so a crash never loses it
+    job_id = job_id or uuid.uuid4().hex
+    job_journal.record(job_id, {'url': url, 'format_id': format_id, 'concurrent_fragments': concurrent_fragments,
+                                'priority': priority, 'section': section})
+    try:
+        key = (video_key(url), format_id, json.dumps(section, sort_keys=True))
+        job, created = download_queue.submit_unique(key, run_download, url, format_id, concurrent_fragments,
+                                                    job_id=job_id, priority=priority, section=section)
+    except QueueFullError:
+        # A resumed job keeps its journal row and partial files for the next start
+        if forget_on_full:
+            job_journal.forget(job_id)
+        raise
+    if not created:
+        job_journal.forget(job_id)
+    progress_registry.track(job.id)
+    return job, created
+
+def resume_unfinished_jobs():
+    """Requeue jobs a previous run journaled but never finished"""
+    for job_id, args in job_journal.unfinished():
+        logger.info(f"Resuming download job {job_id}")
+        try:
+            queue_download(job_id=job_id, forget_on_full=False, **args)
+        except QueueFullError:
+            logger.warning(f"Download queue is full; job {job_id} stays journaled for the next start")
+        except Exception as e:
+            # A row this app cannot queue, e.g. one journaled with arguments it no longer takes
+            logger.error(f"Could not resume download job {job_id}: {str(e)}")
+
 @app.route('/api/download', methods=['POST'])
 def download():
     url = request.json.get('url')
@@ -156,20 +305,262 @@ def download():
 
     if not url:
         return jsonify({'error': 'URL is required'}), 400
+    try:
+        concurrent_fragments = int(request.json.get('concurrent_fragments') or FRAGMENT_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrent_fragments = 0
+    if not 1 <= concurrent_fragments <= MAX_FRAGMENT_CONCURRENCY:
+        return jsonify({'error': f'concurrent_fragments must be between 1 and {MAX_FRAGMENT_CONCURRENCY}'}), 400
+    priority = request.json.get('priority') or 'interactive'
+    if priority not in PRIORITY_WEIGHTS:
+        return jsonify({'error': f'priority must be one of {", ".join(PRIORITY_WEIGHTS)}'}), 400
+    # Optional start/end times or chapter titles; only that part of the video is fetched
+    try:
+        section = requested_section(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        progress_hook = ProgressHook()
-        with YoutubeDL(get_ydl_opts(format_id, progress_hook)) as ydl:
-            ydl.download([url])
-        return jsonify({'success': True, 'message': 'Download completed successfully'})
+        check_disk_space(url, format_id, section)
+    except InsufficientSpaceError as e:
+        return jsonify({'error': str(e)}), 507
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-@app.route('/api/progress')
-def get_progress():
+    try:
+        job, created = queue_download(url, format_id, concurrent_fragments, priority, section=section)
+    except QueueFullError:
+        response = jsonify({'error': 'Too many downloads in progress, please retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    return jsonify({'success': True, 'job_id': job.id, 'message': 'Download queued', 'deduplicated': not created}), 202
+
+@app.route('/api/batch', methods=['POST'])
+def batch_download():
+    data = request.get_json()
+    if not data or not (data.get('urls') or data.get('url')):
+        return jsonify({'error': 'A list of urls or a playlist url is required'}), 400
+    urls = data.get('urls')
+    if urls is not None and (not isinstance(urls, list) or not all(isinstance(u, str) for u in urls)):
+        return jsonify({'error': 'urls must be a list of strings'}), 400
+    format_id = data.get('format_id')
+    # Batches default to bulk so a large playlist does not hold up interactive downloads
+    priority = data.get('priority') or 'bulk'
+    if priority not in PRIORITY_WEIGHTS:
+        return jsonify({'error': f'priority must be one of {", ".join(PRIORITY_WEIGHTS)}'}), 400
+
+    def ingest(entry_url):
+        try:
+            # Warms the info cache, so the job skips extraction when it runs
+            info = extract_info(entry_url)
+            check_disk_space(entry_url, format_id)
+            job, created = queue_download(entry_url, format_id, priority=priority)
+            return {'url': entry_url, 'title': info.get('title'), 'job_id': job.id, 'deduplicated': not created}
+        except QueueFullError:
+            return {'url': entry_url, 'error': 'Download queue is full'}
+        except Exception as e:
+            return {'url': entry_url, 'error': str(e)}
+
+    def generate():
+        # Playlists are enumerated lazily, so the first results go out before the last page is fetched
+        entries = urls if urls is not None else playlist_entry_urls(data['url'], ydl_pool)
+        try:
+            for result in map_unordered(ingest, itertools.islice(entries, BATCH_MAX_ENTRIES), BATCH_WORKERS):
+                yield json.dumps(result) + '\n'
+        except Exception as e:
+            yield json.dumps({'url': data.get('url'), 'error': str(e)}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/config')
+def get_config():
+    return jsonify({
+        'download_workers': DOWNLOAD_WORKERS,
+        'download_queue_size': DOWNLOAD_QUEUE_SIZE,
+        'fragment_concurrency': FRAGMENT_CONCURRENCY,
+        'max_fragment_concurrency': MAX_FRAGMENT_CONCURRENCY,
+        'max_connections': MAX_CONNECTIONS,
+        'http_chunk_size': HTTP_CHUNK_SIZE,
+        'max_bandwidth': MAX_BANDWIDTH,
+        'ffmpeg_workers': FFMPEG_WORKERS,
+        'priorities': PRIORITY_WEIGHTS,
+        'disk_quota': DISK_QUOTA,
+    })
+
+@app.route('/api/stats')
+def get_stats():
+    return jsonify({
+        'download_queue': download_queue.stats(),
+        'info_cache': info_cache.stats(),
+        'download_store': download_store.stats(),
+        'connections': connection_budget.stats(),
+        'bandwidth': bandwidth_scheduler.stats(),
+        'disk': disk_quota.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/files/<job_id>')
+def get_file(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status != 'finished':
+        return jsonify({'error': f"Job is {job.status}"}), 409
+    # Werkzeug answers Range and conditional requests itself and hands the open
+    # file to wsgi.file_wrapper, so the server can use sendfile instead of Python reads
+    return send_from_directory(os.path.abspath(DOWNLOAD_DIR), job.result['filename'],
+                               as_attachment=True, max_age=FILE_MAX_AGE)
+
+@app.route('/api/stream')
+def stream_video():
+    # Pipe the selected format straight to the client without staging it on disk
+    url = request.args.get('url')
+    format_id = request.args.get('format_id') or 'best'
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+
+    try:
+        resolved = resolve_format(extract_info(url), format_id, ydl_pool)
+        chunks, mimetype, filename, length = open_stream(resolved, ffmpeg_bootstrap.location)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    headers = {'Content-Disposition': content_disposition(filename)}
+    if length:
+        headers['Content-Length'] = str(length)
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+@download_queue.task
+def run_download(job, url, format_id, concurrent_fragments=FRAGMENT_CONCURRENCY, section=None):
+    """Download a video on a worker thread"""
+    record = progress_registry.track(job.id)
+    job_journal.mark(job.id, 'running')
+    temp_dir = job_temp_dir(job.id)
+    timer = PhaseTimer(job_phase_seconds)
+    timer.add('queue', job.started_at - job.created_at)
+    meter = ByteMeter(downloaded_bytes)
+    try:
+        # Reuse the metadata fetched by /api/formats instead of extracting again
+        with timer.phase('extract'):
+            info = extract_info(url)
+        opts = get_ydl_opts(format_id, ProgressHook(record))
+        opts['progress_hooks'].append(meter)
+
+        with timer.phase('plan'):
+            # Stream-copy when the selected codecs already fit in mp4; only re-encode when they don't
+            resolved = resolve_format(info, opts['format'], ydl_pool)
+            plan = plan_postprocessors(resolved)
+            opts['postprocessors'] = plan['postprocessors']
+            opts['merge_output_format'] = plan['merge_output_format']
+            # A clip covers start..end seconds; None means the whole video
+            span = resolve_section(info, section) if section else None
+            # Only jobs that merge, convert or cut a clip have to wait for FFmpeg
+            opts['ffmpeg_location'] = ffmpeg_bootstrap.location(wait=plan['needs_ffmpeg'] or span is not None)
+
+            # Serve the file from the store if these formats were processed the same way before
+            key = store_key(info.get('extractor_key'), info.get('id'), resolved.get('format_id'),
+                            opts['postprocessors'], span)
+            path = download_store.lookup(key)
+        cached = path is not None
+        if not cached:
+            # Partial files go to a per-job directory that survives restarts so resumed jobs continue
+            opts['outtmpl'] = f'%(title)s_{key[:10]}.%(ext)s'
+            opts['paths'] = {'home': DOWNLOAD_DIR, 'temp': temp_dir}
+            opts['continuedl'] = True
+            if span:
+                # ffmpeg fetches only the fragments or byte ranges covering the clip
+                opts.update(section_options(*span))
+
+            def wait_for_disk():
+                record.status = 'waiting_for_disk'
+                record.publish()
+
+            # Hold the download's estimated peak disk use until its file is in place
+            with timer.phase('disk_wait'):
+                peak_bytes = estimate_peak_bytes(resolved, plan, DISK_UNKNOWN_SIZE)
+                if span:
+                    peak_bytes = int(peak_bytes * section_fraction(info, *span))
+                disk_quota.acquire(job.id, peak_bytes, timeout=DISK_WAIT, on_wait=wait_for_disk)
+            # Bandwidth share follows the job's priority; ffmpeg waits for a free postprocess slot
+            shaper = bandwidth_scheduler.attach(job.priority)
+            ffmpeg_gate = postprocess_pool.gate()
+            opts['progress_hooks'].append(shaper.hook)
+            # The timer hook runs first so waiting for an ffmpeg slot counts as postprocessing
+            opts['postprocessor_hooks'] = [timer.postprocessor_hook, ffmpeg_gate.hook]
+            try:
+                # Fragment parallelism comes out of the global connection budget
+                # Section downloads look for ffmpeg without reading the options, so point them at ours too
+                with connection_budget.reserve(concurrent_fragments) as granted, ffmpeg_context(opts['ffmpeg_location']):
+                    opts['concurrent_fragment_downloads'] = granted
+                    # The shaper lets go of the instance's options before it goes back to the pool
+                    with ydl_pool.checkout(opts) as ydl, shaper.bound(ydl.params):
+                        with timer.phase('download'):
+                            result = ydl.process_ie_result(selectable(info), download=True)
+            finally:
+                shaper.close()
+                ffmpeg_gate.release()
+                meter.flush()
+                disk_quota.release(job.id)
+            path = downloaded_path(result)
+            with timer.phase('store'):
+                download_store.add(key, path)
+    except Exception as e:
+        job_journal.mark(job.id, 'error', str(e))
+        progress_registry.finish(job.id, error=str(e))
+        timer.observe()
+        jobs_total.inc(outcome='error')
+        raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    job_journal.mark(job.id, 'finished')
+    record.filename = path
+    progress_registry.finish(job.id)
+    timer.observe()
+    jobs_total.inc(outcome='cached' if cached else 'finished')
+    if timer.durations.get('download'):
+        download_throughput.observe(meter.total / timer.durations['download'])
+    return {'filename': os.path.basename(path), 'cached': cached, 'postprocess': 'none' if cached else plan['path'],
+            'section': span}
+
+@app.route('/api/progress/<job_id>')
+def get_progress(job_id):
     # This endpoint will be polled by the frontend to get download progress
-    progress_hook = ProgressHook()
-    return jsonify(progress_hook.progress)
+    record = progress_registry.get(job_id)
+    if record is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(record.to_dict())
+
+@app.route('/api/progress/<job_id>/stream')
+def stream_job_progress(job_id):
+    # Push progress deltas to the browser instead of having it poll
+    if progress_registry.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    events = stream_progress(progress_registry, job_id, max_rate=PROGRESS_STREAM_RATE)
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+# Under the debug reloader this module also runs in the watcher process; only the serving process resumes jobs
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    if ROLE in ('all', 'worker'):
+        download_queue.start()
+        disk_quota.start()
+        # A shared backend keeps its queue across restarts; in-process state relies on the journal
+        if state_backend is None:
+            resume_unfinished_jobs()
 
 if __name__ == '__main__':
     app.run(debug=True)